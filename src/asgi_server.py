@@ -0,0 +1,148 @@
+"""
+ASGI variant of the WhatsApp webhook.
+
+Run with: uvicorn asgi_server:app --host 0.0.0.0 --port 5000
+
+Every I/O call on the request path (TMDb, MongoDB, OpenAI, Twilio) is awaited,
+so a single event-loop process keeps many conversations in flight.
+"""
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qsl
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+from twilio.request_validator import RequestValidator
+from twilio.twiml.messaging_response import MessagingResponse
+
+from services.container import get_container, current_container, reset_container
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BUSY_MESSAGE = "We're handling a lot of messages right now. Please try again in a minute."
+ERROR_MESSAGE = "Sorry, I encountered an error. Please try again."
+
+# Background replies in flight when REPLY_MODE=async
+_pending_replies = set()
+
+
+def _twiml(text: str = None) -> Response:
+    resp = MessagingResponse()
+    if text:
+        resp.message(text)
+    return Response(str(resp), media_type="application/xml")
+
+
+def _is_valid_twilio_request(request: Request, form: dict) -> bool:
+    """Check the X-Twilio-Signature header when TWILIO_VALIDATE_REQUESTS is enabled"""
+    if os.getenv('TWILIO_VALIDATE_REQUESTS', 'false').lower() != 'true':
+        return True
+    validator = RequestValidator(os.getenv('TWILIO_AUTH_TOKEN', ''))
+    signature = request.headers.get('X-Twilio-Signature', '')
+    return validator.validate(str(request.url), form, signature)
+
+
+async def _reply_later(container, message: str, sender: str) -> None:
+    """Process a message in the background and deliver the answer via the Twilio API"""
+    try:
+        response_text, _ = await container.message_handler.handle_message_async(message, sender)
+        await container.async_services['whatsapp'].send_message(sender.replace('whatsapp:', ''), response_text)
+    except Exception as e:
+        logger.error(f"Error processing background reply for {sender}: {str(e)}", exc_info=True)
+
+
+async def webhook(request: Request) -> Response:
+    if request.method == 'GET':
+        return PlainTextResponse("Webhook endpoint working!")
+
+    # Twilio posts application/x-www-form-urlencoded bodies
+    form = dict(parse_qsl((await request.body()).decode('utf-8'), keep_blank_values=True))
+    if not _is_valid_twilio_request(request, form):
+        logger.warning("Rejected webhook request with an invalid Twilio signature")
+        return PlainTextResponse("Invalid signature", status_code=403)
+
+    incoming_msg = form.get('Body', '').strip()
+    sender = form.get('From', '').strip()
+    logger.info(f"Processing message: '{incoming_msg}' from {sender}")
+
+    container = get_container()
+    try:
+        if os.getenv('REPLY_MODE', 'sync').lower() == 'async':
+            # Acknowledge now and answer through the Twilio REST API
+            if len(_pending_replies) >= int(os.getenv('REPLY_QUEUE_SIZE', '100')):
+                return _twiml(BUSY_MESSAGE)
+            task = asyncio.create_task(_reply_later(container, incoming_msg, sender))
+            _pending_replies.add(task)
+            task.add_done_callback(_pending_replies.discard)
+            return _twiml()
+
+        response_text, success = await container.message_handler.handle_message_async(incoming_msg, sender)
+        logger.info(f"Handler response: {response_text} (success: {success})")
+        return _twiml(response_text)
+
+    except Exception as e:
+        logger.error(f"Error processing webhook: {str(e)}", exc_info=True)
+        return _twiml(ERROR_MESSAGE)
+
+
+async def ready(request: Request) -> Response:
+    """Readiness probe: healthy only once models and connection pools are warm"""
+    container = current_container()
+    if container is None:
+        return JSONResponse({'ready': False}, status_code=503)
+    return JSONResponse(container.health(), status_code=200 if container.ready else 503)
+
+
+async def metrics(request: Request) -> Response:
+    container = current_container()
+    data = container.metrics() if container is not None else {}
+    data['pending_replies'] = len(_pending_replies)
+    return JSONResponse(data)
+
+
+async def invalidate_movie(request: Request) -> Response:
+    """Drop a movie from the TMDb cache tiers (requires the X-Admin-Token header)"""
+    admin_token = os.getenv('ADMIN_TOKEN')
+    if not admin_token or request.headers.get('X-Admin-Token') != admin_token:
+        return PlainTextResponse("Forbidden", status_code=403)
+    movie_id = request.path_params['movie_id']
+    removed = await asyncio.to_thread(get_container().tmdb_service.invalidate_movie, movie_id)
+    return JSONResponse({'movie_id': movie_id, 'removed': removed})
+
+
+async def home(request: Request) -> Response:
+    return PlainTextResponse("WhatsApp webhook server is running!")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # spaCy loading and the Mongo ping block, so warm up off the event loop
+    container = await asyncio.to_thread(get_container, False)
+    if not await asyncio.to_thread(container.warm_up):
+        container.warm_up_in_background()
+    await container.start_async()
+    logger.info("ASGI server ready")
+    try:
+        yield
+    finally:
+        if _pending_replies:
+            await asyncio.gather(*_pending_replies, return_exceptions=True)
+        await container.shutdown_async()
+        reset_container()
+
+
+app = Starlette(
+    routes=[
+        Route("/webhook", webhook, methods=['GET', 'POST']),
+        Route("/ready", ready, methods=['GET']),
+        Route("/metrics", metrics, methods=['GET']),
+        Route("/admin/cache/invalidate/{movie_id:int}", invalidate_movie, methods=['POST']),
+        Route("/", home, methods=['GET']),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+Benchmark intent detection on the labelled corpus in data/intent_corpus.jsonl.
+
+Compares the previous regex cascade (full spaCy parse on every message, then
+uncompiled patterns in dict order) with NLPService's compiled IntentEngine,
+which only parses messages that fall through to the NER fallback, the local
+intent classifier on its own, and NLPService.analyze (rules, then classifier,
+gazetteer and NER together). Classifier rows are cross-validated: each message
+is scored by a model trained without it. The hybrid routing line shows how much
+of the corpus OPENAI_ROUTING=hybrid would answer without OpenAI.
+
+With --openai and OPENAI_API_KEY set, the first --openai-limit messages are
+also sent through OpenAIService.process_message (one chat completion each).
+
+Usage:
+    python benchmark_intents.py [--corpus data/intent_corpus.jsonl] [--repeat 20] [--folds 5]
+                                [--openai] [--openai-limit 20]
+
+Without en_core_web_sm installed, a blank spaCy pipeline is used: parse costs
+are understated and the NER fallback finds nothing.
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+
+import spacy
+
+from services.intent_classifier import IntentClassifier
+from services.hybrid_router import HybridRouter
+from services.intent_engine import IntentEngine
+from services.nlp_service import NLPService
+
+# The cascade NLPService used before IntentEngine, kept here for comparison
+LEGACY_PATTERNS = {
+    'get_info': [
+        r'(?:about|info|information|tell me about|what do you know about|details on|score of|rating of|how good is)\s+(.+)',
+        r'(?:how is|how was|is|was)\s+(.+)(?:\s+any good|\s+worth watching|\s+good)?',
+        r'(?:what is|what\'s)\s+(.+)(?:\s+about|\s+like)?',
+        r'(.+)(?:\s+worth watching|\s+any good|\s+recommended)?'
+    ],
+    'mark_watched': [
+        r'(?:i (?:have )?(?:just |recently )?(?:watched|seen)|i\'ve (?:just |recently )?(?:watched|seen)|seen|watched|completed|finished)\s+(.+)',
+        r'(?:i (?:have )?finished|i\'ve finished|done with|completed)\s+(.+)',
+        r'(?:add|mark|put)\s+(.+)(?:\s+as watched|\s+to my watched list|\s+to watched list)'
+    ],
+    'help': [
+        r'(?:help|assist|support|how to use|instructions|commands|what can you do|how does this work)'
+    ],
+    'list_watched': [
+        r'(?:list|show|what are|what have i|which) (?:movies have i watched|movies i\'ve watched|my watched movies|my watched list|watched movies)'
+    ]
+}
+
+
+def load_nlp():
+    try:
+        return spacy.load('en_core_web_sm'), True
+    except OSError:
+        return spacy.blank('en'), False
+
+
+def extract_title(service, doc):
+    try:
+        return service._extract_potential_movie_title(doc)
+    except ValueError:
+        # Blank pipelines have no parser for noun chunks
+        return None
+
+
+def legacy_process(service, message):
+    clean_message = message.lower().strip()
+    doc = service.nlp(clean_message)
+    for intent, patterns in LEGACY_PATTERNS.items():
+        for pattern in patterns:
+            match = re.search(pattern, clean_message)
+            if match:
+                return intent, (match.group(1).strip() if match.groups() else None)
+    title = extract_title(service, doc)
+    return ('get_info', title) if title else ('unknown', None)
+
+
+def engine_process(service, message):
+    clean_message = message.lower().strip()
+    matched = service.intent_engine.match(clean_message)
+    if matched:
+        return matched
+    title = extract_title(service, service.nlp(clean_message))
+    return ('get_info', title) if title else ('unknown', None)
+
+
+def classifier_process(service, message):
+    intent, _ = service.classifier.predict(message.lower().strip())
+    return intent, None
+
+
+def analyze_process(service, message):
+    try:
+        return service.analyze(message)[:2]
+    except ValueError:
+        # Blank pipelines have no parser for noun chunks
+        return 'unknown', None
+
+
+def train_folds(corpus, folds):
+    """Classifier per fold, trained on the other folds"""
+    models = []
+    for fold in range(folds):
+        train = [row for i, row in enumerate(corpus) if i % folds != fold]
+        models.append(IntentClassifier.train([row['text'] for row in train], [row['intent'] for row in train]))
+    return models
+
+
+def evaluate(label, process, service, corpus, repeat, fold_models=None, titles_scored=True):
+    intents = titles = 0
+    for i, row in enumerate(corpus):
+        if fold_models:
+            service.classifier = fold_models[i % len(fold_models)]
+        intent, title = process(service, row['text'])
+        intents += intent == row['intent']
+        titles += intent == row['intent'] and title == row['title']
+
+    # Timed with the model trained on the whole corpus
+    if fold_models:
+        service.classifier = service.full_classifier
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for row in corpus:
+            process(service, row['text'])
+    per_message = (time.perf_counter() - started) / (repeat * len(corpus)) * 1e6
+
+    title_column = f"{titles / len(corpus):6.1%}" if titles_scored else f"{'-':>6}"
+    print(f"{label:<16} intent {intents / len(corpus):6.1%}  intent+title {title_column}  "
+          f"{per_message:9.1f} us/message")
+
+
+def report_routing(service, corpus):
+    """Share of the corpus OPENAI_ROUTING=hybrid would answer locally, and how often correctly"""
+    router = HybridRouter(service, min_confidence=float(os.getenv('HYBRID_MIN_CONFIDENCE', '0.8')),
+                          max_words=int(os.getenv('HYBRID_MAX_WORDS', '12')))
+    local = correct = 0
+    for row in corpus:
+        decision = router.route(row['text'])
+        if decision.route == 'local':
+            local += 1
+            correct += decision.analysis[:2] == (row['intent'], row['title'])
+    routes = ", ".join(f"{name} {count}" for name, count in sorted(router.counters.snapshot().items())
+                       if not name.startswith('intent.'))
+    print(f"hybrid routing   {local}/{len(corpus)} local ({correct} with the labelled intent and title), "
+          f"{router.metrics()['llm_calls_avoided']} LLM calls avoided  [{routes}]")
+
+
+def evaluate_openai(corpus, limit):
+    from services.openai_service import OpenAIService
+
+    service = OpenAIService()
+    rows = corpus[:limit]
+    intents = titles = 0
+    started = time.perf_counter()
+    for row in rows:
+        # No history, so every message is classified on its own
+        service.clear_history('benchmark')
+        intent, title, _ = service.process_message(row['text'], 'benchmark')
+        intents += intent == row['intent']
+        titles += intent == row['intent'] and (title or '').lower() == (row['title'] or '').lower()
+    per_message = (time.perf_counter() - started) / len(rows) * 1e6
+    service.clear_history('benchmark')
+    print(f"{'openai':<16} intent {intents / len(rows):6.1%}  intent+title {titles / len(rows):6.1%}  "
+          f"{per_message:9.1f} us/message  ({len(rows)} messages)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark intent detection")
+    parser.add_argument('--corpus', default='data/intent_corpus.jsonl')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--folds', type=int, default=5, help="Cross-validation folds for the classifier")
+    parser.add_argument('--openai', action='store_true', help="Also benchmark OpenAIService (needs OPENAI_API_KEY)")
+    parser.add_argument('--openai-limit', type=int, default=20, help="Messages sent to OpenAI")
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding='utf-8') as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    # Built without __init__ so the benchmark can run on a blank pipeline
+    service = NLPService.__new__(NLPService)
+    service.nlp, full_model = load_nlp()
+    service.intent_engine = IntentEngine()
+    service.gazetteer = None
+    service.title_confidence = 0.8
+    service.model_confidence = float(os.getenv('INTENT_MODEL_MIN_CONFIDENCE', '0.7'))
+    service.full_classifier = IntentClassifier.train([row['text'] for row in corpus],
+                                                     [row['intent'] for row in corpus])
+    service.classifier = service.full_classifier
+    if not full_model:
+        print("en_core_web_sm not installed: using a blank pipeline (NER fallback disabled)")
+
+    print(f"{len(corpus)} labelled messages, {args.repeat} timed passes")
+    evaluate("legacy cascade", legacy_process, service, corpus, args.repeat)
+    evaluate("intent engine", engine_process, service, corpus, args.repeat)
+
+    fold_models = train_folds(corpus, args.folds)
+    evaluate("classifier", classifier_process, service, corpus, args.repeat, fold_models, titles_scored=False)
+    evaluate("nlp analyze", analyze_process, service, corpus, args.repeat, fold_models)
+    report_routing(service, corpus)
+
+    if not args.openai:
+        print("openai           skipped (pass --openai)")
+    elif not os.getenv('OPENAI_API_KEY'):
+        print("openai           skipped (OPENAI_API_KEY not set)")
+    else:
+        evaluate_openai(corpus, args.openai_limit)
+
+
+if __name__ == "__main__":
+    main()
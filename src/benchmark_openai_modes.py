@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""
+Benchmark the two OpenAI flows against a local fake-OpenAI server.
+
+Compares OPENAI_MODE=two_call (intent extraction, then response generation)
+with OPENAI_MODE=tools (one conversation in which the model calls the movie
+tools), with the answer written by the model or rendered from the templates
+(OPENAI_TOOL_REPLY=template). Messages come from data/intent_corpus.jsonl;
+reported per message: chat completion round-trips, prompt and completion
+tokens, and end-to-end latency.
+
+The stub answers like a well-behaved model: it recognises intents with the
+local IntentEngine, charges tokens at roughly four characters each, and
+sleeps --latency seconds per request plus --token-latency per completion
+token. TMDb and MongoDB are replaced by in-memory fakes, so only the OpenAI
+flow is measured.
+
+With --turns, the messages are also replayed as one user's conversation to
+show that the prompt size per message levels off as history grows.
+
+Usage:
+    python benchmark_openai_modes.py [--messages 40] [--latency 0.3] [--token-latency 0.004] [--turns 40]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from services.history_store import estimate_tokens
+from services.intent_engine import IntentEngine
+from services.openai_service import OpenAIService
+from services.tmdb_service import TMDbService
+
+ENGINE = IntentEngine()
+
+MOVIE = {'id': 27205, 'title': 'Inception', 'release_date': '2010-07-15', 'vote_average': 8.4,
+         'overview': "A thief who steals corporate secrets through dream-sharing technology is given "
+                     "the inverse task of planting an idea into the mind of a C.E.O."}
+SIMILAR = [{'id': 1000 + i, 'title': f"Similar Movie {i}", 'vote_average': 7.6 + i / 10} for i in range(5)]
+
+
+class FakeTMDb:
+    format_movie_info = TMDbService.format_movie_info
+
+    def search_movie(self, title, user_id=None):
+        return dict(MOVIE, title=title.title()), "ok"
+
+    def get_movie_details(self, movie_id):
+        return MOVIE, "ok"
+
+    def get_similar_movies(self, movie_id, min_score=0.0):
+        return [m for m in SIMILAR if m['vote_average'] >= min_score], "ok"
+
+
+class FakeDatabase:
+    def is_movie_watched(self, user_id, movie_id):
+        return False
+
+    def add_watched_movie(self, user_id, movie_id, movie=None):
+        return True
+
+    def get_watched_ids(self, user_id, movie_ids):
+        return set()
+
+    def get_watched_page(self, user_id, limit=10, cursor=None):
+        return [dict(m, watched_at=None) for m in SIMILAR[:3]], None
+
+    def count_watched(self, user_id):
+        return 3
+
+
+class StubState:
+    def __init__(self, latency, token_latency):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+def stub_reply(body):
+    """Content or tool calls a capable model would return for the request"""
+    messages = body['messages']
+    last = messages[-1]
+    user_text = next(m['content'] for m in reversed(messages) if m['role'] == 'user')
+    matched = ENGINE.match(user_text.lower().strip()) or ('unknown', None)
+
+    if 'tools' in body:
+        if last['role'] == 'tool' or body.get('tool_choice') == 'none' or matched[0] in ('help', 'unknown'):
+            data = last['content'] if last['role'] == 'tool' else ''
+            return {'role': 'assistant', 'content': f"Here is what I found for you. {data[:200]}"}
+        name = {'get_info': 'get_movie_info'}.get(matched[0], matched[0])
+        arguments = json.dumps({'title': matched[1]} if matched[1] else {})
+        return {'role': 'assistant', 'content': None, 'tool_calls': [{
+            'id': f"call_{uuid.uuid4().hex[:12]}", 'type': 'function',
+            'function': {'name': name, 'arguments': arguments}}]}
+
+    if 'Extract the intent' in messages[0]['content']:
+        return {'role': 'assistant', 'content': json.dumps({
+            'intent': matched[0], 'movie_title': matched[1],
+            'context': {'additional_info': '', 'sentiment': 'neutral', 'confidence': 0.9}})}
+
+    prompt = last['content']
+    return {'role': 'assistant', 'content': f"Sure! {prompt[:200]} Let me know if you want more suggestions."}
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            reply = stub_reply(body)
+            prompt_tokens = estimate_tokens(json.dumps(body['messages']) + json.dumps(body.get('tools', [])))
+            completion_tokens = estimate_tokens(reply.get('content') or json.dumps(reply.get('tool_calls')))
+            with state.lock:
+                state.requests += 1
+            time.sleep(state.latency + completion_tokens * state.token_latency)
+
+            payload = json.dumps({
+                'id': f"chatcmpl-{uuid.uuid4().hex[:12]}", 'object': 'chat.completion',
+                'created': int(time.time()), 'model': body['model'],
+                'choices': [{'index': 0, 'message': reply,
+                             'finish_reason': 'tool_calls' if reply.get('tool_calls') else 'stop'}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                          'total_tokens': prompt_tokens + completion_tokens},
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def run_mode(label, mode, messages, state, tool_reply='model'):
+    # Imported here so the OpenAI client picks up the stub's base URL
+    from services.message_handler import MessageHandler
+
+    openai_service = OpenAIService(mode=mode)
+    openai_service.tool_reply = tool_reply
+    container = SimpleNamespace(tmdb_service=FakeTMDb(), db_service=FakeDatabase(), whatsapp_service=None,
+                                openai_service=openai_service,
+                                nlp_service=SimpleNamespace(spot_title=lambda text, slot=False: None))
+    handler = MessageHandler(container=container)
+
+    requests_before = state.requests
+    latencies = []
+    for i, message in enumerate(messages):
+        started = time.perf_counter()
+        handler.handle_message(message, f"benchmark-{mode}-{i}")
+        latencies.append(time.perf_counter() - started)
+    handler.executor.shutdown()
+
+    usage = openai_service.usage.snapshot()
+    print(f"{label:<16} {(state.requests - requests_before) / len(messages):6.2f} round-trips  "
+          f"{usage.get('prompt_tokens', 0) / len(messages):7.0f} prompt tok  "
+          f"{usage.get('completion_tokens', 0) / len(messages):6.0f} completion tok  "
+          f"p50 {statistics.median(latencies) * 1000:6.0f} ms  avg {statistics.mean(latencies) * 1000:6.0f} ms")
+
+
+def run_conversation(mode, messages, turns):
+    """Prompt tokens per message as one user's conversation grows"""
+    from services.message_handler import MessageHandler
+
+    openai_service = OpenAIService(mode=mode)
+    container = SimpleNamespace(tmdb_service=FakeTMDb(), db_service=FakeDatabase(), whatsapp_service=None,
+                                openai_service=openai_service,
+                                nlp_service=SimpleNamespace(spot_title=lambda text, slot=False: None))
+    handler = MessageHandler(container=container)
+
+    per_turn = []
+    for turn in range(turns):
+        before = openai_service.usage.get('prompt_tokens')
+        handler.handle_message(messages[turn % len(messages)], "benchmark-conversation")
+        per_turn.append(openai_service.usage.get('prompt_tokens') - before)
+    handler.executor.shutdown()
+
+    checkpoints = sorted({1, turns // 4, turns // 2, turns} - {0})
+    print(f"{mode:<16} prompt tokens at turn " +
+          ", ".join(f"{turn}: {per_turn[turn - 1]}" for turn in checkpoints))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the two-call and tool-calling OpenAI flows")
+    parser.add_argument('--corpus', default='data/intent_corpus.jsonl')
+    parser.add_argument('--messages', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0.3, help="Seconds per request")
+    parser.add_argument('--token-latency', type=float, default=0.004, help="Seconds per completion token")
+    parser.add_argument('--turns', type=int, default=0,
+                        help="Also replay this many messages as one long conversation")
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding='utf-8') as f:
+        corpus = [json.loads(line)['text'] for line in f if line.strip()]
+    # Spread over the corpus so every intent is represented
+    step = max(1, len(corpus) // args.messages)
+    messages = corpus[::step][:args.messages]
+
+    state = StubState(args.latency, args.token_latency)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['OPENAI_BASE_URL'] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ['OPENAI_API_KEY'] = 'stub'
+    os.environ['OPENAI_ROUTING'] = 'always'
+    # Compare the flows themselves, not the reply cache
+    os.environ['OPENAI_RESPONSE_CACHE'] = 'false'
+
+    print(f"{len(messages)} messages, {args.latency * 1000:.0f} ms per request + "
+          f"{args.token_latency * 1000:.1f} ms per completion token")
+    try:
+        run_mode("two_call", 'two_call', messages, state)
+        run_mode("tools", 'tools', messages, state)
+        run_mode("tools+template", 'tools', messages, state, tool_reply='template')
+        if args.turns:
+            print(f"One conversation of {args.turns} messages:")
+            for mode in ('two_call', 'tools'):
+                run_conversation(mode, messages, args.turns)
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
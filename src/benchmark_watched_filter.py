@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Benchmark filtering recommendations against a user's watched movies.
+
+Compares the old per-movie is_movie_watched loop with the batched
+get_watched_ids call, counting the commands actually sent to MongoDB.
+
+Usage:
+    python benchmark_watched_filter.py [--history 2000] [--candidates 20] [--rounds 20]
+
+Needs MONGODB_URI. Writes to a throwaway user id and removes it afterwards.
+"""
+
+import argparse
+import statistics
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+from pymongo import monitoring
+
+load_dotenv()
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts the find/aggregate/count commands the driver sends"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name in ('find', 'aggregate', 'count', 'getMore'):
+            with self._lock:
+                self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def take(self) -> int:
+        with self._lock:
+            count, self.count = self.count, 0
+        return count
+
+
+def run(label, func, counter, rounds):
+    counter.take()
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        unwatched = func()
+        timings.append((time.perf_counter() - started) * 1000)
+    round_trips = counter.take() / rounds
+    print(f"{label:<22} {round_trips:>6.1f} round-trips  "
+          f"p50 {statistics.median(timings):>7.2f} ms  max {max(timings):>7.2f} ms  "
+          f"({len(unwatched)} unwatched)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark watched-movie filtering")
+    parser.add_argument('--history', type=int, default=2000, help="Movies in the user's history")
+    parser.add_argument('--candidates', type=int, default=20, help="Similar movies to filter")
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    # Must be registered before the client is created
+    counter = CommandCounter()
+    monitoring.register(counter)
+    from services.db_service import DatabaseService
+
+    db_service = DatabaseService()
+    user_id = f"benchmark-{uuid.uuid4().hex}"
+    try:
+        db_service.ensure_indexes()
+        print(f"Seeding {args.history} watched movies for {user_id}")
+        for movie_id in range(args.history):
+            db_service.add_watched_movie(user_id, movie_id, {'title': f"Movie {movie_id}"})
+
+        # Half of the candidates are already watched
+        half = args.candidates // 2
+        candidates = [{'id': movie_id} for movie_id in
+                      list(range(half)) + list(range(args.history, args.history + args.candidates - half))]
+
+        def per_movie():
+            return [m for m in candidates if not db_service.is_movie_watched(user_id, m['id'])]
+
+        def batched():
+            watched = db_service.get_watched_ids(user_id, [m['id'] for m in candidates])
+            return [m for m in candidates if m['id'] not in watched]
+
+        run("is_movie_watched loop", per_movie, counter, args.rounds)
+        run("get_watched_ids", batched, counter, args.rounds)
+    finally:
+        db_service.watched.delete_many({'user_id': user_id})
+        db_service.close()
+
+
+if __name__ == "__main__":
+    main()
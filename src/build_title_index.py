@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Build the local TMDb title index from TMDb's daily movie ID export.
+
+Usage:
+    python build_title_index.py [--source PATH_OR_URL] [--output PATH] [--fuzzy-min-popularity 1.0]
+
+Without --source, the most recent export (yesterday's, in UTC) is streamed from
+files.tmdb.org. The output defaults to TMDB_TITLE_INDEX. Run it from cron; the
+new index is moved into place atomically and running servers reopen it on
+their next refresh check.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.request import urlopen
+
+from dotenv import load_dotenv
+from services.title_index import build_index
+
+load_dotenv()
+
+EXPORT_URL = "http://files.tmdb.org/p/exports/movie_ids_{date}.json.gz"
+
+
+def default_source() -> str:
+    yesterday = datetime.now(timezone.utc) - timedelta(days=1)
+    return EXPORT_URL.format(date=yesterday.strftime('%m_%d_%Y'))
+
+
+def stream_records(source: str):
+    """Yield one JSON record per line from a gzip export, read as a stream"""
+    raw = urlopen(source) if source.startswith(('http://', 'https://')) else open(source, 'rb')
+    with raw, gzip.GzipFile(fileobj=raw) as lines:
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the local TMDb title index")
+    parser.add_argument('--source', default=None, help="Export file path or URL (default: latest daily export)")
+    parser.add_argument('--output', default=os.getenv('TMDB_TITLE_INDEX', 'tmdb_titles.sqlite3'))
+    parser.add_argument('--fuzzy-min-popularity', type=float, default=1.0,
+                        help="Only titles at least this popular get typo-tolerant postings")
+    args = parser.parse_args()
+
+    source = args.source or default_source()
+    print(f"Building title index from {source} into {args.output}")
+    started = time.perf_counter()
+    try:
+        count = build_index(stream_records(source), args.output,
+                            fuzzy_min_popularity=args.fuzzy_min_popularity)
+    except Exception as e:
+        print(f"Error building title index: {str(e)}")
+        sys.exit(1)
+    print(f"Indexed {count} titles in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Classify archived messages offline with NLPService.process_batch.
+
+Usage:
+    python classify_messages.py INPUT [--output OUT.jsonl] [--batch-size 256] [--processes 4]
+
+INPUT has one message per line, either plain text or JSON with a "text" or
+"Body" field ("-" reads stdin). Each output line is JSON with the message,
+intent, title and sentiment, in input order. Use --processes to spread the
+spaCy parses over several cores.
+"""
+
+import argparse
+import json
+import sys
+import time
+from itertools import tee
+
+from services.nlp_service import NLPService
+
+
+def read_messages(stream):
+    for line in stream:
+        line = line.rstrip('\n')
+        if not line.strip():
+            continue
+        if line.lstrip().startswith('{'):
+            record = json.loads(line)
+            yield record.get('text') or record.get('Body') or ''
+        else:
+            yield line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify messages in bulk")
+    parser.add_argument('input', help="Input file, or - for stdin")
+    parser.add_argument('--output', default='-', help="Output JSONL file (default: stdout)")
+    parser.add_argument('--batch-size', type=int, default=None, help="nlp.pipe batch size")
+    parser.add_argument('--processes', type=int, default=None, help="spaCy worker processes")
+    args = parser.parse_args()
+
+    nlp_service = NLPService()
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    sink = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+
+    started = time.perf_counter()
+    count = 0
+    try:
+        # process_batch reads ahead one chunk; tee keeps the texts for the output lines
+        texts, feed = tee(read_messages(source))
+        results = nlp_service.process_batch(feed, batch_size=args.batch_size, n_process=args.processes)
+        for message, result in zip(texts, results):
+            sink.write(json.dumps({'text': message, **result._asdict()}) + '\n')
+            count += 1
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    elapsed = time.perf_counter() - started
+    print(f"Classified {count} messages in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f}/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
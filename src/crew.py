@@ -6,7 +6,7 @@ from services.whatsapp_service import WhatsAppService
 from services.db_service import DatabaseService
 import os
 from dotenv import load_dotenv
-from services.message_handler import MessageHandler
+from services.container import get_container
 
 # Load environment variables
 load_dotenv()
@@ -19,9 +19,12 @@ class MoviescoreCrew():
     """movie_score crew"""
 
     def __init__(self):
-        self.tmdb_service = TMDbService()
-        self.whatsapp_service = WhatsAppService()
-        self.db_service = DatabaseService()
+        # Share the process-wide services with the webhook server
+        container = get_container()
+        self.tmdb_service = container.tmdb_service
+        self.whatsapp_service = container.whatsapp_service
+        self.db_service = container.db_service
+        self.message_handler = container.message_handler
         # Initialize agents
         self.whatsapp_agent = self._create_whatsapp_agent()
         self.movie_query_agent = self._create_movie_query_agent()
@@ -173,8 +176,7 @@ class MoviescoreCrew():
         phone_number = parts[1].strip()
         
         # Use message handler to process
-        handler = MessageHandler()
-        response, success = handler.handle_message(message, phone_number)
+        response, success = self.message_handler.handle_message(message, phone_number)
         
         if success:
             self.whatsapp_service.send_message(phone_number, response)
@@ -219,7 +221,7 @@ class MoviescoreCrew():
 
     def _filter_unwatched_movies(self, movies: List[dict], user_id: str) -> List[dict]:
         """Filter out watched movies"""
-        watched_ids = self.db_service.get_watched_movies(user_id)
+        watched_ids = self.db_service.get_watched_ids(user_id, [movie.get('id') for movie in movies])
         return [movie for movie in movies if movie.get('id') not in watched_ids]
 
     def _sort_by_popularity(self, movies: List[dict]) -> List[dict]:
@@ -227,8 +229,9 @@ class MoviescoreCrew():
         return sorted(movies, key=lambda x: x.get('popularity', 0), reverse=True)
 
     def _add_watched_movie(self, user_id: str, movie_id: int) -> bool:
-        """Add movie to watched list"""
-        return self.db_service.add_watched_movie(user_id, movie_id)
+        """Add movie to watched list, storing its title and score for listing"""
+        movie, _ = self.tmdb_service.get_movie_details(movie_id)
+        return self.db_service.add_watched_movie(user_id, movie_id, movie)
 
     def _get_watched_movies(self, user_id: str) -> List[int]:
         """Get user's watched movies"""
@@ -0,0 +1,44 @@
+"""
+Gunicorn settings for the Flask webhook server.
+
+    gunicorn -c gunicorn.conf.py webhook_server:app     (from src/)
+
+The spaCy pipeline is loaded once in the master before workers are forked, so
+every worker shares its memory copy-on-write instead of loading its own copy.
+Only the model is preloaded: Mongo and HTTP clients are not fork-safe and are
+still built inside each worker, by post_worker_init. Set PRELOAD_NLP_MODEL=false
+to load per worker.
+"""
+
+import gc
+import logging
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+
+logger = logging.getLogger('gunicorn.error')
+
+
+def on_starting(server):
+    if os.getenv('PRELOAD_NLP_MODEL', 'true').lower() != 'true':
+        return
+    from services.metrics import memory_report
+    from services.nlp_service import load_model, model_report
+
+    load_model()
+    # Move everything allocated so far out of the collector's reach: collections
+    # in the workers would otherwise write to these objects and unshare the pages
+    gc.freeze()
+    logger.info(f"Preloaded spaCy in master: {model_report()}, memory {memory_report()}")
+
+
+def post_worker_init(worker):
+    from services.metrics import memory_report
+    from webhook_server import start_services
+
+    # Warm up in the background so the worker starts answering /ready at once
+    start_services()
+    logger.info(f"Worker {worker.pid} booted, memory {memory_report()}")
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""
+Move watched movies from the old one-document-per-user layout ({'movies': [...]})
+to one record per (user, movie) carrying the movie's title, score and year.
+
+Usage:
+    python migrate_watched.py [--batch-size 100]
+
+Safe to run more than once: records are upserted, each user document is deleted
+once its movies are moved, and each distinct movie is looked up through TMDb once.
+"""
+
+import argparse
+import sys
+import time
+
+from dotenv import load_dotenv
+from services.db_service import DatabaseService
+from services.tmdb_service import TMDbService
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate watched movies to per-movie records")
+    parser.add_argument('--batch-size', type=int, default=100, help="Mongo cursor batch size")
+    args = parser.parse_args()
+
+    db_service = DatabaseService()
+    started = time.perf_counter()
+    try:
+        if not db_service.ensure_indexes():
+            sys.exit(1)
+        migrated = db_service.migrate_legacy_entries(TMDbService(), batch_size=args.batch_size)
+    except Exception as e:
+        print(f"Error migrating watched movies: {str(e)}")
+        sys.exit(1)
+    finally:
+        db_service.close()
+    print(f"Migrated {migrated} user documents in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
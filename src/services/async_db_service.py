@@ -0,0 +1,55 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import os
+from services.db_service import DatabaseService
+
+
+class AsyncDatabaseService:
+    """
+    Asyncio counterpart of DatabaseService.
+
+    pymongo calls run on a dedicated thread pool sized to the Mongo connection
+    pool, so the event loop never blocks and the sync service stays the single
+    source of truth for the storage layout. This is the same model Motor uses
+    internally.
+    """
+
+    def __init__(self, db_service: Optional[DatabaseService] = None, max_workers: Optional[int] = None):
+        self.db_service = db_service or DatabaseService()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.getenv('MONGODB_ASYNC_WORKERS', '32')),
+            thread_name_prefix="mongo-async"
+        )
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def add_watched_movie(self, user_id: str, movie_id: int, movie: Optional[Dict] = None) -> bool:
+        """Add a movie to user's watched list"""
+        return await self._run(self.db_service.add_watched_movie, user_id, movie_id, movie)
+
+    async def get_watched_movies(self, user_id: str) -> List[int]:
+        """Get list of movies watched by user"""
+        return await self._run(self.db_service.get_watched_movies, user_id)
+
+    async def count_watched(self, user_id: str) -> int:
+        """Number of movies the user has watched"""
+        return await self._run(self.db_service.count_watched, user_id)
+
+    async def get_watched_page(self, user_id: str, limit: int = 10,
+                               cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of the user's watched movies, newest first"""
+        return await self._run(self.db_service.get_watched_page, user_id, limit, cursor)
+
+    async def is_movie_watched(self, user_id: str, movie_id: int) -> bool:
+        """Check if user has watched a specific movie"""
+        return await self._run(self.db_service.is_movie_watched, user_id, movie_id)
+
+    async def get_watched_ids(self, user_id: str, movie_ids: Iterable[int]) -> Set[int]:
+        """Which of the given movies the user has watched, in a single query"""
+        return await self._run(self.db_service.get_watched_ids, user_id, list(movie_ids))
+
+    async def close(self) -> None:
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,117 @@
+import inspect
+from typing import Tuple, Optional, Dict, Any, Callable
+from openai import AsyncOpenAI
+from services.openai_client import OpenAIDeadlineExceeded
+from services.openai_service import OpenAIService, RESPONSE_FAILURE_MESSAGE
+
+
+class AsyncOpenAIService:
+    """Asyncio counterpart of OpenAIService built on AsyncOpenAI"""
+
+    def __init__(self, openai_service: Optional[OpenAIService] = None):
+        # Reuse the sync service for prompts and the shared conversation histories
+        self.openai_service = openai_service or OpenAIService()
+        self.client = AsyncOpenAI(api_key=self.openai_service.api_key)
+        self.model = self.openai_service.model
+
+    async def process_message(self, message: str, user_id: str) -> Tuple[str, Optional[str], Dict[str, Any]]:
+        """
+        Process a message using OpenAI to determine intent and extract entities
+        Returns: (intent, entity, context)
+        """
+        messages = self.openai_service._build_intent_messages(message, user_id)
+
+        try:
+            response = await self.openai_service.completions.create_async(
+                self.client,
+                model=self.model,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=150,
+                **self.openai_service._intent_options()
+            )
+            self.openai_service._record_usage('intent', response)
+            content = response.choices[0].message.content
+            return self.openai_service._parse_intent_response(content, user_id)
+
+        except OpenAIDeadlineExceeded:
+            raise
+
+        except Exception as e:
+            print(f"Error calling OpenAI API: {str(e)}")
+            return "unknown", None, {"error": str(e)}
+
+    async def generate_response(self, prompt: str, user_id: str, context: Dict[str, Any] = None,
+                                intent: Optional[str] = None) -> str:
+        """
+        Generate a natural language response using OpenAI
+        """
+        messages = self.openai_service._build_response_messages(prompt, user_id, context, intent)
+        cache_key, cached = self.openai_service._cached_response(messages)
+        if cached is not None:
+            return self.openai_service._remember_reply(user_id, cached)
+
+        try:
+            response = await self.openai_service.completions.create_async(
+                self.client,
+                model=self.model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=300
+            )
+            self.openai_service._record_usage('response', response)
+            return self.openai_service._remember_reply(
+                user_id, self.openai_service._store_response(cache_key, response))
+
+        except OpenAIDeadlineExceeded:
+            raise
+
+        except Exception as e:
+            print(f"Error generating response: {str(e)}")
+            return RESPONSE_FAILURE_MESSAGE
+
+    async def respond_with_tools(self, message: str, user_id: str, tools: Dict[str, Callable[[Dict[str, Any]], Any]],
+                                 render: Optional[Callable[[str, Dict[str, Any], Any], str]] = None) -> str:
+        """
+        Asyncio variant of OpenAIService.respond_with_tools; tool implementations
+        may be coroutine functions
+        """
+        service = self.openai_service
+        messages = service._build_tool_messages(message, user_id)
+
+        try:
+            for round_number in range(service.max_tool_rounds):
+                response = await service.completions.create_async(
+                    self.client,
+                    model=self.model,
+                    messages=messages,
+                    **service._tool_options(round_number)
+                )
+                service._record_usage('tools', response)
+                reply = response.choices[0].message
+                if not reply.tool_calls:
+                    return service._finish_tool_conversation(reply.content, user_id)
+
+                messages.append(service._tool_call_message(reply))
+                results = []
+                for call in reply.tool_calls:
+                    result = service._run_tool(call, tools)
+                    if inspect.isawaitable(result):
+                        result = await result
+                    results.append((call, result))
+                if render is not None and service.tool_reply == 'template':
+                    return service._finish_tool_conversation(service._render_tool_results(results, render), user_id)
+                for call, result in results:
+                    messages.append(service._tool_result_message(call, result))
+
+            return RESPONSE_FAILURE_MESSAGE
+
+        except OpenAIDeadlineExceeded:
+            raise
+
+        except Exception as e:
+            print(f"Error generating response with tools: {str(e)}")
+            return RESPONSE_FAILURE_MESSAGE
+
+    async def close(self) -> None:
+        await self.client.close()
@@ -0,0 +1,113 @@
+import asyncio
+from typing import Any, List, Optional, Dict, Tuple
+import requests
+from services.cache import MISSING
+from services.tmdb_service import TMDbService
+
+
+class AsyncTMDbService:
+    """Asyncio counterpart of TMDbService"""
+
+    def __init__(self, tmdb_service: Optional[TMDbService] = None):
+        # Reuse the sync service for configuration, request building and parsing,
+        # and its transport for the pooled httpx client, breaker and metrics
+        self.tmdb_service = tmdb_service or TMDbService()
+        self.transport = self.tmdb_service.transport
+        self.cache = self.tmdb_service.cache
+
+    async def search_movie(self, title: str, user_id: Optional[str] = None) -> Tuple[Optional[Dict], str]:
+        """
+        Search for a movie by title
+        Returns: (movie_data, message)
+        """
+        corrected_id = await self._corrections(self.tmdb_service.corrections.lookup, title)
+        if corrected_id is not None:
+            movie, _ = await self.get_movie_details(corrected_id)
+            if movie:
+                await self.record_search_result(user_id, title, movie)
+                return movie, "Movie found successfully"
+
+        # The memory-mapped index answers in microseconds, so it runs inline; exact matches only
+        match = self.tmdb_service._lookup_title_index(title)
+        if match:
+            movie, _ = await self.get_movie_details(match['id'])
+            if movie:
+                await self.record_search_result(user_id, title, movie)
+                return movie, "Movie found successfully"
+
+        try:
+            url, params = self.tmdb_service._search_request(title)
+            payload = await self._fetch('search', url, params, self.tmdb_service._search_key(title))
+            movie, message = self.tmdb_service._parse_search(payload, title)
+        except requests.exceptions.RequestException as e:
+            return None, f"Error searching for movie: {str(e)}"
+
+        if not movie:
+            match = self.tmdb_service._lookup_title_index(title, fuzzy=True)
+            if match:
+                movie, _ = await self.get_movie_details(match['id'])
+                if movie:
+                    message = "Movie found successfully"
+        await self.record_search_result(user_id, title, movie)
+        return movie, message
+
+    async def record_search_result(self, user_id: Optional[str], title: str, movie: Optional[Dict]) -> None:
+        """Asyncio variant of TMDbService.record_search_result"""
+        await self._corrections(self.tmdb_service.record_search_result, user_id, title, movie)
+
+    async def _corrections(self, fn, *args):
+        """Run a correction map call, off the event loop when it may touch the shared tier"""
+        if self.tmdb_service.corrections.cache.shared is not None:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def get_movie_details(self, movie_id: int) -> Tuple[Optional[Dict], str]:
+        """
+        Get detailed information about a movie
+        Returns: (movie_details, message)
+        """
+        try:
+            url, params = self.tmdb_service._details_request(movie_id)
+            payload = await self._fetch('details', url, params, self.tmdb_service._details_key(movie_id))
+            return payload, "Movie details retrieved successfully"
+        except requests.exceptions.RequestException as e:
+            return None, f"Error getting movie details: {str(e)}"
+
+    async def get_similar_movies(self, movie_id: int, min_score: float = 0.0) -> Tuple[List[Dict], str]:
+        """
+        Get similar movies with optional minimum score filter
+        Returns: (similar_movies, message)
+        """
+        try:
+            url, params = self.tmdb_service._similar_request(movie_id)
+            payload = await self._fetch('similar', url, params, self.tmdb_service._similar_key(movie_id))
+            return self.tmdb_service._parse_similar(payload, min_score)
+        except requests.exceptions.RequestException as e:
+            return [], f"Error getting similar movies: {str(e)}"
+
+    async def _fetch(self, endpoint: str, url: str, params: Dict[str, Any], key: str) -> Dict:
+        """Cache-aware fetch; shared-tier I/O runs off the event loop"""
+        payload, fresh_for = self.cache.lookup_local(key)
+        if fresh_for <= 0 and self.cache.shared is not None:
+            payload, fresh_for = await asyncio.to_thread(self.cache.resolve, key, payload, fresh_for)
+        elif fresh_for <= 0:
+            payload, fresh_for = self.cache.resolve(key, payload, fresh_for)
+        payload = self.tmdb_service._serve_cached(endpoint, url, params, key, payload, fresh_for)
+        if payload is not MISSING:
+            return payload
+        return await self.tmdb_service.flights.do_async(key, lambda: self._fetch_uncached(endpoint, url, params, key))
+
+    async def _fetch_uncached(self, endpoint: str, url: str, params: Dict[str, Any], key: str) -> Dict:
+        payload = self.cache.get_local(key)
+        if payload is not MISSING:
+            return payload
+        payload = await self.transport.get_async(endpoint, url, params)
+        await asyncio.to_thread(self.tmdb_service._store, endpoint, key, payload)
+        return payload
+
+    def format_movie_info(self, movie: Dict) -> str:
+        """Format movie information for display"""
+        return self.tmdb_service.format_movie_info(movie)
+
+    async def close(self) -> None:
+        await self.transport.aclose()
@@ -0,0 +1,43 @@
+from typing import Optional, Tuple
+from twilio.rest import Client
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+from services.whatsapp_service import WhatsAppService
+
+
+class AsyncWhatsAppService:
+    """Asyncio counterpart of WhatsAppService using Twilio's aiohttp client"""
+
+    def __init__(self, whatsapp_service: Optional[WhatsAppService] = None):
+        # Reuse the sync service for credentials and the loaded NLP model
+        self.whatsapp_service = whatsapp_service or WhatsAppService()
+        self.http_client = AsyncTwilioHttpClient()
+        self.client = Client(
+            self.whatsapp_service.account_sid,
+            self.whatsapp_service.auth_token,
+            http_client=self.http_client
+        )
+
+    async def send_message(self, to_number: str, message: str) -> bool:
+        """Send WhatsApp message using Twilio"""
+        try:
+            await self.whatsapp_service.limiter.acquire_async('twilio', 'messages')
+            await self.client.messages.create_async(
+                body=message,
+                from_=f"whatsapp:{self.whatsapp_service.from_number}",
+                to=f"whatsapp:{to_number}"
+            )
+            return True
+        except Exception as e:
+            print(f"Error sending WhatsApp message: {str(e)}")
+            return False
+
+    def process_message(self, message: str) -> Tuple[str, Optional[str]]:
+        """
+        Process incoming message to determine intent and extract movie title
+        Returns: (intent, movie_title)
+        """
+        # NLP is CPU bound and fast, so it runs inline on the event loop
+        return self.whatsapp_service.process_message(message)
+
+    async def close(self) -> None:
+        await self.http_client.close()
@@ -0,0 +1,315 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from services.metrics import Counters
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+def normalize_query(text: str) -> str:
+    """Case-fold, drop punctuation and collapse whitespace so equivalent queries share a key"""
+    text = re.sub(r"[^\w\s]", " ", text.casefold())
+    return " ".join(text.split())
+
+
+def cache_key(endpoint: str, *parts: Any, language: str = 'en-US') -> str:
+    """Build a cache key such as 'search:en-US:the dark knight'"""
+    normalized = [normalize_query(p) if isinstance(p, str) else str(p) for p in parts]
+    return ":".join([endpoint, language] + normalized)
+
+
+class LRUCache:
+    """Bounded in-process LRU with a TTL per entry"""
+
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # key -> (value, expires_at, tags)
+        self._entries: "OrderedDict[str, Tuple[Any, float, Tuple[str, ...]]]" = OrderedDict()
+        self.counters = Counters()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def get_entry(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Return (value, expires_at) or None when the key is absent or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at, _ = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.counters.incr('expired')
+                return None
+            self._entries.move_to_end(key)
+            return value, expires_at
+
+    def set(self, key: str, value: Any, ttl: float, tags: Iterable[str] = ()) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl, tuple(tags))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters.incr('evictions')
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_tag(self, tag: str) -> int:
+        with self._lock:
+            keys = [key for key, (_, _, tags) in self._entries.items() if tag in tags]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCacheTier:
+    """
+    Shared tier in a local SQLite file, readable by every worker on the host.
+    Each thread uses its own connection; WAL mode lets readers run alongside writers.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS cache ("
+                     "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, tags TEXT NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Any:
+        """Return (value, expires_at, tags) or MISSING"""
+        row = self._conn().execute(
+            "SELECT value, expires_at, tags FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        if not row:
+            return MISSING
+        return json.loads(row[0]), row[1], tuple(filter(None, row[2].split('|')))
+
+    def set(self, key: str, value: Any, ttl: float, tags: Iterable[str] = ()) -> None:
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO cache (key, value, expires_at, tags) VALUES (?, ?, ?, ?)",
+                     (key, json.dumps(value), time.time() + ttl, "|" + "|".join(tags) + "|"))
+        conn.commit()
+
+    def delete(self, key: str) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+        conn.commit()
+
+    def invalidate_tag(self, tag: str) -> int:
+        conn = self._conn()
+        cursor = conn.execute("DELETE FROM cache WHERE tags LIKE ?", (f"%|{tag}|%",))
+        conn.commit()
+        return cursor.rowcount
+
+    def purge_expired(self) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        conn.commit()
+
+
+class MongoCacheTier:
+    """Shared tier in a MongoDB collection, visible to every worker on every node"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        # Mongo removes expired documents in the background
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+        self.collection.create_index('tags')
+
+    def get(self, key: str) -> Any:
+        """Return (value, expires_at, tags) or MISSING"""
+        doc = self.collection.find_one({'_id': key, 'expires_at': {'$gt': datetime.now(timezone.utc)}})
+        if not doc:
+            return MISSING
+        expires_at = doc['expires_at'].replace(tzinfo=timezone.utc).timestamp()
+        return doc['value'], expires_at, tuple(doc.get('tags', ()))
+
+    def set(self, key: str, value: Any, ttl: float, tags: Iterable[str] = ()) -> None:
+        self.collection.replace_one(
+            {'_id': key},
+            {'_id': key, 'value': value, 'tags': list(tags),
+             'expires_at': datetime.now(timezone.utc) + timedelta(seconds=ttl)},
+            upsert=True
+        )
+
+    def delete(self, key: str) -> None:
+        self.collection.delete_one({'_id': key})
+
+    def invalidate_tag(self, tag: str) -> int:
+        return self.collection.delete_many({'tags': tag}).deleted_count
+
+
+class TieredCache:
+    """
+    Two-tier cache: a bounded in-process LRU in front of an optional shared tier.
+    TTLs are per endpoint (the first component of the key).
+
+    With `stale_ttl`, entries are kept that many seconds past their TTL.
+    lookup() still returns them, flagged as stale, so a caller can answer at
+    once and refresh in the background. get() only ever returns fresh values.
+    """
+
+    def __init__(self, local: LRUCache, shared=None, ttls: Optional[Dict[str, float]] = None,
+                 default_ttl: float = 3600.0, stale_ttl: float = 0.0):
+        self.local = local
+        self.shared = shared
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.counters = Counters()
+
+    def ttl_for(self, key: str) -> float:
+        return self.ttls.get(key.split(':', 1)[0], self.default_ttl)
+
+    def lookup_local(self, key: str) -> Tuple[Any, float]:
+        """
+        Look up the local LRU
+        Returns: (value or MISSING, seconds the value stays fresh; zero or less when stale)
+        """
+        entry = self.local.get_entry(key)
+        if entry is None:
+            return MISSING, 0.0
+        value, expires_at = entry
+        fresh_for = expires_at - self.stale_ttl - time.time()
+        self.counters.incr('local_hits' if fresh_for > 0 else 'stale_hits')
+        return value, fresh_for
+
+    def lookup_shared(self, key: str) -> Tuple[Any, float]:
+        """Look up the shared tier and promote hits into the local LRU; returns like lookup_local"""
+        if self.shared is None:
+            return MISSING, 0.0
+        try:
+            entry = self.shared.get(key)
+        except Exception as e:
+            logger.warning(f"Shared cache read failed for {key}: {str(e)}")
+            return MISSING, 0.0
+        if entry is MISSING:
+            return MISSING, 0.0
+        value, expires_at, tags = entry
+        fresh_for = expires_at - self.stale_ttl - time.time()
+        self.counters.incr('shared_hits' if fresh_for > 0 else 'stale_hits')
+        # Keep the shared expiry so every worker expires the entry at the same time
+        self.local.set(key, value, max(0.0, expires_at - time.time()), tags)
+        return value, fresh_for
+
+    def lookup(self, key: str) -> Tuple[Any, float]:
+        """
+        Look up both tiers, preferring a fresh shared copy over a stale local one
+        (another worker may already have refreshed it)
+        Returns: (value or MISSING, seconds the value stays fresh)
+        """
+        return self.resolve(key, *self.lookup_local(key))
+
+    def resolve(self, key: str, value: Any, fresh_for: float) -> Tuple[Any, float]:
+        """Finish a lookup begun with lookup_local(), consulting the shared tier unless the value is fresh"""
+        if fresh_for <= 0:
+            shared_value, shared_fresh_for = self.lookup_shared(key)
+            if shared_value is not MISSING and (value is MISSING or shared_fresh_for > fresh_for):
+                value, fresh_for = shared_value, shared_fresh_for
+        if value is MISSING:
+            self.counters.incr('misses')
+        return value, fresh_for
+
+    def get_local(self, key: str) -> Any:
+        value, fresh_for = self.lookup_local(key)
+        return value if fresh_for > 0 else MISSING
+
+    def get_shared(self, key: str) -> Any:
+        value, fresh_for = self.lookup_shared(key)
+        return value if fresh_for > 0 else MISSING
+
+    def get(self, key: str) -> Any:
+        """Return the fresh cached value or MISSING, recording a miss if neither tier has it"""
+        value, fresh_for = self.lookup(key)
+        return value if fresh_for > 0 else MISSING
+
+    def set(self, key: str, value: Any, tags: Iterable[str] = (), ttl: Optional[float] = None) -> None:
+        """Store a value for its endpoint's TTL, or `ttl` seconds when given"""
+        ttl = (self.ttl_for(key) if ttl is None else ttl) + self.stale_ttl
+        tags = tuple(str(tag) for tag in tags)
+        self.local.set(key, value, ttl, tags)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, ttl, tags)
+            except Exception as e:
+                logger.warning(f"Shared cache write failed for {key}: {str(e)}")
+
+    def invalidate_tag(self, tag: str) -> int:
+        removed = self.local.invalidate_tag(str(tag))
+        if self.shared is not None:
+            removed += self.shared.invalidate_tag(str(tag))
+        self.counters.incr('invalidations')
+        return removed
+
+    def metrics(self) -> Dict[str, object]:
+        counters = self.counters.snapshot()
+        hits = counters.get('local_hits', 0) + counters.get('shared_hits', 0) + counters.get('stale_hits', 0)
+        lookups = hits + counters.get('misses', 0)
+        return {
+            'entries': len(self.local),
+            'max_entries': self.local.max_entries,
+            'shared_tier': type(self.shared).__name__ if self.shared is not None else None,
+            'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+            'evictions': self.local.counters.get('evictions'),
+            'expired': self.local.counters.get('expired'),
+            **counters,
+        }
+
+
+
+def _parse_ttls(spec: str) -> Dict[str, float]:
+    """Parse 'search=21600,details=86400' into {'search': 21600.0, ...}"""
+    ttls = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, seconds = item.partition('=')
+        ttls[name.strip()] = float(seconds)
+    return ttls
+
+
+def build_cache_from_env(prefix: str, default_ttls: Dict[str, float]) -> TieredCache:
+    """
+    Build a TieredCache configured by <PREFIX>_CACHE_* environment variables.
+    <PREFIX>_SHARED_CACHE selects the shared tier: 'mongo', 'disk' or empty for none;
+    <PREFIX>_CACHE_STALE_TTL keeps entries that many seconds past their TTL for lookup().
+    """
+    ttls = dict(default_ttls)
+    ttls.update(_parse_ttls(os.getenv(f'{prefix}_CACHE_TTLS', '')))
+    local = LRUCache(max_entries=int(os.getenv(f'{prefix}_CACHE_SIZE', '5000')))
+
+    shared = None
+    shared_kind = os.getenv(f'{prefix}_SHARED_CACHE', '').lower()
+    if shared_kind == 'disk':
+        shared = DiskCacheTier(os.getenv(f'{prefix}_DISK_CACHE_PATH', f'{prefix.lower()}_cache.sqlite3'))
+    elif shared_kind == 'mongo':
+        from pymongo import MongoClient
+        client = MongoClient(os.getenv('MONGODB_URI'))
+        shared = MongoCacheTier(client.movie_score[f'{prefix.lower()}_cache'])
+
+    return TieredCache(local, shared, ttls, stale_ttl=float(os.getenv(f'{prefix}_CACHE_STALE_TTL', '0')))
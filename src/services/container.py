@@ -0,0 +1,269 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from services.tmdb_service import TMDbService
+from services.db_service import DatabaseService
+from services.nlp_service import NLPService, model_report
+from services.metrics import memory_report
+from services.rate_limiter import get_rate_limiter
+from services.whatsapp_service import WhatsAppService
+from services.openai_service import OpenAIService
+from services.reply_queue import ReplyQueue
+from services.watched_refresher import WatchedRefresher
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceContainer:
+    """
+    Process-wide holder for the application services.
+
+    Each service is built once per worker process and shared by every request,
+    so the spaCy model, the Mongo connection pool and the per-user OpenAI
+    conversation histories survive between messages.
+    """
+
+    def __init__(self, with_reply_queue: bool = True):
+        # The ASGI server schedules background replies on its event loop instead
+        self.with_reply_queue = with_reply_queue
+
+        self.tmdb_service: Optional[TMDbService] = None
+        self.db_service: Optional[DatabaseService] = None
+        self.nlp_service: Optional[NLPService] = None
+        self.whatsapp_service: Optional[WhatsAppService] = None
+        self.openai_service: Optional[OpenAIService] = None
+        self.message_handler = None
+        self.reply_queue: Optional[ReplyQueue] = None
+        self.watched_refresher: Optional[WatchedRefresher] = None
+
+        # Asyncio counterparts, created inside the event loop by start_async
+        self.async_services: Dict[str, object] = {}
+
+        self._lock = threading.Lock()
+        self._started = False
+        self._ready = False
+        self._stopping = threading.Event()
+        self._startup_timings: Dict[str, float] = {}
+
+    @property
+    def ready(self) -> bool:
+        """True once startup and warm-up have completed"""
+        return self._ready
+
+    def startup(self) -> None:
+        """Build every service once. Safe to call from several threads."""
+        with self._lock:
+            if self._started:
+                return
+
+            self.tmdb_service = self._timed('tmdb', TMDbService)
+            self.db_service = self._timed('db', DatabaseService)
+            self.nlp_service = self._timed('nlp', NLPService)
+            self.whatsapp_service = self._timed(
+                'whatsapp', lambda: WhatsAppService(nlp_service=self.nlp_service)
+            )
+
+            if os.getenv('USE_OPENAI', 'false').lower() == 'true':
+                try:
+                    self.openai_service = self._timed('openai', OpenAIService)
+                except Exception as e:
+                    logger.error(f"Failed to initialize OpenAI service: {str(e)}")
+                    self.openai_service = None
+
+            # Imported here to avoid a circular import with message_handler
+            from services.message_handler import MessageHandler
+            self.message_handler = MessageHandler(container=self)
+
+            # Acknowledge-then-reply mode: the webhook only enqueues messages
+            if self.with_reply_queue and os.getenv('REPLY_MODE', 'sync').lower() == 'async':
+                self.reply_queue = ReplyQueue(self.message_handler, self.whatsapp_service)
+                self.reply_queue.start()
+
+            # Refreshes stale TMDb entries and prewarms hot titles within its own request budget
+            if self.tmdb_service.refresher is not None:
+                self.tmdb_service.refresher.start()
+
+            # Keeps the scores stored with watched entries from going stale
+            if float(os.getenv('WATCHED_REFRESH_INTERVAL', '0')) > 0:
+                self.watched_refresher = WatchedRefresher(self.db_service, self.tmdb_service)
+                self.watched_refresher.start()
+
+            self._started = True
+            logger.info(f"Service container started: {self.startup_report()}")
+
+    def warm_up(self) -> bool:
+        """
+        Exercise the expensive resources so the first real message does not pay
+        for lazy initialisation (spaCy vocab, Mongo and TMDb connection pools) and
+        create the Mongo indexes.
+        Returns: True when every service is warm
+        """
+        try:
+            self.startup()
+            self.nlp_service.warm_up()
+            if not self.db_service.ping():
+                raise RuntimeError("database ping failed")
+            if not self.db_service.ensure_indexes():
+                raise RuntimeError("database indexes could not be created")
+            if not self.tmdb_service.warm_up():
+                raise RuntimeError("TMDb connection failed")
+            self._ready = True
+            logger.info("Service container warmed up")
+        except Exception as e:
+            logger.error(f"Service warm-up failed: {str(e)}", exc_info=True)
+            self._ready = False
+        return self._ready
+
+    def warm_up_until_ready(self) -> bool:
+        """
+        Retry warm_up until it succeeds, waiting WARMUP_RETRY_DELAY seconds
+        (default 1) after the first failure and doubling up to
+        WARMUP_RETRY_MAX_DELAY (default 60), so a database or TMDb outage at
+        boot does not leave the worker unready for good.
+        Returns: True once warm, False if the container shut down first
+        """
+        delay = float(os.getenv('WARMUP_RETRY_DELAY', '1'))
+        max_delay = float(os.getenv('WARMUP_RETRY_MAX_DELAY', '60'))
+        while not self._stopping.is_set():
+            if self.warm_up():
+                return True
+            logger.warning(f"Retrying service warm-up in {delay:.1f}s")
+            if self._stopping.wait(delay):
+                break
+            delay = min(delay * 2, max_delay)
+        return False
+
+    def warm_up_in_background(self) -> threading.Thread:
+        """Run warm_up_until_ready on a daemon thread"""
+        thread = threading.Thread(target=self.warm_up_until_ready, name="service-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self) -> None:
+        """Release connection pools held by the services"""
+        self._stopping.set()
+        with self._lock:
+            self._ready = False
+            if self.reply_queue is not None:
+                self.reply_queue.stop()
+            if self.watched_refresher is not None:
+                self.watched_refresher.stop()
+            if self.tmdb_service is not None:
+                if self.tmdb_service.refresher is not None:
+                    self.tmdb_service.refresher.stop()
+                self.tmdb_service.transport.close()
+            if self.db_service is not None:
+                self.db_service.close()
+            self._started = False
+            logger.info("Service container shut down")
+
+    async def start_async(self) -> None:
+        """
+        Build the asyncio services on the running event loop and attach them to
+        the shared MessageHandler. Sync services are built first if needed.
+        """
+        if self.async_services:
+            return
+        self.startup()
+
+        # Imported here so sync deployments do not need httpx or aiohttp
+        from services.async_tmdb_service import AsyncTMDbService
+        from services.async_db_service import AsyncDatabaseService
+        from services.async_whatsapp_service import AsyncWhatsAppService
+        from services.async_openai_service import AsyncOpenAIService
+
+        self.async_services = {
+            'tmdb': AsyncTMDbService(self.tmdb_service),
+            'db': AsyncDatabaseService(self.db_service),
+            'whatsapp': AsyncWhatsAppService(self.whatsapp_service),
+        }
+        if self.openai_service is not None:
+            self.async_services['openai'] = AsyncOpenAIService(self.openai_service)
+
+        self.message_handler.attach_async_services(
+            self.async_services['tmdb'],
+            self.async_services['db'],
+            self.async_services['whatsapp'],
+            self.async_services.get('openai'),
+        )
+        logger.info("Async services started")
+
+    async def shutdown_async(self) -> None:
+        """Close the asyncio clients created by start_async"""
+        for service in self.async_services.values():
+            await service.close()
+        self.async_services = {}
+        if self.message_handler is not None:
+            self.message_handler.attach_async_services(None, None, None)
+
+    def health(self) -> Dict[str, object]:
+        """Readiness report used by the webhook server"""
+        return {
+            'ready': self._ready,
+            'openai_enabled': self.openai_service is not None,
+            'startup_seconds': dict(self._startup_timings),
+            'reply_mode': 'async' if self.reply_queue is not None else 'sync',
+        }
+
+    def startup_report(self) -> Dict[str, object]:
+        """Per-worker service build times, spaCy pipeline and resident memory"""
+        return {
+            'pid': os.getpid(),
+            'startup_seconds': dict(self._startup_timings),
+            'nlp_models': model_report(),
+            'memory_mb': memory_report(),
+        }
+
+    def metrics(self) -> Dict[str, object]:
+        """Runtime metrics exposed by the webhook server"""
+        metrics: Dict[str, object] = {'memory_mb': memory_report(), 'rate_limits': get_rate_limiter().metrics()}
+        if self.tmdb_service is not None:
+            metrics['tmdb'] = self.tmdb_service.metrics()
+        if self.openai_service is not None:
+            metrics['openai'] = self.openai_service.metrics()
+        if self.message_handler is not None and self.message_handler.router is not None:
+            metrics['routing'] = self.message_handler.router.metrics()
+        if self.reply_queue is not None:
+            metrics['reply_queue'] = self.reply_queue.metrics()
+        if self.watched_refresher is not None:
+            metrics['watched_refresher'] = self.watched_refresher.metrics()
+        return metrics
+
+    def _timed(self, name: str, factory):
+        started = time.perf_counter()
+        service = factory()
+        self._startup_timings[name] = round(time.perf_counter() - started, 3)
+        return service
+
+
+_container: Optional[ServiceContainer] = None
+_container_lock = threading.Lock()
+
+
+def get_container(with_reply_queue: bool = True) -> ServiceContainer:
+    """Return the process-wide container, starting it on first use"""
+    global _container
+    if _container is None:
+        with _container_lock:
+            if _container is None:
+                container = ServiceContainer(with_reply_queue=with_reply_queue)
+                container.startup()
+                _container = container
+    return _container
+
+
+def current_container() -> Optional[ServiceContainer]:
+    """Return the process-wide container if it has been started, without starting it"""
+    return _container
+
+
+def reset_container() -> None:
+    """Shut down and forget the process-wide container (used after fork and in scripts)"""
+    global _container
+    with _container_lock:
+        if _container is not None:
+            _container.shutdown()
+        _container = None
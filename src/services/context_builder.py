@@ -0,0 +1,85 @@
+import re
+from typing import Dict, List, Optional
+
+from services.history_store import estimate_tokens
+
+SUMMARY_HEADER = "Earlier in this conversation:"
+
+# History kept for each kind of call; classification never sees generated prose and vice versa
+CHANNELS = ('intent', 'chat')
+
+
+def _first_sentence(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    sentence = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit - 3].rstrip() + "..."
+
+
+class ContextBuilder:
+    """
+    Token-budgeted conversation context for OpenAIService.
+
+    Each channel ('intent' for classification, 'chat' for generated replies)
+    keeps its own history in the history store. When a channel's history grows
+    past its token budget or the store's message cap, the oldest turns are
+    folded into a short rolling summary, which the store returns as the
+    channel's first message, so the context sent per request stays about the
+    same size however long the conversation gets. The store swaps the folded
+    turns for the summary in one step and refuses the fold if the turns have
+    changed meanwhile, so concurrent messages from one user, in any worker,
+    cannot interleave with it.
+    """
+
+    def __init__(self, store, budgets: Optional[Dict[str, int]] = None, summary_tokens: int = 120,
+                 line_chars: int = 100):
+        self.store = store
+        self.budgets = {'intent': 300, 'chat': 500, **(budgets or {})}
+        self.summary_tokens = summary_tokens
+        self.line_chars = line_chars
+
+    def record(self, channel: str, user_id: str, role: str, content: str) -> None:
+        """Append a message to a channel, folding the oldest turns when it outgrows its budget"""
+        self.store.append(user_id, role, content, channel=channel)
+        summary, messages = self._split_summary(self.store.recent(user_id, channel=channel))
+
+        budget = self.budgets[channel]
+        # Leave room for the summary and the next message within the store's message cap
+        capacity = max(1, getattr(self.store, 'max_messages', len(messages) + 2) - 2)
+        folded = []
+        # The newest message is always kept
+        while len(messages) > 1 and (len(messages) > capacity or self._tokens(messages) > budget):
+            folded.append(messages.pop(0))
+        if folded:
+            # A refused fold means another message or worker got there first; the next record folds again
+            self.store.fold(user_id, self._fold(summary, folded), folded, channel=channel)
+
+    def context(self, channel: str, user_id: str) -> List[Dict[str, str]]:
+        """The channel's summary (as a system message) and recent messages, oldest first"""
+        return self.store.recent(user_id, channel=channel)
+
+    def clear(self, user_id: str) -> None:
+        for channel in CHANNELS:
+            self.store.clear(user_id, channel=channel)
+
+    @staticmethod
+    def _split_summary(window: List[Dict[str, str]]):
+        if window and window[0]['role'] == 'system' and window[0]['content'].startswith(SUMMARY_HEADER):
+            return window[0]['content'], window[1:]
+        return None, list(window)
+
+    @staticmethod
+    def _tokens(messages: List[Dict[str, str]]) -> int:
+        return sum(estimate_tokens(message['content']) for message in messages)
+
+    def _fold(self, summary: Optional[str], messages: List[Dict[str, str]]) -> str:
+        """
+        Add one line per folded message to the summary, dropping the oldest
+        lines once it exceeds `summary_tokens`. Extractive, so folding costs no
+        completion.
+        """
+        lines = summary.split("\n")[1:] if summary else []
+        lines += [f"- {message['role']}: {_first_sentence(message['content'], self.line_chars)}"
+                  for message in messages]
+        while len(lines) > 1 and estimate_tokens("\n".join([SUMMARY_HEADER] + lines)) > self.summary_tokens:
+            lines.pop(0)
+        return "\n".join([SUMMARY_HEADER] + lines)
@@ -1,26 +1,90 @@
-from typing import List
-from pymongo import MongoClient
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, MongoClient, UpdateMany, UpdateOne
+from pymongo.errors import PyMongoError
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Listing order: newest first, with _id breaking ties between equal timestamps
+NEWEST_FIRST = [('watched_at', DESCENDING), ('_id', DESCENDING)]
+
+
+def movie_fields(movie: Optional[Dict]) -> Dict:
+    """Title, score and year captured from TMDb data so listing needs no TMDb call"""
+    movie = movie or {}
+    return {
+        'title': movie.get('title'),
+        'vote_average': movie.get('vote_average'),
+        'year': (movie.get('release_date') or '')[:4] or None,
+    }
+
+
+def _to_entry(doc: Dict) -> Dict:
+    """Shape a stored record like a TMDb movie for the formatters"""
+    return {
+        'id': doc['movie_id'],
+        'title': doc.get('title'),
+        'vote_average': doc.get('vote_average'),
+        'year': doc.get('year'),
+        'watched_at': doc.get('watched_at'),
+    }
+
+
+def encode_cursor(doc: Dict) -> str:
+    """Opaque pagination cursor pointing just after `doc`"""
+    watched_at = doc['watched_at'].replace(tzinfo=timezone.utc)
+    return f"{int(watched_at.timestamp() * 1000)}:{doc['_id']}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    millis, _, object_id = cursor.partition(':')
+    return datetime.fromtimestamp(int(millis) / 1000, tz=timezone.utc), ObjectId(object_id)
+
+
 class DatabaseService:
-    def __init__(self):
+    def __init__(self, client: Optional[MongoClient] = None):
         self.mongo_uri = os.getenv('MONGODB_URI')
-        if not self.mongo_uri:
+        if client is None and not self.mongo_uri:
             raise ValueError("MongoDB URI not found in environment variables")
-            
-        self.client = MongoClient(self.mongo_uri)
+
+        # A client can be passed in, e.g. a mongomock client in the tests
+        self.client = client if client is not None else MongoClient(self.mongo_uri)
         self.db = self.client.movie_score
+        # One record per (user, movie); the old per-user documents are only read by the migration
+        self.watched = self.db.watched_entries
         self.watched_movies = self.db.watched_movies
 
-    def add_watched_movie(self, user_id: str, movie_id: int) -> bool:
-        """Add a movie to user's watched list"""
+    def ensure_indexes(self) -> bool:
+        """
+        Create the watched-entry indexes if they are missing. Called from the
+        warm-up and migration steps, never from the constructor, so building
+        the service does no network I/O.
+        Returns: True when every index exists
+        """
         try:
-            result = self.watched_movies.update_one(
-                {'user_id': user_id},
-                {'$addToSet': {'movies': movie_id}},
+            self.watched.create_index([('user_id', ASCENDING), ('movie_id', ASCENDING)], unique=True)
+            self.watched.create_index([('user_id', ASCENDING)] + NEWEST_FIRST)
+            self.watched.create_index([('movie_id', ASCENDING), ('refreshed_at', ASCENDING)])
+            self.watched.create_index('refreshed_at')
+            return True
+        except PyMongoError as e:
+            print(f"Error creating watched indexes: {str(e)}")
+            return False
+
+    def add_watched_movie(self, user_id: str, movie_id: int, movie: Optional[Dict] = None) -> bool:
+        """
+        Add a movie to user's watched list, storing its title, score and year
+        so the list can be shown without calling TMDb
+        """
+        now = datetime.now(timezone.utc)
+        try:
+            # Marking a movie twice keeps the original watched_at
+            self.watched.update_one(
+                {'user_id': user_id, 'movie_id': movie_id},
+                {'$setOnInsert': {**movie_fields(movie), 'watched_at': now, 'refreshed_at': now}},
                 upsert=True
             )
             return True
@@ -29,18 +93,164 @@ class DatabaseService:
             return False
 
     def get_watched_movies(self, user_id: str) -> List[int]:
-        """Get list of movies watched by user"""
+        """Get list of movies watched by user, newest first"""
         try:
-            user_doc = self.watched_movies.find_one({'user_id': user_id})
-            return user_doc.get('movies', []) if user_doc else []
+            cursor = self.watched.find({'user_id': user_id}, {'movie_id': 1, '_id': 0}).sort(NEWEST_FIRST)
+            return [doc['movie_id'] for doc in cursor]
         except Exception as e:
             print(f"Error getting watched movies: {str(e)}")
             return []
 
+    def get_watched_page(self, user_id: str, limit: int = 10,
+                         cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Get one page of the user's watched movies, newest first
+        Returns: (entries, cursor for the next page or None on the last page)
+        """
+        query: Dict = {'user_id': user_id}
+        try:
+            if cursor:
+                watched_at, object_id = decode_cursor(cursor)
+                query['$or'] = [
+                    {'watched_at': {'$lt': watched_at}},
+                    {'watched_at': watched_at, '_id': {'$lt': object_id}},
+                ]
+            # Fetch one extra record to know whether another page exists
+            docs = list(self.watched.find(query).sort(NEWEST_FIRST).limit(limit + 1))
+        except Exception as e:
+            print(f"Error getting watched page: {str(e)}")
+            return [], None
+        next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+        return [_to_entry(doc) for doc in docs[:limit]], next_cursor
+
+    def count_watched(self, user_id: str) -> int:
+        """Number of movies the user has watched, counted on the (user_id, ...) index"""
+        try:
+            return self.watched.count_documents({'user_id': user_id})
+        except Exception as e:
+            print(f"Error counting watched movies: {str(e)}")
+            return 0
+
     def is_movie_watched(self, user_id: str, movie_id: int) -> bool:
         """Check if user has watched a specific movie"""
         try:
-            return movie_id in self.get_watched_movies(user_id)
+            return self.watched.find_one({'user_id': user_id, 'movie_id': movie_id}, {'_id': 1}) is not None
         except Exception as e:
             print(f"Error checking watched movie: {str(e)}")
-            return False 
\ No newline at end of file
+            return False
+
+    def get_watched_ids(self, user_id: str, movie_ids: Iterable[int]) -> Set[int]:
+        """
+        Which of the given movies the user has watched, in a single query
+        answered from the (user_id, movie_id) index
+        Returns: set of watched movie ids
+        """
+        movie_ids = list(movie_ids)
+        if not movie_ids:
+            return set()
+        try:
+            docs = self.watched.find({'user_id': user_id, 'movie_id': {'$in': movie_ids}},
+                                     {'movie_id': 1, '_id': 0})
+            return {doc['movie_id'] for doc in docs}
+        except Exception as e:
+            print(f"Error getting watched ids: {str(e)}")
+            return set()
+
+    def find_stale_movie_ids(self, max_age: timedelta, limit: int = 500) -> List[int]:
+        """
+        Distinct ids of watched entries whose stored score is older than max_age,
+        leaving out movies whose refresh was postponed (see postpone_refresh)
+        """
+        try:
+            now = datetime.now(timezone.utc)
+            docs = self.watched.aggregate([
+                {'$match': {'refreshed_at': {'$lt': now - max_age}, 'refresh_retry_at': {'$not': {'$gt': now}}}},
+                {'$group': {'_id': '$movie_id'}},
+                {'$limit': limit},
+            ])
+            return [doc['_id'] for doc in docs]
+        except Exception as e:
+            print(f"Error finding stale watched entries: {str(e)}")
+            return []
+
+    def refresh_movie_metadata(self, movies: List[Dict]) -> int:
+        """
+        Update the stored title, score and year of every watched entry for the
+        given TMDb movies in a single bulk write
+        Returns: number of entries modified
+        """
+        if not movies:
+            return 0
+        now = datetime.now(timezone.utc)
+        operations = [
+            UpdateMany({'movie_id': movie['id']},
+                       {'$set': {**movie_fields(movie), 'refreshed_at': now}, '$unset': {'refresh_retry_at': ''}})
+            for movie in movies
+        ]
+        try:
+            return self.watched.bulk_write(operations, ordered=False).modified_count
+        except Exception as e:
+            print(f"Error refreshing watched movie metadata: {str(e)}")
+            return 0
+
+    def postpone_refresh(self, movie_ids: List[int], delay: timedelta) -> int:
+        """
+        Keep the given movies out of find_stale_movie_ids for `delay`, e.g. after
+        their TMDb lookup failed, so they do not take up every batch
+        Returns: number of entries postponed
+        """
+        if not movie_ids:
+            return 0
+        try:
+            retry_at = datetime.now(timezone.utc) + delay
+            return self.watched.update_many({'movie_id': {'$in': movie_ids}},
+                                            {'$set': {'refresh_retry_at': retry_at}}).modified_count
+        except Exception as e:
+            print(f"Error postponing watched movie refresh: {str(e)}")
+            return 0
+
+    def migrate_legacy_entries(self, tmdb_service, batch_size: int = 100) -> int:
+        """
+        Move per-user documents ({'movies': [...]}, holding bare ids or entry
+        dicts) into one record per watched movie, then delete them. Bare ids
+        are looked up through TMDb once each and get timestamps that keep
+        their original order.
+        Returns: number of user documents migrated
+        """
+        migrated = 0
+        details_cache: Dict[int, Optional[Dict]] = {}
+        for user_doc in self.watched_movies.find({}, batch_size=batch_size):
+            user_id = user_doc['user_id']
+            movies = user_doc.get('movies', [])
+            base_time = datetime.now(timezone.utc) - timedelta(seconds=len(movies))
+            operations = []
+            for position, entry in enumerate(movies):
+                if isinstance(entry, dict):
+                    movie_id, record = entry['id'], {k: v for k, v in entry.items() if k != 'id'}
+                else:
+                    if entry not in details_cache:
+                        details_cache[entry], _ = tmdb_service.get_movie_details(entry)
+                    watched_at = base_time + timedelta(seconds=position)
+                    movie_id = entry
+                    record = {**movie_fields(details_cache[entry]),
+                              'watched_at': watched_at, 'refreshed_at': watched_at}
+                operations.append(UpdateOne({'user_id': user_id, 'movie_id': movie_id},
+                                            {'$setOnInsert': record}, upsert=True))
+            if operations:
+                self.watched.bulk_write(operations, ordered=False)
+            self.watched_movies.delete_one({'_id': user_doc['_id']})
+            migrated += 1
+        return migrated
+
+    def ping(self) -> bool:
+        """Check the connection and open the first pooled socket"""
+        try:
+            self.client.admin.command('ping')
+            return True
+        except Exception as e:
+            print(f"Error pinging database: {str(e)}")
+            return False
+
+    def close(self) -> None:
+        """Close the client and its connection pool"""
+        self.client.close()
@@ -0,0 +1,203 @@
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import Executor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Monotonic deadline of the request currently being handled, if any
+_request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    'request_deadline', default=None
+)
+
+
+def default_request_budget() -> float:
+    """Seconds a request may spend before non-critical work is dropped"""
+    return float(os.getenv('REQUEST_BUDGET_SECONDS', '8.0'))
+
+
+@contextmanager
+def request_budget(seconds: Optional[float] = None):
+    """Set the deadline for the current request (thread or asyncio task)"""
+    deadline = time.monotonic() + (seconds if seconds is not None else default_request_budget())
+    token = _request_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _request_deadline.reset(token)
+
+
+def current_deadline() -> Optional[float]:
+    return _request_deadline.get()
+
+
+def remaining_budget(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left before the current request deadline, or `default` outside a request"""
+    deadline = _request_deadline.get()
+    if deadline is None:
+        return default
+    return max(0.0, deadline - time.monotonic())
+
+
+class SkipStep(Exception):
+    """Raised by a step to skip itself and every step depending on it"""
+
+
+class _Step:
+    def __init__(self, name: str, func: Callable, deps: Sequence[str], critical: bool):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.critical = critical
+
+
+class ExecutionPlan:
+    """
+    Small dependency graph of backend calls for one request.
+
+    Each step receives the results of its dependencies as positional arguments
+    and starts as soon as they are available, so independent calls overlap.
+    Critical steps are always waited for. Non-critical steps (recommendations,
+    extra details) are dropped once the deadline passes and the caller builds
+    a reduced answer from whatever finished in time.
+
+    Steps run in a copy of the caller's context, so remaining_budget() and the
+    request priority hold inside them, with the plan's deadline as the budget
+    when the caller has none.
+    """
+
+    def __init__(self, deadline: Optional[float] = None):
+        if deadline is None:
+            deadline = current_deadline() or time.monotonic() + default_request_budget()
+        self.deadline = deadline
+        self._steps: Dict[str, _Step] = {}
+        self.results: Dict[str, Any] = {}
+        self.skipped: List[str] = []
+        self.failed: List[str] = []
+        self.timed_out: List[str] = []
+
+    def step(self, name: str, func: Callable, deps: Sequence[str] = (), critical: bool = True) -> 'ExecutionPlan':
+        for dep in deps:
+            if dep not in self._steps:
+                raise ValueError(f"Step '{name}' depends on unknown step '{dep}'")
+        self._steps[name] = _Step(name, func, deps, critical)
+        return self
+
+    @property
+    def degraded(self) -> bool:
+        """True when a non-critical step failed or missed the deadline"""
+        return bool(self.failed or self.timed_out)
+
+    def run(self, executor: Executor) -> Dict[str, Any]:
+        """Run the plan on a thread pool and return the results by step name"""
+        remaining = dict(self._steps)
+        pending = {}
+
+        while True:
+            for step in self._take_ready(remaining):
+                args = [self.results[dep] for dep in step.deps]
+                pending[executor.submit(self._step_context().run, step.func, *args)] = step
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, timeout=self._wait_timeout(pending.values()), return_when=FIRST_COMPLETED)
+            if not done:
+                for future in self._drop_non_critical(pending):
+                    future.cancel()
+                continue
+
+            for future in done:
+                step = pending.pop(future)
+                try:
+                    self.results[step.name] = future.result()
+                except Exception as e:
+                    self._record_failure(step, e)
+
+        return self.results
+
+    async def run_async(self) -> Dict[str, Any]:
+        """Run the plan on the event loop; steps must be coroutine functions"""
+        remaining = dict(self._steps)
+        pending = {}
+
+        while True:
+            for step in self._take_ready(remaining):
+                args = [self.results[dep] for dep in step.deps]
+                pending[asyncio.ensure_future(step.func(*args))] = step
+
+            if not pending:
+                break
+
+            done, _ = await asyncio.wait(pending, timeout=self._wait_timeout(pending.values()),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                for task in self._drop_non_critical(pending):
+                    task.cancel()
+                continue
+
+            for task in done:
+                step = pending.pop(task)
+                try:
+                    self.results[step.name] = task.result()
+                except Exception as e:
+                    self._record_failure(step, e)
+
+        return self.results
+
+    def _step_context(self) -> contextvars.Context:
+        """A context per step: pool threads do not inherit the caller's, and one context cannot run twice at once"""
+        context = contextvars.copy_context()
+        if context.get(_request_deadline) is None:
+            context.run(_request_deadline.set, self.deadline)
+        return context
+
+    def _take_ready(self, remaining: Dict[str, _Step]) -> List[_Step]:
+        """Pop the steps whose dependencies finished, skipping those whose dependencies did not"""
+        expired = time.monotonic() >= self.deadline
+        ready = []
+        changed = True
+        while changed:
+            changed = False
+            for name, step in list(remaining.items()):
+                if any(dep in self.skipped or dep in self.failed or dep in self.timed_out for dep in step.deps):
+                    self.skipped.append(name)
+                    del remaining[name]
+                    changed = True
+                elif all(dep in self.results for dep in step.deps):
+                    del remaining[name]
+                    if expired and not step.critical:
+                        self.timed_out.append(name)
+                        changed = True
+                    else:
+                        ready.append(step)
+        return ready
+
+    def _wait_timeout(self, running) -> Optional[float]:
+        left = self.deadline - time.monotonic()
+        if left > 0:
+            return left
+        # Critical work is never dropped; wait for it past the deadline if needed
+        return None if any(step.critical for step in running) else 0.0
+
+    def _drop_non_critical(self, pending: Dict[Any, _Step]) -> List[Any]:
+        """Forget the non-critical steps still running once the deadline has passed"""
+        dropped = [handle for handle, step in pending.items() if not step.critical]
+        for handle in dropped:
+            self.timed_out.append(pending.pop(handle).name)
+        if dropped:
+            logger.info(f"Request budget exhausted, dropping steps: {self.timed_out}")
+        return dropped
+
+    def _record_failure(self, step: _Step, error: Exception) -> None:
+        if isinstance(error, SkipStep):
+            self.skipped.append(step.name)
+            return
+        if step.critical:
+            raise error
+        logger.warning(f"Non-critical step '{step.name}' failed: {str(error)}")
+        self.failed.append(step.name)
@@ -0,0 +1,352 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Deque, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from services.metrics import Counters
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token for English text)"""
+    return max(1, (len(text) + 3) // 4)
+
+
+def _channel_key(user_id: str, channel: str) -> str:
+    """Key of a user's channel in the Mongo store; the default channel is the bare user id"""
+    return f"{channel}:{user_id}" if channel else user_id
+
+
+class _Conversation:
+    __slots__ = ('messages', 'summary', 'tokens', 'bytes')
+
+    def __init__(self):
+        self.messages: Deque[Dict[str, str]] = deque()
+        self.summary: Optional[str] = None
+        self.tokens = 0
+        self.bytes = 0
+
+
+class _User:
+    __slots__ = ('channels', 'last_seen')
+
+    def __init__(self):
+        self.channels: Dict[str, _Conversation] = {}
+        self.last_seen = time.monotonic()
+
+
+class MemoryHistoryStore:
+    """
+    In-process conversation history.
+
+    Each user can keep several channels (e.g. ContextBuilder's 'intent' and
+    'chat'). Each channel is a ring buffer capped at `max_messages` messages
+    and `max_tokens` estimated tokens (the newest message is always kept), plus
+    an optional summary of older messages set by fold(). Users, with all their
+    channels, are kept in LRU order; those idle for `idle_ttl` seconds or
+    beyond `max_users` are dropped, so `max_users` counts people, not channels.
+    """
+
+    def __init__(self, max_messages: int = 5, max_tokens: int = 1000,
+                 max_users: int = 10000, idle_ttl: float = 3600.0):
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+
+        self._lock = threading.Lock()
+        self._users: "OrderedDict[str, _User]" = OrderedDict()
+        self._tokens = 0
+        self._bytes = 0
+        self.counters = Counters()
+
+    def append(self, user_id: str, role: str, content: str, channel: str = '') -> None:
+        tokens = estimate_tokens(content)
+        size = len(content.encode('utf-8'))
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                user = self._users[user_id] = _User()
+            self._users.move_to_end(user_id)
+            user.last_seen = time.monotonic()
+            conversation = user.channels.get(channel)
+            if conversation is None:
+                conversation = user.channels[channel] = _Conversation()
+
+            conversation.messages.append({'role': role, 'content': content})
+            conversation.tokens += tokens
+            conversation.bytes += size
+            self._tokens += tokens
+            self._bytes += size
+
+            while len(conversation.messages) > 1 and (
+                    len(conversation.messages) > self.max_messages or conversation.tokens > self.max_tokens):
+                self._drop_oldest(conversation)
+            self._evict()
+
+    def recent(self, user_id: str, limit: Optional[int] = None, channel: str = '') -> List[Dict[str, str]]:
+        """
+        The channel's most recent messages, oldest first, after the summary (as
+        a system message) when there is one; `limit` applies to the messages only
+        """
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                return []
+            if time.monotonic() - user.last_seen > self.idle_ttl:
+                self._remove(user_id)
+                self.counters.incr('idle_evictions')
+                return []
+            self._users.move_to_end(user_id)
+            conversation = user.channels.get(channel)
+            if conversation is None:
+                return []
+            messages = list(conversation.messages)
+            summary = conversation.summary
+        messages = messages[-limit:] if limit else messages
+        return ([{'role': 'system', 'content': summary}] if summary else []) + messages
+
+    def fold(self, user_id: str, summary: str, folded: List[Dict[str, str]], channel: str = '') -> bool:
+        """
+        Replace the channel's oldest messages, which must still be `folded`,
+        with `summary` in one step
+        Returns: False, changing nothing, when the channel no longer starts with `folded`
+        """
+        with self._lock:
+            user = self._users.get(user_id)
+            conversation = user.channels.get(channel) if user is not None else None
+            if conversation is None or list(islice(conversation.messages, len(folded))) != folded:
+                self.counters.incr('fold_conflicts')
+                return False
+            for _ in folded:
+                self._drop_oldest(conversation, counter='folded_messages')
+            self._set_summary(conversation, summary)
+            return True
+
+    def clear(self, user_id: str, channel: str = '') -> None:
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None or channel not in user.channels:
+                return
+            self._discard(user.channels.pop(channel))
+            if not user.channels:
+                del self._users[user_id]
+
+    def metrics(self) -> Dict[str, object]:
+        with self._lock:
+            users = len(self._users)
+            messages = sum(len(c.messages) for user in self._users.values() for c in user.channels.values())
+            tokens, content_bytes = self._tokens, self._bytes
+        return {
+            'backend': 'memory',
+            'users': users,
+            'messages': messages,
+            'tokens': tokens,
+            'content_bytes': content_bytes,
+            **self.counters.snapshot(),
+        }
+
+    def _drop_oldest(self, conversation: _Conversation, counter: str = 'trimmed_messages') -> None:
+        message = conversation.messages.popleft()
+        tokens = estimate_tokens(message['content'])
+        size = len(message['content'].encode('utf-8'))
+        conversation.tokens -= tokens
+        conversation.bytes -= size
+        self._tokens -= tokens
+        self._bytes -= size
+        self.counters.incr(counter)
+
+    def _set_summary(self, conversation: _Conversation, summary: Optional[str]) -> None:
+        # The summary is counted in the size gauges but not against the message caps
+        for sign, text in ((-1, conversation.summary), (1, summary)):
+            if text:
+                self._tokens += sign * estimate_tokens(text)
+                self._bytes += sign * len(text.encode('utf-8'))
+        conversation.summary = summary
+
+    def _discard(self, conversation: _Conversation) -> None:
+        """Take a removed channel out of the size gauges"""
+        self._tokens -= conversation.tokens
+        self._bytes -= conversation.bytes
+        self._set_summary(conversation, None)
+
+    def _remove(self, user_id: str) -> None:
+        for conversation in self._users.pop(user_id).channels.values():
+            self._discard(conversation)
+
+    def _evict(self) -> None:
+        # The OrderedDict is in last-use order, so idle users are at the front
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._users:
+            user_id, user = next(iter(self._users.items()))
+            if user.last_seen >= cutoff:
+                break
+            self._remove(user_id)
+            self.counters.incr('idle_evictions')
+        while len(self._users) > self.max_users:
+            self._remove(next(iter(self._users)))
+            self.counters.incr('lru_evictions')
+
+
+class MongoHistoryStore:
+    """
+    Conversation history in a MongoDB capped collection, shared by every worker
+    and kept across restarts. The capped size bounds total storage; the same
+    per-user message, token and idle limits as MemoryHistoryStore are applied
+    when history is read. Capped collections do not allow deletes, so clearing
+    a user's history writes a marker that reads stop at.
+
+    A user's summary lives in a regular `<collection>_summaries` document with
+    the id of the last message it covers (`through`); reads skip the messages
+    up to it. Folding moves `through` forward with one conditional write, so
+    workers folding the same history at once cannot lose messages: the
+    second write finds `through` changed and is refused.
+    """
+
+    def __init__(self, db, collection_name: str = 'conversation_history', capped_bytes: int = 64 << 20,
+                 max_messages: int = 5, max_tokens: int = 1000, idle_ttl: float = 3600.0):
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.idle_ttl = idle_ttl
+        self.capped_bytes = capped_bytes
+
+        if collection_name not in db.list_collection_names():
+            try:
+                db.create_collection(collection_name, capped=True, size=capped_bytes)
+            except Exception as e:
+                # Another worker created it first
+                logger.debug(f"History collection not created: {str(e)}")
+        self.collection = db[collection_name]
+        self.collection.create_index([('user_id', 1), ('_id', -1)])
+        self.summaries = db[f'{collection_name}_summaries']
+        self.counters = Counters()
+
+    def append(self, user_id: str, role: str, content: str, channel: str = '') -> None:
+        try:
+            self.collection.insert_one({
+                'user_id': _channel_key(user_id, channel), 'role': role, 'content': content,
+                'tokens': estimate_tokens(content), 'created_at': datetime.now(timezone.utc),
+            })
+            self.counters.incr('appends')
+        except Exception as e:
+            self.counters.incr('errors')
+            logger.warning(f"History write failed for {user_id}: {str(e)}")
+
+    def recent(self, user_id: str, limit: Optional[int] = None, channel: str = '') -> List[Dict[str, str]]:
+        """
+        The channel's most recent messages, oldest first, after the summary (as
+        a system message) when there is one; `limit` applies to the messages only
+        """
+        try:
+            summary, docs = self._window(_channel_key(user_id, channel))
+        except Exception as e:
+            self.counters.incr('errors')
+            logger.warning(f"History read failed for {user_id}: {str(e)}")
+            return []
+        messages = [{'role': doc['role'], 'content': doc['content']} for doc in docs]
+        messages = messages[-limit:] if limit else messages
+        return ([{'role': 'system', 'content': summary['content']}] if summary else []) + messages
+
+    def fold(self, user_id: str, summary: str, folded: List[Dict[str, str]], channel: str = '') -> bool:
+        """
+        Replace the channel's oldest messages, which must still be `folded`,
+        with `summary` in one conditional write
+        Returns: False, changing nothing, when the channel no longer starts with
+        `folded` or another worker folded it first
+        """
+        key = _channel_key(user_id, channel)
+        try:
+            current, docs = self._window(key)
+            if not folded or [{'role': doc['role'], 'content': doc['content']}
+                              for doc in docs[:len(folded)]] != folded:
+                self.counters.incr('fold_conflicts')
+                return False
+            # Matches only while `through` is what this read saw; with no summary
+            # yet, a concurrent first fold makes the upsert hit a duplicate _id
+            self.summaries.update_one(
+                {'_id': key, 'through': current['through'] if current else None},
+                {'$set': {'content': summary, 'through': docs[len(folded) - 1]['_id'],
+                          'updated_at': datetime.now(timezone.utc)}},
+                upsert=True,
+            )
+            self.counters.incr('folds')
+            return True
+        except DuplicateKeyError:
+            self.counters.incr('fold_conflicts')
+            return False
+        except Exception as e:
+            self.counters.incr('errors')
+            logger.warning(f"History fold failed for {user_id}: {str(e)}")
+            return False
+
+    def _window(self, key: str):
+        """
+        The channel's summary document and the message documents after it,
+        oldest first, within the message, token and idle limits
+        Returns: (summary document or None, message documents)
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.idle_ttl)
+        summary = self.summaries.find_one({'_id': key, 'updated_at': {'$gte': cutoff}})
+        query = {'user_id': key, 'created_at': {'$gte': cutoff}}
+        if summary:
+            query['_id'] = {'$gt': summary['through']}
+        docs, tokens = [], 0
+        for doc in self.collection.find(query).sort('_id', -1).limit(self.max_messages + 1):
+            if doc.get('cleared'):
+                # Cleared after the summary was written
+                summary = None
+                break
+            if len(docs) >= self.max_messages:
+                break
+            tokens += doc.get('tokens', 0)
+            if docs and tokens > self.max_tokens:
+                break
+            docs.append(doc)
+        docs.reverse()
+        return summary, docs
+
+    def clear(self, user_id: str, channel: str = '') -> None:
+        key = _channel_key(user_id, channel)
+        try:
+            self.collection.insert_one({'user_id': key, 'cleared': True,
+                                        'created_at': datetime.now(timezone.utc)})
+            self.summaries.delete_one({'_id': key})
+        except Exception as e:
+            logger.warning(f"History clear failed for {user_id}: {str(e)}")
+
+    def metrics(self) -> Dict[str, object]:
+        metrics: Dict[str, object] = {'backend': 'mongo', 'capped_bytes': self.capped_bytes,
+                                      **self.counters.snapshot()}
+        try:
+            stats = self.collection.database.command('collStats', self.collection.name)
+            metrics['size_bytes'] = stats.get('size')
+            metrics['messages'] = stats.get('count')
+        except Exception:
+            pass
+        return metrics
+
+
+def build_history_store_from_env():
+    """
+    Build the history store selected by OPENAI_HISTORY_BACKEND ('memory' or
+    'mongo'), with limits from the OPENAI_HISTORY_* environment variables.
+    """
+    limits = {
+        'max_messages': int(os.getenv('OPENAI_HISTORY_MESSAGES', '5')),
+        'max_tokens': int(os.getenv('OPENAI_HISTORY_TOKENS', '1000')),
+        'idle_ttl': float(os.getenv('OPENAI_HISTORY_IDLE_TTL', '3600')),
+    }
+    if os.getenv('OPENAI_HISTORY_BACKEND', 'memory').lower() == 'mongo':
+        from pymongo import MongoClient
+        client = MongoClient(os.getenv('MONGODB_URI'))
+        return MongoHistoryStore(client.movie_score,
+                                 capped_bytes=int(os.getenv('OPENAI_HISTORY_CAPPED_BYTES', str(64 << 20))),
+                                 **limits)
+    return MemoryHistoryStore(max_users=int(os.getenv('OPENAI_HISTORY_USERS', '10000')), **limits)
@@ -0,0 +1,396 @@
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services.execution_plan import remaining_budget
+from services.metrics import LatencyStats, Counters
+from services.rate_limiter import RateLimitExceeded, RateLimiter, get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# Client errors that mean every call will fail (bad key, throttled), so they trip the breaker
+BREAKER_FAILURE_STATUS = {401, 403, 429}
+
+
+class TransportError(requests.exceptions.RequestException):
+    """Raised for failures of the sync and async transport alike"""
+
+
+class CircuitOpenError(TransportError):
+    """Raised without touching the network while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After `failure_threshold` failures in a row the circuit opens and calls fail
+    fast for `reset_timeout` seconds. Then a single trial call is let through
+    (half-open); its outcome closes or re-opens the circuit. A trial that ends
+    with neither outcome (cancelled, or an unexpected error) is released with
+    end_trial(), so the next call can be the trial instead.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        # Token of the half-open trial in flight, if any
+        self._trial: Optional[object] = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def allow(self) -> bool:
+        return self.admit()[0]
+
+    def admit(self) -> Tuple[bool, Optional[object]]:
+        """
+        Decide whether a call may go ahead
+        Returns: (allowed, trial token when the call is the half-open trial)
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True, None
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False, None
+            if self._trial is not None:
+                return False, None
+            self._trial = object()
+            return True, self._trial
+
+    def end_trial(self, trial: object) -> None:
+        """Release `trial` if it is still in flight; a no-op once its outcome was recorded"""
+        with self._lock:
+            if self._trial is trial:
+                self._trial = None
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial = None
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+def _parse_timeouts(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Parse 'search=2:5,details=2:8' into {'search': (2.0, 5.0), ...}"""
+    timeouts = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, values = item.partition('=')
+        connect, _, read = values.partition(':')
+        timeouts[name.strip()] = (float(connect), float(read or connect))
+    return timeouts
+
+
+class HTTPTransport:
+    """
+    Shared, pooled HTTP transport for a JSON API.
+
+    One keep-alive `requests.Session` (and, for the asyncio path, one
+    `httpx.AsyncClient`) is reused for every call. Each call gets per-endpoint
+    connect/read timeouts, bounded retries with jittered exponential backoff on
+    429/5xx, and goes through a circuit breaker. A `Retry-After` from the
+    server is waited out in full; when it is longer than `retry_after_max` or
+    the request budget left, the call fails instead of retrying early. Each
+    attempt's timeouts are cut to the request budget left.
+    Every attempt, retries included, first takes a token from the shared rate
+    limiter under the transport's name. Latency and error counters are kept
+    per endpoint.
+    """
+
+    def __init__(self, name: str,
+                 timeouts: Optional[Dict[str, Tuple[float, float]]] = None,
+                 default_timeout: Tuple[float, float] = (3.05, 10.0),
+                 max_retries: int = 2,
+                 backoff_base: float = 0.25,
+                 backoff_max: float = 4.0,
+                 retry_after_max: float = 30.0,
+                 pool_size: int = 20,
+                 breaker: Optional[CircuitBreaker] = None,
+                 limiter: Optional[RateLimiter] = None):
+        self.name = name
+        self.timeouts = timeouts or {}
+        self.default_timeout = default_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._async_client = None
+
+        self._latency: Dict[str, LatencyStats] = {}
+        self._latency_lock = threading.Lock()
+        self.counters = Counters()
+
+    @classmethod
+    def from_env(cls, name: str, prefix: str,
+                 timeouts: Optional[Dict[str, Tuple[float, float]]] = None) -> 'HTTPTransport':
+        """Build a transport configured by <PREFIX>_* environment variables"""
+        timeouts = dict(timeouts or {})
+        timeouts.update(_parse_timeouts(os.getenv(f'{prefix}_TIMEOUTS', '')))
+        return cls(
+            name,
+            timeouts=timeouts,
+            max_retries=int(os.getenv(f'{prefix}_MAX_RETRIES', '2')),
+            backoff_base=float(os.getenv(f'{prefix}_BACKOFF_BASE', '0.25')),
+            backoff_max=float(os.getenv(f'{prefix}_BACKOFF_MAX', '4.0')),
+            retry_after_max=float(os.getenv(f'{prefix}_RETRY_AFTER_MAX', '30')),
+            pool_size=int(os.getenv(f'{prefix}_POOL_SIZE', '20')),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv(f'{prefix}_BREAKER_THRESHOLD', '5')),
+                reset_timeout=float(os.getenv(f'{prefix}_BREAKER_RESET', '30')),
+            ),
+            limiter=get_rate_limiter(),
+        )
+
+    def get(self, endpoint: str, url: str, params: Dict[str, Any]) -> Any:
+        """GET `url` and return the decoded JSON body, retrying transient failures"""
+        attempt = 0
+        while True:
+            self._throttle(endpoint)
+            timeout = self._attempt_timeout(endpoint)
+            trial = self._before_attempt(endpoint)
+            try:
+                started = time.perf_counter()
+                try:
+                    response = self.session.get(url, params=params, timeout=timeout)
+                except requests.exceptions.RequestException as e:
+                    self._record_failure(endpoint, started, 'network')
+                    if attempt >= self.max_retries or not self._sleep_before_retry(endpoint, attempt, None):
+                        raise TransportError(f"{self.name} {endpoint} failed: {str(e)}") from e
+                    attempt += 1
+                    continue
+
+                if response.status_code in RETRYABLE_STATUS:
+                    self._record_failure(endpoint, started, str(response.status_code))
+                    retry_after = response.headers.get('Retry-After')
+                    if attempt >= self.max_retries or not self._sleep_before_retry(endpoint, attempt, retry_after):
+                        raise TransportError(f"{self.name} {endpoint} returned HTTP {response.status_code}",
+                                             response=response)
+                    attempt += 1
+                    continue
+
+                return self._finish(endpoint, started, response.status_code, response.json, response)
+            finally:
+                if trial is not None:
+                    self.breaker.end_trial(trial)
+
+    async def get_async(self, endpoint: str, url: str, params: Dict[str, Any]) -> Any:
+        """Asyncio variant of get() sharing the breaker and metrics"""
+        import asyncio
+        import httpx
+
+        client = self._get_async_client()
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                try:
+                    await self.limiter.acquire_async(self.name, endpoint)
+                except RateLimitExceeded as e:
+                    self.counters.incr(f'{endpoint}.rate_limited')
+                    raise TransportError(str(e)) from e
+            connect, read = self._attempt_timeout(endpoint)
+            trial = self._before_attempt(endpoint)
+            try:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(url, params=params,
+                                                timeout=httpx.Timeout(read, connect=connect))
+                except httpx.HTTPError as e:
+                    self._record_failure(endpoint, started, 'network')
+                    delay = self._retry_delay(endpoint, attempt, None)
+                    if attempt >= self.max_retries or delay is None:
+                        raise TransportError(f"{self.name} {endpoint} failed: {str(e)}") from e
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+
+                if response.status_code in RETRYABLE_STATUS:
+                    self._record_failure(endpoint, started, str(response.status_code))
+                    delay = self._retry_delay(endpoint, attempt, response.headers.get('Retry-After'))
+                    if attempt >= self.max_retries or delay is None:
+                        raise TransportError(f"{self.name} {endpoint} returned HTTP {response.status_code}")
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+
+                return self._finish(endpoint, started, response.status_code, response.json)
+            finally:
+                # A cancelled or crashed half-open trial must not leave the breaker stuck open
+                if trial is not None:
+                    self.breaker.end_trial(trial)
+
+    def metrics(self) -> Dict[str, object]:
+        with self._latency_lock:
+            latency = {endpoint: stats.snapshot() for endpoint, stats in self._latency.items()}
+        return {
+            'breaker': self.breaker.state,
+            'counters': self.counters.snapshot(),
+            'latency': latency,
+        }
+
+    def warm_up(self, url: str) -> bool:
+        """Open the first pooled connection (DNS, TCP and TLS) without a counted API call"""
+        try:
+            self.session.head(url, timeout=self.default_timeout)
+            return True
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"{self.name} warm-up failed: {str(e)}")
+            return False
+
+    def close(self) -> None:
+        self.session.close()
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def _get_async_client(self):
+        if self._async_client is None:
+            import httpx
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.pool_size * 5,
+                                    max_keepalive_connections=self.pool_size)
+            )
+        return self._async_client
+
+    def _throttle(self, endpoint: str) -> None:
+        """Wait for a rate limit token, failing like a transport error if none comes in time"""
+        if self.limiter is None:
+            return
+        try:
+            self.limiter.acquire(self.name, endpoint)
+        except RateLimitExceeded as e:
+            self.counters.incr(f'{endpoint}.rate_limited')
+            raise TransportError(str(e)) from e
+
+    def _attempt_timeout(self, endpoint: str) -> Tuple[float, float]:
+        """
+        The endpoint's (connect, read) timeouts, cut to the request budget left so
+        a slow attempt cannot outlive the request. Fails without a call when the
+        budget is already spent.
+        """
+        connect, read = self.timeouts.get(endpoint, self.default_timeout)
+        left = remaining_budget()
+        if left is None:
+            return connect, read
+        if left <= 0:
+            self.counters.incr(f'{endpoint}.budget_exhausted')
+            raise TransportError(f"{self.name} {endpoint} not attempted: request budget spent")
+        return min(connect, left), min(read, left)
+
+    def _before_attempt(self, endpoint: str) -> Optional[object]:
+        """
+        Let an attempt through the breaker or fail fast
+        Returns: the trial token when the attempt is the half-open trial
+        """
+        allowed, trial = self.breaker.admit()
+        if not allowed:
+            self.counters.incr(f'{endpoint}.short_circuited')
+            raise CircuitOpenError(f"{self.name} circuit open, failing fast")
+        self.counters.incr(f'{endpoint}.calls')
+        return trial
+
+    def _finish(self, endpoint: str, started: float, status: int, decode, response=None) -> Any:
+        self._stats(endpoint).record(time.perf_counter() - started)
+        if status >= 400:
+            # Other client errors (e.g. 404) are about the request, not the service:
+            # they neither trip the breaker nor reset its failure count
+            if status in BREAKER_FAILURE_STATUS:
+                self.breaker.record_failure()
+            self.counters.incr(f'{endpoint}.errors.{status}')
+            raise TransportError(f"{self.name} {endpoint} returned HTTP {status}", response=response)
+        try:
+            payload = decode()
+        except ValueError as e:
+            # An HTML error page or a cut-off body from a proxy counts as an outage
+            self.counters.incr(f'{endpoint}.errors.decode')
+            self.breaker.record_failure()
+            raise TransportError(f"{self.name} {endpoint} returned a body that is not JSON",
+                                 response=response) from e
+        self.breaker.record_success()
+        return payload
+
+    def _record_failure(self, endpoint: str, started: float, kind: str) -> None:
+        self._stats(endpoint).record(time.perf_counter() - started)
+        self.counters.incr(f'{endpoint}.errors.{kind}')
+        self.breaker.record_failure()
+
+    def _retry_delay(self, endpoint: str, attempt: int, retry_after: Optional[str]) -> Optional[float]:
+        """
+        Backoff before the next attempt, or None to give up: when it would overrun
+        the request budget, or the server asks for a longer wait than retry_after_max
+        """
+        delay = _parse_retry_after(retry_after)
+        if delay is None:
+            # Full jitter: uniform in [0, base * 2^attempt], capped
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        elif delay > self.retry_after_max:
+            # Retrying sooner than the server asked would only be throttled again
+            self.counters.incr(f'{endpoint}.retry_after_exceeded')
+            return None
+
+        left = remaining_budget()
+        if left is not None and delay >= left:
+            return None
+        self.counters.incr(f'{endpoint}.retries')
+        return delay
+
+    def _sleep_before_retry(self, endpoint: str, attempt: int, retry_after: Optional[str]) -> bool:
+        delay = self._retry_delay(endpoint, attempt, retry_after)
+        if delay is None:
+            return False
+        time.sleep(delay)
+        return True
+
+    def _stats(self, endpoint: str) -> LatencyStats:
+        with self._latency_lock:
+            if endpoint not in self._latency:
+                self._latency[endpoint] = LatencyStats()
+            return self._latency[endpoint]
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After is either delta-seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
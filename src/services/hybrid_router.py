@@ -0,0 +1,99 @@
+import os
+import re
+import time
+from typing import Dict, NamedTuple, Optional
+
+from services.metrics import Counters, LatencyStats, SampleStats
+from services.nlp_service import NLPAnalysis, NLPService, TITLE_INTENTS
+
+# Wording that usually needs more than one of the template answers
+COMPLEX_PATTERN = re.compile(
+    r"\b(?:and|or|but|vs|versus|compare|compared|than|instead|recommend|suggest|why|should i)\b"
+)
+
+
+class RouteDecision(NamedTuple):
+    route: str  # 'local' or 'openai'
+    reason: str  # 'confident', 'low_confidence', 'complex', 'unknown' or 'no_title'
+    analysis: NLPAnalysis
+
+
+class HybridRouter:
+    """
+    Decides per message whether the local NLP answer is good enough or the
+    message needs the OpenAI path.
+
+    A message stays local when NLPService is at least `min_confidence` sure of
+    a known intent (with a title where the intent needs one) and the message
+    is short and simple. Everything else is escalated. Counts and latencies
+    per route show the time saved, and the chat completions OpenAI-routed
+    messages actually made (which depend on the OpenAI mode and response
+    cache hits) estimate how many LLM calls were avoided.
+    """
+
+    def __init__(self, nlp_service: NLPService, min_confidence: float = 0.8, max_words: int = 12):
+        self.nlp_service = nlp_service
+        self.min_confidence = min_confidence
+        self.max_words = max_words
+        self.counters = Counters()
+        self.latency = {'local': LatencyStats(), 'openai': LatencyStats()}
+        self.classify_latency = LatencyStats()
+        self.openai_calls = SampleStats()
+
+    @classmethod
+    def from_env(cls, nlp_service: NLPService) -> Optional['HybridRouter']:
+        """Router configured by HYBRID_MIN_CONFIDENCE and HYBRID_MAX_WORDS when OPENAI_ROUTING=hybrid"""
+        if os.getenv('OPENAI_ROUTING', 'always').lower() != 'hybrid' or nlp_service is None:
+            return None
+        return cls(nlp_service,
+                   min_confidence=float(os.getenv('HYBRID_MIN_CONFIDENCE', '0.8')),
+                   max_words=int(os.getenv('HYBRID_MAX_WORDS', '12')))
+
+    def route(self, message: str) -> RouteDecision:
+        started = time.perf_counter()
+        analysis = self.nlp_service.analyze(message)
+        self.classify_latency.record(time.perf_counter() - started)
+
+        clean_message = message.lower().strip()
+        if analysis.intent == 'unknown':
+            reason = 'unknown'
+        elif analysis.intent in TITLE_INTENTS and not analysis.title:
+            reason = 'no_title'
+        elif analysis.confidence < self.min_confidence:
+            reason = 'low_confidence'
+        elif len(clean_message.split()) > self.max_words or COMPLEX_PATTERN.search(clean_message):
+            reason = 'complex'
+        else:
+            reason = 'confident'
+
+        decision = RouteDecision('local' if reason == 'confident' else 'openai', reason, analysis)
+        self.counters.incr(f"{decision.route}.{reason}" if decision.route == 'openai' else 'local')
+        self.counters.incr(f"intent.{analysis.intent}.{decision.route}")
+        return decision
+
+    def record(self, decision: RouteDecision, seconds: float, llm_calls: int = 0) -> None:
+        """Record how long answering a routed message took and the chat completions it made"""
+        self.latency[decision.route].record(seconds)
+        if decision.route == 'openai':
+            self.openai_calls.record(llm_calls)
+
+    def metrics(self) -> Dict[str, object]:
+        counts = self.counters.snapshot()
+        local = self.latency['local'].snapshot()
+        openai = self.latency['openai'].snapshot()
+        calls = self.openai_calls.snapshot()
+        # Estimated from the average cost of each route; zero until both have traffic
+        saved = 0.0
+        if local['count'] and openai['count']:
+            saved = max(0.0, openai['avg_ms'] - local['avg_ms']) * local['count'] / 1000
+        # Local messages times the completions an OpenAI-routed message made on average
+        avoided = 0.0
+        if calls['count']:
+            avoided = counts.get('local', 0) * self.openai_calls.total / calls['count']
+        return {
+            'routes': counts,
+            'latency': {'local': local, 'openai': openai, 'classify': self.classify_latency.snapshot()},
+            'llm_calls_per_openai_message': calls,
+            'llm_calls_avoided': round(avoided),
+            'latency_saved_seconds': round(saved, 2),
+        }
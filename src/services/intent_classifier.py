@@ -0,0 +1,170 @@
+import json
+import os
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services.cache import normalize_query
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+DEFAULT_MODEL_PATH = os.path.join(DATA_DIR, 'intent_model.npz')
+DEFAULT_CORPUS_PATH = os.path.join(DATA_DIR, 'intent_corpus.jsonl')
+# Frozen evaluation messages: never trained on, and never edited to fit a model
+DEFAULT_HELDOUT_PATH = os.path.join(DATA_DIR, 'intent_heldout.jsonl')
+
+
+def _bucket(feature: str, n_features: int) -> int:
+    # crc32 is stable across processes, unlike hash() on str
+    return zlib.crc32(feature.encode('utf-8')) % n_features
+
+
+def extract_features(text: str, n_features: int, char_ngrams: Tuple[int, int] = (3, 5)) -> Dict[int, float]:
+    """
+    Hashed features of a message: word unigrams and bigrams plus character
+    n-grams inside each word, L2-normalised
+    Returns: {bucket: weight}
+    """
+    words = normalize_query(text).split() or ['<empty>']
+    features: Dict[int, float] = {}
+
+    def add(feature: str) -> None:
+        index = _bucket(feature, n_features)
+        features[index] = features.get(index, 0.0) + 1.0
+
+    padded = ['<s>'] + words + ['</s>']
+    for word in words:
+        add(f"w:{word}")
+        marked = f"<{word}>"
+        for n in range(char_ngrams[0], char_ngrams[1] + 1):
+            for i in range(len(marked) - n + 1):
+                add(f"c:{marked[i:i + n]}")
+    for first, second in zip(padded, padded[1:]):
+        add(f"b:{first} {second}")
+
+    norm = sum(value * value for value in features.values()) ** 0.5
+    return {index: value / norm for index, value in features.items()}
+
+
+class IntentClassifier:
+    """
+    Multinomial logistic regression over hashed n-gram features, in NumPy.
+
+    Small enough to keep in memory for every worker (labels x n_features floats)
+    and fast enough to classify a message in tens of microseconds.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, labels: Sequence[str], n_features: int,
+                 heldout: Optional[Dict[str, float]] = None):
+        self.weights = weights.astype(np.float32)
+        self.bias = bias.astype(np.float32)
+        self.labels = list(labels)
+        self.n_features = n_features
+        # Held-out accuracy recorded by train_intent_classifier.py (see heldout_report)
+        self.heldout = heldout
+
+    @classmethod
+    def train(cls, texts: Sequence[str], labels: Sequence[str], n_features: int = 4096,
+              epochs: int = 300, learning_rate: float = 1.0, l2: float = 1e-4) -> 'IntentClassifier':
+        """Fit on labelled messages with full-batch gradient descent on the cross-entropy"""
+        classes = sorted(set(labels))
+        targets = np.zeros((len(texts), len(classes)), dtype=np.float32)
+        for row, label in enumerate(labels):
+            targets[row, classes.index(label)] = 1.0
+
+        features = np.zeros((len(texts), n_features), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for index, value in extract_features(text, n_features).items():
+                features[row, index] = value
+
+        weights = np.zeros((n_features, len(classes)), dtype=np.float32)
+        bias = np.zeros(len(classes), dtype=np.float32)
+        for _ in range(epochs):
+            probabilities = _softmax(features @ weights + bias)
+            error = (probabilities - targets) / len(texts)
+            weights -= learning_rate * (features.T @ error + l2 * weights)
+            bias -= learning_rate * error.sum(axis=0)
+        return cls(weights, bias, classes, n_features)
+
+    @classmethod
+    def load(cls, path: str) -> 'IntentClassifier':
+        with np.load(path) as data:
+            config = json.loads(str(data['config']))
+            return cls(data['weights'], data['bias'], config['labels'], config['n_features'],
+                       config.get('heldout'))
+
+    @classmethod
+    def from_env(cls) -> Optional['IntentClassifier']:
+        """
+        Load the model at INTENT_MODEL (default data/intent_model.npz), or None when
+        absent or when its held-out accuracy on confident predictions is below
+        INTENT_MODEL_MIN_ACCURACY (default 0.9; 0 loads models without a report)
+        """
+        path = os.getenv('INTENT_MODEL', DEFAULT_MODEL_PATH)
+        if not path or not os.path.exists(path):
+            return None
+        model = cls.load(path)
+        min_accuracy = float(os.getenv('INTENT_MODEL_MIN_ACCURACY', '0.9'))
+        accuracy = model.heldout.get('confident_accuracy') if model.heldout else None
+        if min_accuracy > 0 and (accuracy is None or accuracy < min_accuracy):
+            print(f"Intent model {path} not used: held-out accuracy {accuracy} is below {min_accuracy}")
+            return None
+        return model
+
+    def save(self, path: str) -> None:
+        config = json.dumps({'labels': self.labels, 'n_features': self.n_features, 'heldout': self.heldout})
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_path, weights=self.weights, bias=self.bias, config=np.array(config))
+        os.replace(tmp_path, path)
+
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        features = extract_features(text, self.n_features)
+        indices = np.fromiter(features.keys(), dtype=np.int64, count=len(features))
+        values = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+        probabilities = _softmax(values @ self.weights[indices] + self.bias)
+        return dict(zip(self.labels, probabilities.tolist()))
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """
+        Most likely intent of a message
+        Returns: (intent, probability)
+        """
+        probabilities = self.predict_proba(text)
+        intent = max(probabilities, key=probabilities.get)
+        return intent, probabilities[intent]
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    scores = scores - scores.max(axis=-1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def load_corpus(path: str) -> List[Dict]:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def heldout_report(scored: Sequence[Tuple[Dict, str, float]], min_confidence: float) -> Dict[str, float]:
+    """
+    Accuracy of predictions on the held-out set (from evaluate): over every
+    message, and over the ones at or above `min_confidence`, which are the ones
+    NLPService uses
+    """
+    confident = [(row, intent) for row, intent, probability in scored if probability >= min_confidence]
+    return {
+        'messages': len(scored),
+        'accuracy': round(sum(1 for row, intent, _ in scored if intent == row['intent']) / max(len(scored), 1), 4),
+        'min_confidence': min_confidence,
+        'coverage': round(len(confident) / max(len(scored), 1), 4),
+        'confident_accuracy': round(sum(1 for row, intent in confident if intent == row['intent'])
+                                    / max(len(confident), 1), 4),
+    }
+
+
+def evaluate(model: IntentClassifier, rows: Iterable[Dict]) -> List[Tuple[Dict, str, float]]:
+    """
+    Score labelled rows the model was not trained on
+    Returns: [(row, predicted intent, probability)]
+    """
+    return [(row, *model.predict(row['text'])) for row in rows]
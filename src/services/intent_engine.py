@@ -0,0 +1,75 @@
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+# Trailing qualifiers that belong to the question, not the title
+_QUALIFIERS = r"(?:\s+(?:any good|worth watching|worth it|good|recommended|about|like))?"
+_END = r"\s*[?!.]*\s*$"
+# When a movie was watched, and "seen it already:" before the title
+_WHEN = r"(?:\s+(?:yesterday|today|tonight|last night|this (?:morning|afternoon|evening|week)|again))?"
+_ALREADY = r"(?:it (?:already|before)\s*[:,-]\s*)?"
+
+
+class IntentRule(NamedTuple):
+    intent: str
+    pattern: str
+    priority: int
+
+
+# Higher priority wins when several rules match. Patterns are matched against
+# the lower-cased message; a capture group, if present, is the movie title.
+DEFAULT_RULES: List[IntentRule] = [
+    IntentRule('list_watched',
+               r"\b(?:list|show|what are|what have i|which)(?: me)? (?:movies have i watched|movies i've watched"
+               r"|my watched movies|my watched list|watched movies|watched)\b", 100),
+    IntentRule('list_watched', r"\bwhat movies have i (?:watched|seen)\b", 100),
+    IntentRule('list_watched', r"^\s*(?:my (?:watched )?(?:movies|list)|(?:my )?watched(?: movies| list)?)" + _END, 100),
+    IntentRule('mark_watched',
+               r"\b(?:i (?:have )?(?:just |recently )?(?:watched|seen|saw)|i've (?:just |recently )?(?:watched|seen)"
+               r"|seen|saw|watched|completed|finished)\s+" + _ALREADY + r"(?:watching\s+)?(.+?)" + _WHEN + _END, 80),
+    IntentRule('mark_watched',
+               r"\b(?:i (?:have )?finished|i've finished|done with|completed)\s+(?:watching\s+)?(.+?)" + _WHEN + _END, 80),
+    IntentRule('mark_watched',
+               r"\b(?:add|mark|put)\s+(.+?)(?:\s+as watched|\s+to my watched list|\s+to watched list)" + _END, 85),
+    IntentRule('help',
+               r"\b(?:help|assist|support|how to use|how do i use|instructions|commands"
+               r"|what can (?:you|this bot|it) do|how does this work)\b", 70),
+    IntentRule('get_info',
+               r"\b(?:tell me about|what do you know about|details on|(?:the )?(?:score|rating) (?:of|for)|how good is"
+               r"|info(?:rmation)?(?:\s+(?:on|about))?|about)\s+(.+?)" + _QUALIFIERS + _END, 60),
+    IntentRule('get_info', r"\b(?:how is|how was|is|was)\s+(.+?)" + _QUALIFIERS + _END, 50),
+    IntentRule('get_info', r"\b(?:what is|what's)\s+(.+?)" + _QUALIFIERS + _END, 40),
+    IntentRule('get_info', r"^\s*(.+?)\s+(?:worth watching|any good|recommended)" + _END, 30),
+]
+
+
+class IntentEngine:
+    """
+    Rule-based intent matcher compiled into a single regular expression.
+
+    Each rule becomes one branch of an alternation anchored at the start of the
+    message and ordered by priority, so one `match` call scans the message and
+    the first branch that matches is the highest-priority rule. Messages no rule
+    matches return None and are left to the caller's NER fallback.
+    """
+
+    def __init__(self, rules: Optional[List[IntentRule]] = None):
+        # sorted() is stable, so rules of equal priority keep their listed order
+        self.rules = sorted(rules or DEFAULT_RULES, key=lambda rule: -rule.priority)
+        branches = []
+        for index, rule in enumerate(self.rules):
+            body = re.sub(r"(?<!\\)\((?!\?)", f"(?P<e{index}>", rule.pattern, count=1)
+            branches.append(f"(?P<r{index}>.*?{body})")
+        self._regex = re.compile("^(?:" + "|".join(branches) + ")", re.DOTALL)
+
+    def match(self, message: str) -> Optional[Tuple[str, Optional[str]]]:
+        """
+        Match a lower-cased, stripped message
+        Returns: (intent, entity) or None when no rule matches
+        """
+        found = self._regex.match(message)
+        if not found:
+            return None
+        index = int(found.lastgroup[1:])
+        entity = found.group(f"e{index}") if f"e{index}" in self._regex.groupindex else None
+        entity = entity.strip() if entity else None
+        return self.rules[index].intent, entity or None
@@ -2,17 +2,53 @@ from typing import Tuple, Optional, List, Dict, Any
 from services.tmdb_service import TMDbService
 from services.db_service import DatabaseService
 from services.whatsapp_service import WhatsAppService
-from services.openai_service import OpenAIService
+from services.openai_service import OpenAIService, RESPONSE_FAILURE_MESSAGE, counting_calls
+from services.openai_client import OpenAIDeadlineExceeded
+from services.hybrid_router import HybridRouter
+from concurrent.futures import ThreadPoolExecutor
+from services.execution_plan import ExecutionPlan, SkipStep, request_budget
+import asyncio
 import logging
 import os
+import time
 
 logger = logging.getLogger(__name__)
 
+UNKNOWN_REQUEST_MESSAGE = (
+    "Sorry, I couldn't understand your request. Try saying 'Tell me about [movie name]', "
+    "'I watched [movie name]', or 'help' for more options."
+)
+OPENAI_FAILURE_MESSAGE = (
+    "I'm having trouble understanding your request right now. "
+    "Could you try again with a simpler question about movies?"
+)
+# Movie fields passed back to the model by the get_movie_info and mark_watched tools
+TOOL_MOVIE_FIELDS = ('title', 'release_date', 'vote_average', 'overview')
+
 class MessageHandler:
-    def __init__(self):
+    def __init__(self, container=None):
+        # Runs the independent backend calls of a request concurrently
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('PLAN_WORKERS', '16')),
+            thread_name_prefix="plan"
+        )
+
+        if container is not None:
+            # Reuse the process-wide services instead of building new ones
+            self.tmdb_service = container.tmdb_service
+            self.db_service = container.db_service
+            self.whatsapp_service = container.whatsapp_service
+            self.openai_service = container.openai_service
+            self.nlp_service = container.nlp_service
+            self.use_openai = self.openai_service is not None
+            self.router = HybridRouter.from_env(self.nlp_service)
+            self.attach_async_services(None, None, None)
+            return
+
         self.tmdb_service = TMDbService()
         self.db_service = DatabaseService()
         self.whatsapp_service = WhatsAppService()
+        self.nlp_service = self.whatsapp_service.nlp_service
         
         # Initialize OpenAI service if API key is available
         self.use_openai = os.getenv('USE_OPENAI', 'false').lower() == 'true'
@@ -24,10 +60,27 @@ class MessageHandler:
                 logger.error(f"Failed to initialize OpenAI service: {str(e)}")
                 self.use_openai = False
 
+        # With OPENAI_ROUTING=hybrid, confidently understood messages skip OpenAI
+        self.router = HybridRouter.from_env(self.nlp_service)
+        self.attach_async_services(None, None, None)
+
+    def attach_async_services(self, tmdb_service, db_service, whatsapp_service, openai_service=None) -> None:
+        """Attach the asyncio counterparts of the services used by handle_message_async"""
+        self.async_tmdb_service = tmdb_service
+        self.async_db_service = db_service
+        self.async_whatsapp_service = whatsapp_service
+        self.async_openai_service = openai_service
+
     def handle_message(self, message: str, user_id: str) -> Tuple[str, bool]:
         """
         Handle incoming message and return (response_message, success)
         """
+        # Every backend call made for this message shares one latency budget
+        with request_budget():
+            return self._route_message(message, user_id)
+
+    def _route_message(self, message: str, user_id: str) -> Tuple[str, bool]:
+        """Detect the intent of a message and dispatch it to the matching handler"""
         logger.debug(f"Processing message: '{message}' from {user_id}")
         
         # Clean up the WhatsApp number format if needed
@@ -35,27 +88,91 @@ class MessageHandler:
             user_id = user_id.replace('whatsapp:', '')
         
         # Process the message using OpenAI if enabled
-        if self.use_openai:
+        if self.use_openai and self.router is not None:
+            return self._handle_hybrid(message, user_id)
+        elif self.use_openai:
             return self._handle_with_openai(message, user_id)
         else:
             # Fall back to the basic NLP processing
             intent, movie_title = self.whatsapp_service.process_message(message)
             logger.debug(f"Detected intent: {intent}, movie: {movie_title}")
-            
-            # Handle different intents
-            if intent == 'get_info' and movie_title:
-                return self._handle_movie_info(movie_title)
-            elif intent == 'mark_watched' and movie_title:
-                return self._handle_mark_watched(movie_title, user_id)
-            elif intent == 'help':
-                return self._handle_help_request(), True
-            elif intent == 'list_watched':
-                return self._handle_list_watched(user_id)
+            return self._handle_intent(intent, movie_title, user_id)
+
+    def _handle_intent(self, intent: str, movie_title: Optional[str], user_id: str) -> Tuple[str, bool]:
+        """Answer a detected intent with the template responses"""
+        if intent == 'get_info' and movie_title:
+            return self._handle_movie_info(movie_title, user_id)
+        elif intent == 'mark_watched' and movie_title:
+            return self._handle_mark_watched(movie_title, user_id)
+        elif intent == 'help':
+            return self._handle_help_request(), True
+        elif intent == 'list_watched':
+            return self._handle_list_watched(user_id)
+        else:
+            return UNKNOWN_REQUEST_MESSAGE, False
+
+    def _handle_hybrid(self, message: str, user_id: str) -> Tuple[str, bool]:
+        """Answer locally when the NLP service is confident, otherwise through OpenAI"""
+        decision = self.router.route(message)
+        logger.debug(f"Routed to {decision.route} ({decision.reason}): {decision.analysis}")
+        started = time.perf_counter()
+        with counting_calls() as calls:
+            if decision.route == 'local':
+                result = self._handle_intent(decision.analysis.intent, decision.analysis.title, user_id)
             else:
-                return "Sorry, I couldn't understand your request. Try saying 'Tell me about [movie name]', 'I watched [movie name]', or 'help' for more options.", False
+                result = self._handle_with_openai(message, user_id)
+        self.router.record(decision, time.perf_counter() - started, len(calls))
+        return result
+
+    async def handle_message_async(self, message: str, user_id: str) -> Tuple[str, bool]:
+        """
+        Asyncio variant of handle_message used by the ASGI webhook
+        Returns: (response_message, success)
+        """
+        if getattr(self, 'async_tmdb_service', None) is None:
+            # No async services attached: run the sync path off the event loop
+            return await asyncio.to_thread(self.handle_message, message, user_id)
+
+        with request_budget():
+            return await self._route_message_async(message, user_id)
+
+    async def _route_message_async(self, message: str, user_id: str) -> Tuple[str, bool]:
+        """Asyncio variant of _route_message"""
+        logger.debug(f"Processing message (async): '{message}' from {user_id}")
+
+        if user_id.startswith('whatsapp:'):
+            user_id = user_id.replace('whatsapp:', '')
+
+        if self.use_openai and self.async_openai_service is not None:
+            if self.router is not None:
+                return await self._handle_hybrid_async(message, user_id)
+            return await self._handle_with_openai_async(message, user_id)
+
+        intent, movie_title = self.async_whatsapp_service.process_message(message)
+        logger.debug(f"Detected intent: {intent}, movie: {movie_title}")
+        return await self._handle_intent_async(intent, movie_title, user_id)
+
+    async def _handle_intent_async(self, intent: str, movie_title: Optional[str], user_id: str) -> Tuple[str, bool]:
+        """Asyncio variant of _handle_intent"""
+        if intent == 'get_info' and movie_title:
+            data = await self._collect_movie_info_async(movie_title, user_id)
+            return self._format_movie_info(data, movie_title)
+        elif intent == 'mark_watched' and movie_title:
+            data = await self._collect_mark_watched_async(movie_title, user_id)
+            return self._format_mark_watched(data, movie_title)
+        elif intent == 'help':
+            return self._handle_help_request(), True
+        elif intent == 'list_watched':
+            data = await self._collect_list_watched_async(user_id)
+            return self._format_list_watched(data)
+        else:
+            return UNKNOWN_REQUEST_MESSAGE, False
 
     def _handle_with_openai(self, message: str, user_id: str) -> Tuple[str, bool]:
         """Handle message processing with OpenAI"""
+        if self.openai_service.mode == 'tools':
+            return self._handle_with_openai_tools(message, user_id)
+        intent, movie_title, response_data = None, None, None
         try:
             # Process the message to get intent and entities
             intent, movie_title, context = self.openai_service.process_message(message, user_id)
@@ -65,68 +182,362 @@ class MessageHandler:
             response_data = {}
             
             if intent == 'get_info' and movie_title:
-                # Get movie information
-                movie, msg = self.tmdb_service.search_movie(movie_title)
-                if movie:
-                    response_data['movie'] = movie
-                    # Get similar movies
-                    similar_movies, _ = self.tmdb_service.get_similar_movies(movie['id'], min_score=7.0)
-                    if similar_movies:
-                        response_data['similar_movies'] = similar_movies[:3]
-                else:
-                    response_data['error'] = f"Couldn't find information about '{movie_title}'"
-                    
+                response_data = self._collect_movie_info(movie_title, user_id)
             elif intent == 'mark_watched' and movie_title:
-                # Mark movie as watched
-                movie, msg = self.tmdb_service.search_movie(movie_title)
-                if movie:
-                    response_data['movie'] = movie
-                    # Check if already watched
-                    if self.db_service.is_movie_watched(user_id, movie['id']):
-                        response_data['already_watched'] = True
-                    else:
-                        # Mark as watched
-                        success = self.db_service.add_watched_movie(user_id, movie['id'])
-                        response_data['marked_watched'] = success
-                        
-                        # Get recommendations
-                        if success:
-                            similar_movies, _ = self.tmdb_service.get_similar_movies(movie['id'], min_score=7.5)
-                            unwatched_similar = [m for m in similar_movies 
-                                              if not self.db_service.is_movie_watched(user_id, m['id'])]
-                            if unwatched_similar:
-                                response_data['recommendations'] = unwatched_similar[:3]
-                else:
-                    response_data['error'] = f"Couldn't find the movie '{movie_title}'"
-                    
+                response_data = self._collect_mark_watched(movie_title, user_id)
             elif intent == 'list_watched':
-                # Get watched movies
-                watched_ids = self.db_service.get_watched_movies(user_id)
-                response_data['watched_count'] = len(watched_ids)
-                
-                if watched_ids:
-                    # Get details for each movie (up to 10)
-                    watched_movies = []
-                    for movie_id in watched_ids[:10]:
-                        movie, _ = self.tmdb_service.get_movie_details(movie_id)
-                        if movie:
-                            watched_movies.append(movie)
-                    response_data['watched_movies'] = watched_movies
-                    
+                response_data = self._collect_list_watched(user_id)
             elif intent == 'help':
                 response_data['help_requested'] = True
             
             # Generate natural language response
             prompt = self._create_response_prompt(intent, response_data)
-            response = self.openai_service.generate_response(prompt, user_id, context)
+            response = self.openai_service.generate_response(prompt, user_id, context, intent)
             
             return response, True
             
+        except OpenAIDeadlineExceeded as e:
+            logger.warning(f"OpenAI missed the request deadline, answering locally: {str(e)}")
+            if response_data is not None:
+                return self._format_collected(intent, movie_title, response_data)
+            return self._handle_intent(*self._local_intent(message), user_id)
+            
         except Exception as e:
             logger.error(f"Error processing with OpenAI: {str(e)}", exc_info=True)
             # Fall back to basic response
-            return "I'm having trouble understanding your request right now. Could you try again with a simpler question about movies?", False
-    
+            return OPENAI_FAILURE_MESSAGE, False
+
+    async def _handle_with_openai_async(self, message: str, user_id: str) -> Tuple[str, bool]:
+        """Asyncio variant of _handle_with_openai"""
+        if self.openai_service.mode == 'tools':
+            return await self._handle_with_openai_tools_async(message, user_id)
+        intent, movie_title, response_data = None, None, None
+        try:
+            intent, movie_title, context = await self.async_openai_service.process_message(message, user_id)
+            logger.debug(f"OpenAI detected intent: {intent}, movie: {movie_title}, context: {context}")
+
+            response_data = {}
+
+            if intent == 'get_info' and movie_title:
+                response_data = await self._collect_movie_info_async(movie_title, user_id)
+            elif intent == 'mark_watched' and movie_title:
+                response_data = await self._collect_mark_watched_async(movie_title, user_id)
+            elif intent == 'list_watched':
+                response_data = await self._collect_list_watched_async(user_id)
+            elif intent == 'help':
+                response_data['help_requested'] = True
+
+            prompt = self._create_response_prompt(intent, response_data)
+            response = await self.async_openai_service.generate_response(prompt, user_id, context, intent)
+
+            return response, True
+
+        except OpenAIDeadlineExceeded as e:
+            logger.warning(f"OpenAI missed the request deadline, answering locally: {str(e)}")
+            if response_data is not None:
+                return self._format_collected(intent, movie_title, response_data)
+            return await self._handle_intent_async(*self._local_intent(message), user_id)
+
+        except Exception as e:
+            logger.error(f"Error processing with OpenAI: {str(e)}", exc_info=True)
+            return OPENAI_FAILURE_MESSAGE, False
+
+    def _handle_with_openai_tools(self, message: str, user_id: str) -> Tuple[str, bool]:
+        """Let the model call the movie operations and answer in the same conversation"""
+        # Results of tools that ran, for a template answer if OpenAI then misses the deadline
+        ran = []
+
+        def tool(name: str, collect):
+            def run(args: Dict[str, Any]) -> Dict[str, Any]:
+                result = self._tool_data(collect(args))
+                ran.append((name, args, result))
+                return result
+            return run
+
+        tools = {
+            'get_movie_info': tool('get_movie_info', lambda args: self._collect_movie_info(args['title'], user_id)),
+            'mark_watched': tool('mark_watched', lambda args: self._collect_mark_watched(args['title'], user_id)),
+            'list_watched': tool('list_watched', lambda args: self._collect_list_watched(user_id)),
+        }
+        try:
+            response = self.openai_service.respond_with_tools(message, user_id, tools, self._render_tool_result)
+        except OpenAIDeadlineExceeded as e:
+            logger.warning(f"OpenAI missed the request deadline, answering locally: {str(e)}")
+            if ran:
+                return "\n\n".join(self._render_tool_result(*entry) for entry in ran), True
+            return self._handle_intent(*self._local_intent(message), user_id)
+        return response, response != RESPONSE_FAILURE_MESSAGE
+
+    async def _handle_with_openai_tools_async(self, message: str, user_id: str) -> Tuple[str, bool]:
+        """Asyncio variant of _handle_with_openai_tools"""
+        ran = []
+
+        def tool(name: str, collect):
+            async def run(args: Dict[str, Any]) -> Dict[str, Any]:
+                result = self._tool_data(await collect(args))
+                ran.append((name, args, result))
+                return result
+            return run
+
+        tools = {
+            'get_movie_info': tool('get_movie_info',
+                                   lambda args: self._collect_movie_info_async(args['title'], user_id)),
+            'mark_watched': tool('mark_watched',
+                                 lambda args: self._collect_mark_watched_async(args['title'], user_id)),
+            'list_watched': tool('list_watched', lambda args: self._collect_list_watched_async(user_id)),
+        }
+        try:
+            response = await self.async_openai_service.respond_with_tools(message, user_id, tools,
+                                                                          self._render_tool_result)
+        except OpenAIDeadlineExceeded as e:
+            logger.warning(f"OpenAI missed the request deadline, answering locally: {str(e)}")
+            if ran:
+                return "\n\n".join(self._render_tool_result(*entry) for entry in ran), True
+            return await self._handle_intent_async(*self._local_intent(message), user_id)
+        return response, response != RESPONSE_FAILURE_MESSAGE
+
+    def _local_intent(self, message: str) -> Tuple[str, Optional[str]]:
+        """Intent and title from the local NLP service, used when OpenAI cannot answer in time"""
+        self.openai_service.completions.counters.incr('fallbacks')
+        return self.nlp_service.process_message(message)
+
+    def _format_collected(self, intent: str, movie_title: Optional[str], data: Dict[str, Any]) -> Tuple[str, bool]:
+        """Template reply for data already collected for an OpenAI-detected intent"""
+        self.openai_service.completions.counters.incr('fallbacks')
+        if intent == 'get_info' and movie_title:
+            return self._format_movie_info(data, movie_title)
+        elif intent == 'mark_watched' and movie_title:
+            return self._format_mark_watched(data, movie_title)
+        elif intent == 'list_watched':
+            return self._format_list_watched(data)
+        elif intent == 'help':
+            return self._handle_help_request(), True
+        return UNKNOWN_REQUEST_MESSAGE, False
+
+    def _render_tool_result(self, name: str, arguments: Dict[str, Any], data: Dict[str, Any]) -> str:
+        """Template reply for a tool result (OPENAI_TOOL_REPLY=template)"""
+        if name == 'get_movie_info':
+            return self._format_movie_info(data, arguments['title'])[0]
+        elif name == 'mark_watched':
+            return self._format_mark_watched(data, arguments['title'])[0]
+        elif name == 'list_watched':
+            return self._format_list_watched(data)[0]
+        return UNKNOWN_REQUEST_MESSAGE
+
+    @staticmethod
+    def _tool_data(data: Dict[str, Any]) -> Dict[str, Any]:
+        """Collected data trimmed to the fields the answer uses, to keep tool results small"""
+        def brief(movie: Dict, detailed: bool = False) -> Dict[str, Any]:
+            fields = TOOL_MOVIE_FIELDS if detailed else ('title', 'vote_average')
+            return {field: movie.get(field) for field in fields if movie.get(field) is not None}
+
+        result: Dict[str, Any] = {}
+        for key, value in data.items():
+            if key == 'movie':
+                result[key] = brief(value, detailed=True)
+            elif key in ('similar_movies', 'recommendations', 'watched_movies'):
+                result[key] = [brief(movie) for movie in value]
+            else:
+                result[key] = value
+        return result
+
+    def _resolve_movie(self, movie_title: str, user_id: Optional[str] = None) -> Optional[Dict]:
+        """
+        Find the movie for a title, skipping the search for confidently known
+        titles; the user id lets TMDb learn corrections for failed searches.
+        A spotted title still needs its details, which come from the cache or TMDb.
+        """
+        spotted = self.nlp_service.spot_title(movie_title, slot=True)
+        if spotted:
+            movie, _ = self.tmdb_service.get_movie_details(spotted.movie_id)
+            if movie:
+                self.tmdb_service.record_search_result(user_id, movie_title, movie)
+                return movie
+        movie, _ = self.tmdb_service.search_movie(movie_title, user_id)
+        return movie
+
+    async def _resolve_movie_async(self, movie_title: str, user_id: Optional[str] = None) -> Optional[Dict]:
+        """Asyncio variant of _resolve_movie"""
+        spotted = self.nlp_service.spot_title(movie_title, slot=True)
+        if spotted:
+            movie, _ = await self.async_tmdb_service.get_movie_details(spotted.movie_id)
+            if movie:
+                await self.async_tmdb_service.record_search_result(user_id, movie_title, movie)
+                return movie
+        movie, _ = await self.async_tmdb_service.search_movie(movie_title, user_id)
+        return movie
+
+    def _collect_movie_info(self, movie_title: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Gather the data needed to answer a get_info request"""
+        data: Dict[str, Any] = {}
+        movie = self._resolve_movie(movie_title, user_id)
+        if not movie:
+            data['error'] = f"Couldn't find information about '{movie_title}'"
+            return data
+
+        data['movie'] = movie
+        # Similar movies are optional: dropped if they miss the request budget
+        plan = ExecutionPlan().step(
+            'similar', lambda: self.tmdb_service.get_similar_movies(movie['id'], min_score=7.0)[0],
+            critical=False
+        )
+        results = plan.run(self.executor)
+        self._apply_movie_info_results(data, results, plan)
+        return data
+
+    def _collect_mark_watched(self, movie_title: str, user_id: str) -> Dict[str, Any]:
+        """Mark a movie as watched and gather recommendations based on it"""
+        data: Dict[str, Any] = {}
+        movie = self._resolve_movie(movie_title, user_id)
+        if not movie:
+            data['error'] = f"Couldn't find the movie '{movie_title}'"
+            return data
+
+        data['movie'] = movie
+
+        def add_if_new(already_watched: bool) -> bool:
+            if already_watched:
+                raise SkipStep()
+            return self.db_service.add_watched_movie(user_id, movie['id'], movie)
+
+        def filter_unwatched(similar_movies: List[Dict]) -> List[Dict]:
+            watched = self.db_service.get_watched_ids(user_id, [m['id'] for m in similar_movies])
+            return [m for m in similar_movies if m['id'] not in watched]
+
+        # The watched check and write overlap with fetching recommendations
+        plan = (ExecutionPlan()
+                .step('watched', lambda: self.db_service.is_movie_watched(user_id, movie['id']))
+                .step('add', add_if_new, ['watched'])
+                .step('similar', lambda: self.tmdb_service.get_similar_movies(movie['id'], min_score=7.5)[0],
+                      critical=False)
+                .step('unwatched', filter_unwatched, ['similar'], critical=False))
+        results = plan.run(self.executor)
+        self._apply_mark_watched_results(data, results, plan)
+        return data
+
+    def _collect_list_watched(self, user_id: str) -> Dict[str, Any]:
+        """Gather the user's most recent movies, and their watched count when there are more"""
+        entries, next_cursor = self.db_service.get_watched_page(user_id, limit=10)
+        # One page says it all; the total is only counted for longer histories
+        count = self.db_service.count_watched(user_id) if next_cursor else len(entries)
+        data: Dict[str, Any] = {'watched_count': count}
+
+        if entries:
+            # Entries carry their title and score; only ones stored without them need TMDb
+            plan = ExecutionPlan()
+            for movie_id in self._untitled_watched_ids(entries):
+                plan.step(f"details_{movie_id}",
+                          lambda movie_id=movie_id: self.tmdb_service.get_movie_details(movie_id)[0],
+                          critical=False)
+            results = plan.run(self.executor)
+            self._apply_list_watched_results(data, entries, results, plan)
+        return data
+
+    async def _collect_movie_info_async(self, movie_title: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Asyncio variant of _collect_movie_info"""
+        data: Dict[str, Any] = {}
+        movie = await self._resolve_movie_async(movie_title, user_id)
+        if not movie:
+            data['error'] = f"Couldn't find information about '{movie_title}'"
+            return data
+
+        data['movie'] = movie
+
+        async def similar() -> List[Dict]:
+            return (await self.async_tmdb_service.get_similar_movies(movie['id'], min_score=7.0))[0]
+
+        plan = ExecutionPlan().step('similar', similar, critical=False)
+        results = await plan.run_async()
+        self._apply_movie_info_results(data, results, plan)
+        return data
+
+    async def _collect_mark_watched_async(self, movie_title: str, user_id: str) -> Dict[str, Any]:
+        """Asyncio variant of _collect_mark_watched"""
+        data: Dict[str, Any] = {}
+        movie = await self._resolve_movie_async(movie_title, user_id)
+        if not movie:
+            data['error'] = f"Couldn't find the movie '{movie_title}'"
+            return data
+
+        data['movie'] = movie
+
+        async def watched() -> bool:
+            return await self.async_db_service.is_movie_watched(user_id, movie['id'])
+
+        async def add_if_new(already_watched: bool) -> bool:
+            if already_watched:
+                raise SkipStep()
+            return await self.async_db_service.add_watched_movie(user_id, movie['id'], movie)
+
+        async def similar() -> List[Dict]:
+            return (await self.async_tmdb_service.get_similar_movies(movie['id'], min_score=7.5))[0]
+
+        async def filter_unwatched(similar_movies: List[Dict]) -> List[Dict]:
+            watched = await self.async_db_service.get_watched_ids(user_id, [m['id'] for m in similar_movies])
+            return [m for m in similar_movies if m['id'] not in watched]
+
+        plan = (ExecutionPlan()
+                .step('watched', watched)
+                .step('add', add_if_new, ['watched'])
+                .step('similar', similar, critical=False)
+                .step('unwatched', filter_unwatched, ['similar'], critical=False))
+        results = await plan.run_async()
+        self._apply_mark_watched_results(data, results, plan)
+        return data
+
+    async def _collect_list_watched_async(self, user_id: str) -> Dict[str, Any]:
+        """Asyncio variant of _collect_list_watched"""
+        entries, next_cursor = await self.async_db_service.get_watched_page(user_id, limit=10)
+        count = await self.async_db_service.count_watched(user_id) if next_cursor else len(entries)
+        data: Dict[str, Any] = {'watched_count': count}
+
+        if entries:
+            async def details(movie_id: int) -> Optional[Dict]:
+                return (await self.async_tmdb_service.get_movie_details(movie_id))[0]
+
+            plan = ExecutionPlan()
+            for movie_id in self._untitled_watched_ids(entries):
+                plan.step(f"details_{movie_id}", lambda movie_id=movie_id: details(movie_id), critical=False)
+            results = await plan.run_async()
+            self._apply_list_watched_results(data, entries, results, plan)
+        return data
+
+    def _apply_movie_info_results(self, data: Dict[str, Any], results: Dict[str, Any], plan: ExecutionPlan) -> None:
+        similar_movies = results.get('similar')
+        if similar_movies:
+            data['similar_movies'] = similar_movies[:3]
+        if plan.degraded:
+            data['degraded'] = True
+
+    def _apply_mark_watched_results(self, data: Dict[str, Any], results: Dict[str, Any], plan: ExecutionPlan) -> None:
+        if results.get('watched'):
+            data['already_watched'] = True
+            return
+
+        data['marked_watched'] = results.get('add', False)
+        unwatched_similar = results.get('unwatched')
+        if data['marked_watched'] and unwatched_similar:
+            data['recommendations'] = unwatched_similar[:3]
+        if plan.degraded:
+            data['degraded'] = True
+
+    @staticmethod
+    def _untitled_watched_ids(entries: List[Dict]) -> List[int]:
+        """Ids of entries marked while TMDb details were unavailable"""
+        return [entry['id'] for entry in entries if not entry.get('title')]
+
+    def _apply_list_watched_results(self, data: Dict[str, Any], entries: List[Dict],
+                                    results: Dict[str, Any], plan: ExecutionPlan) -> None:
+        # Keep the stored order; details that missed the budget are left out
+        watched_movies = []
+        for entry in entries:
+            movie = entry if entry.get('title') else results.get(f"details_{entry['id']}")
+            if movie:
+                watched_movies.append(movie)
+        data['watched_movies'] = watched_movies
+        if plan.degraded:
+            data['degraded'] = True
+
     def _create_response_prompt(self, intent: str, data: Dict[str, Any]) -> str:
         """Create a prompt for the OpenAI response generation based on the intent and data"""
         if intent == 'get_info':
@@ -194,50 +605,13 @@ class MessageHandler:
         else:
             return "The user sent a message that I couldn't understand. Please provide a helpful response explaining how they can interact with the movie recommendation service."
 
-    def _handle_movie_info(self, movie_title: str) -> Tuple[str, bool]:
+    def _handle_movie_info(self, movie_title: str, user_id: Optional[str] = None) -> Tuple[str, bool]:
         """Handle movie information request"""
-        movie, message = self.tmdb_service.search_movie(movie_title)
-        if not movie:
-            return f"Sorry, I couldn't find information about '{movie_title}'", False
-            
-        # Get similar movies with good scores
-        similar_movies, _ = self.tmdb_service.get_similar_movies(movie['id'], min_score=7.0)
-        
-        response = self.tmdb_service.format_movie_info(movie)
-        if similar_movies:
-            response += "\n\nYou might also like:\n"
-            for i, similar in enumerate(similar_movies[:3], 1):
-                response += f"{i}. {similar['title']} ({similar['vote_average']}/10)\n"
-                
-        return response, True
+        return self._format_movie_info(self._collect_movie_info(movie_title, user_id), movie_title)
 
     def _handle_mark_watched(self, movie_title: str, user_id: str) -> Tuple[str, bool]:
         """Handle marking a movie as watched"""
-        movie, message = self.tmdb_service.search_movie(movie_title)
-        if not movie:
-            return f"Sorry, I couldn't find the movie '{movie_title}'", False
-            
-        # Check if already watched
-        if self.db_service.is_movie_watched(user_id, movie['id']):
-            return f"You've already marked {movie['title']} as watched!", True
-            
-        # Mark as watched
-        success = self.db_service.add_watched_movie(user_id, movie['id'])
-        if not success:
-            return "Sorry, there was an error marking the movie as watched", False
-            
-        # Get recommendations based on this movie
-        similar_movies, _ = self.tmdb_service.get_similar_movies(movie['id'], min_score=7.5)
-        unwatched_similar = [m for m in similar_movies 
-                           if not self.db_service.is_movie_watched(user_id, m['id'])]
-        
-        response = f"Great! I've marked {movie['title']} as watched."
-        if unwatched_similar:
-            response += "\n\nBased on this, you might enjoy:\n"
-            for i, rec in enumerate(unwatched_similar[:3], 1):
-                response += f"{i}. {rec['title']} ({rec['vote_average']}/10)\n"
-                
-        return response, True
+        return self._format_mark_watched(self._collect_mark_watched(movie_title, user_id), movie_title)
         
     def _handle_help_request(self) -> str:
         """Handle help request"""
@@ -252,28 +626,58 @@ class MessageHandler:
         
     def _handle_list_watched(self, user_id: str) -> Tuple[str, bool]:
         """Handle request to list watched movies"""
-        # Get list of watched movie IDs
-        watched_ids = self.db_service.get_watched_movies(user_id)
-        
-        if not watched_ids:
-            return "You haven't marked any movies as watched yet.", True
+        return self._format_list_watched(self._collect_list_watched(user_id))
+
+    def _format_movie_info(self, data: Dict[str, Any], movie_title: str) -> Tuple[str, bool]:
+        """Format the template reply for a get_info request"""
+        if 'error' in data:
+            return f"Sorry, I couldn't find information about '{movie_title}'", False
+
+        response = self.tmdb_service.format_movie_info(data['movie'])
+        similar_movies = data.get('similar_movies', [])
+        if similar_movies:
+            response += "\n\nYou might also like:\n"
+            for i, similar in enumerate(similar_movies, 1):
+                response += f"{i}. {similar['title']} ({similar['vote_average']}/10)\n"
+                
+        return response, True
+
+    def _format_mark_watched(self, data: Dict[str, Any], movie_title: str) -> Tuple[str, bool]:
+        """Format the template reply for a mark_watched request"""
+        if 'error' in data:
+            return f"Sorry, I couldn't find the movie '{movie_title}'", False
+
+        movie = data['movie']
+        if data.get('already_watched'):
+            return f"You've already marked {movie['title']} as watched!", True
             
-        # Get details for each movie (up to 10 to avoid too long messages)
-        watched_movies = []
-        for movie_id in watched_ids[:10]:
-            movie, _ = self.tmdb_service.get_movie_details(movie_id)
-            if movie:
-                watched_movies.append(movie)
-        
-        # Format response
+        if not data.get('marked_watched'):
+            return "Sorry, there was an error marking the movie as watched", False
+            
+        response = f"Great! I've marked {movie['title']} as watched."
+        recommendations = data.get('recommendations', [])
+        if recommendations:
+            response += "\n\nBased on this, you might enjoy:\n"
+            for i, rec in enumerate(recommendations, 1):
+                response += f"{i}. {rec['title']} ({rec['vote_average']}/10)\n"
+                
+        return response, True
+
+    def _format_list_watched(self, data: Dict[str, Any]) -> Tuple[str, bool]:
+        """Format the template reply for a list_watched request"""
+        count = data.get('watched_count', 0)
+        if not count:
+            return "You haven't marked any movies as watched yet.", True
+
+        watched_movies = data.get('watched_movies', [])
         if not watched_movies:
             return "You've marked some movies as watched, but I couldn't retrieve their details.", False
             
-        response = f"You've watched {len(watched_ids)} movies. Here are the most recent ones:\n\n"
+        response = f"You've watched {count} movies. Here are the most recent ones:\n\n"
         for i, movie in enumerate(watched_movies, 1):
             response += f"{i}. {movie.get('title', 'Unknown')} ({movie.get('vote_average', 0)}/10)\n"
             
-        if len(watched_ids) > 10:
-            response += f"\nAnd {len(watched_ids) - 10} more..."
+        if count > 10:
+            response += f"\nAnd {count - 10} more..."
             
-        return response, True 
\ No newline at end of file
+        return response, True
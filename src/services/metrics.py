@@ -0,0 +1,117 @@
+import threading
+from collections import deque
+from typing import Dict
+
+
+class LatencyStats:
+    """Thread-safe latency recorder keeping totals plus a window of recent samples"""
+
+    def __init__(self, window: int = 1024):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, pct: float) -> float:
+        """Percentile over the recent window, 0.0 when nothing was recorded"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            count, total, maximum = self.count, self.total, self.max
+        return {
+            'count': count,
+            'avg_ms': round(total / count * 1000, 2) if count else 0.0,
+            'p50_ms': round(self.percentile(50) * 1000, 2),
+            'p95_ms': round(self.percentile(95) * 1000, 2),
+            'max_ms': round(maximum * 1000, 2),
+        }
+
+
+class SampleStats:
+    """Thread-safe recorder of a per-request quantity (such as tokens) over a window of recent samples"""
+
+    def __init__(self, window: int = 1024):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0
+
+    def record(self, value: float) -> None:
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+            self.total += value
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total = self.count, self.total
+        if not samples:
+            return {'count': 0, 'avg': 0.0, 'p50': 0, 'p95': 0, 'max': 0}
+        return {
+            'count': count,
+            'avg': round(total / count, 1),
+            'p50': samples[int(round(0.5 * (len(samples) - 1)))],
+            'p95': samples[int(round(0.95 * (len(samples) - 1)))],
+            'max': samples[-1],
+        }
+
+
+class Counters:
+    """Thread-safe named counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, int] = {}
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + amount
+
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self._values.get(name, 0)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._values)
+
+
+def memory_report() -> Dict[str, float]:
+    """
+    Resident memory of this process in MB. On Linux, PSS and the shared/private
+    split show how much of the resident set is shared copy-on-write with the
+    master and the other workers.
+    """
+    report: Dict[str, float] = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+        report['rss_mb'] = fields.get('Rss', 0) / 1024
+        report['pss_mb'] = fields.get('Pss', 0) / 1024
+        report['shared_mb'] = (fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)) / 1024
+        report['private_mb'] = (fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)) / 1024
+    except OSError:
+        import resource
+        # ru_maxrss is in KB on Linux and bytes on macOS; this branch is the non-Linux one
+        report['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024)
+    return {name: round(value, 1) for name, value in report.items()}
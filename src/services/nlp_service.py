@@ -1,67 +1,235 @@
+import os
+import threading
+import time
 import spacy
-import re
-from typing import Tuple, Optional
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple, Optional
+
+from services.intent_classifier import IntentClassifier
+from services.intent_engine import IntentEngine
+from services.title_gazetteer import TitleGazetteer, TitleMatch
+
+# Components en_core_web_sm ships that NER, noun chunks and token text do not use.
+# Noun chunks need the parser plus tagger/attribute_ruler (for POS); NER has its own tok2vec.
+DEFAULT_EXCLUDE = 'lemmatizer'
+
+# Models loaded in this process, keyed by (name, excluded components). A model
+# loaded in a pre-fork master is inherited by every worker and shared copy-on-write.
+_models: Dict[Tuple[str, Tuple[str, ...]], object] = {}
+_load_seconds: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+_models_lock = threading.Lock()
+
+
+def model_settings() -> Tuple[str, Tuple[str, ...]]:
+    """Model name and excluded components from SPACY_MODEL and SPACY_EXCLUDE"""
+    name = os.getenv('SPACY_MODEL', 'en_core_web_sm')
+    exclude = os.getenv('SPACY_EXCLUDE', DEFAULT_EXCLUDE)
+    return name, tuple(sorted(filter(None, (c.strip() for c in exclude.split(',')))))
+
+
+def load_model(name: Optional[str] = None, exclude: Optional[Tuple[str, ...]] = None):
+    """
+    Load a spaCy pipeline once per process, leaving out the excluded components
+    entirely (their weights are never read into memory)
+    """
+    default_name, default_exclude = model_settings()
+    key = (name or default_name, tuple(sorted(exclude)) if exclude is not None else default_exclude)
+    with _models_lock:
+        if key not in _models:
+            started = time.perf_counter()
+            try:
+                _models[key] = spacy.load(key[0], exclude=list(key[1]))
+            except OSError:
+                # If the model isn't installed, provide instructions
+                raise ImportError(
+                    f"Spacy model '{key[0]}' not found. "
+                    f"Please install it with: python -m spacy download {key[0]}"
+                )
+            _load_seconds[key] = time.perf_counter() - started
+        return _models[key]
+
+
+def model_report() -> Dict[str, object]:
+    """Loaded pipelines with their components and load times"""
+    return {
+        name: {'excluded': list(exclude), 'components': list(_models[(name, exclude)].pipe_names),
+               'load_seconds': round(_load_seconds[(name, exclude)], 3)}
+        for name, exclude in _models
+    }
+
+
+POSITIVE_WORDS = {'good', 'great', 'excellent', 'amazing', 'love', 'enjoy', 'like', 'best', 'favorite', 'recommend'}
+NEGATIVE_WORDS = {'bad', 'terrible', 'awful', 'horrible', 'hate', 'dislike', 'worst', 'boring', 'waste'}
+
+
+# Confidence reported for intents decided by a rule, the gazetteer or the NER fallback
+RULE_CONFIDENCE = 0.9
+FALLBACK_CONFIDENCE = 0.5
+
+# Intents that need a movie title to be answered
+TITLE_INTENTS = ('get_info', 'mark_watched')
+
+
+class NLPResult(NamedTuple):
+    intent: str
+    title: Optional[str]
+    sentiment: float
+
+
+class NLPAnalysis(NamedTuple):
+    intent: str
+    title: Optional[str]
+    confidence: float
+    source: str  # 'model', 'rules', 'gazetteer' or 'ner'
+
 
 class NLPService:
     """Service for natural language processing of user messages"""
     
     def __init__(self):
         # Load English language model - using the small model for efficiency
-        # You can use 'en_core_web_md' or 'en_core_web_lg' for better accuracy
-        try:
-            self.nlp = spacy.load('en_core_web_sm')
-        except OSError:
-            # If the model isn't installed, provide instructions
-            raise ImportError(
-                "Spacy model 'en_core_web_sm' not found. "
-                "Please install it with: python -m spacy download en_core_web_sm"
-            )
-        
-        # Define intent patterns - these could be moved to a configuration file
-        self.intent_patterns = {
-            'get_info': [
-                r'(?:about|info|information|tell me about|what do you know about|details on|score of|rating of|how good is)\s+(.+)',
-                r'(?:how is|how was|is|was)\s+(.+)(?:\s+any good|\s+worth watching|\s+good)?',
-                r'(?:what is|what\'s)\s+(.+)(?:\s+about|\s+like)?',
-                r'(.+)(?:\s+worth watching|\s+any good|\s+recommended)?'
-            ],
-            'mark_watched': [
-                r'(?:i (?:have )?(?:just |recently )?(?:watched|seen)|i\'ve (?:just |recently )?(?:watched|seen)|seen|watched|completed|finished)\s+(.+)',
-                r'(?:i (?:have )?finished|i\'ve finished|done with|completed)\s+(.+)',
-                r'(?:add|mark|put)\s+(.+)(?:\s+as watched|\s+to my watched list|\s+to watched list)'
-            ],
-            'help': [
-                r'(?:help|assist|support|how to use|instructions|commands|what can you do|how does this work)'
-            ],
-            'list_watched': [
-                r'(?:list|show|what are|what have i|which) (?:movies have i watched|movies i\'ve watched|my watched movies|my watched list|watched movies)'
-            ]
-        }
+        # You can use 'en_core_web_md' or 'en_core_web_lg' for better accuracy (SPACY_MODEL).
+        # Reuses the pipeline when the server preloaded it before forking workers
+        self.nlp = load_model()
+        
+        # Intent rules compiled once into a single prioritised matcher
+        self.intent_engine = IntentEngine()
+        
+        # Known titles and aliases, when a title index or alias list is configured
+        self.gazetteer = TitleGazetteer.from_env()
+        self.title_confidence = float(os.getenv('TITLE_GAZETTEER_MIN_CONFIDENCE', '0.8'))
+        
+        # Locally trained intent classifier (train_intent_classifier.py), when a model file exists
+        self.classifier = IntentClassifier.from_env()
+        self.model_confidence = float(os.getenv('INTENT_MODEL_MIN_CONFIDENCE', '0.7'))
+    
+    def warm_up(self) -> None:
+        """Run one parse so the model's lazy initialisation happens before the first message"""
+        self.nlp("tell me about warm up")
     
     def process_message(self, message: str) -> Tuple[str, Optional[str]]:
         """
         Process a message to determine intent and extract entities
         Returns: (intent, entity)
         """
-        # Clean the message
+        analysis = self.analyze(message)
+        return analysis.intent, analysis.title
+    
+    def analyze(self, message: str) -> NLPAnalysis:
+        """
+        Intent, title, confidence and the component that decided the intent.
+        
+        A matching compiled rule decides; otherwise the intent classifier when it
+        is confident, with the title from known titles or the NER fallback;
+        otherwise known titles, then the NER fallback. Only the NER fallback
+        parses the message.
+        """
         clean_message = message.lower().strip()
+        analysis = self._analyze_without_parse(clean_message, message)
+        if analysis:
+            return analysis
+        
+        # If nothing else applies, try to extract movie titles using NER
+        # This is a fallback and might be less accurate, and the only path that parses
+        return self._analysis_from_doc(clean_message, self.nlp(clean_message))
+    
+    def process_batch(self, messages: Iterable[str], batch_size: Optional[int] = None,
+                      n_process: Optional[int] = None, chunk_size: int = 10000) -> Iterator[NLPResult]:
+        """
+        Classify a stream of messages, yielding (intent, title, sentiment) in input order.
+        
+        Messages are read `chunk_size` at a time. Those the intent rules answer are
+        only tokenised (for sentiment); the rest go through one nlp.pipe call per
+        chunk with `batch_size` (SPACY_BATCH_SIZE) and `n_process` worker
+        processes (SPACY_PROCESSES). Every message is parsed at most once.
+        """
+        batch_size = batch_size or int(os.getenv('SPACY_BATCH_SIZE', '256'))
+        n_process = n_process or int(os.getenv('SPACY_PROCESSES', '1'))
+        messages = iter(messages)
+        while True:
+            chunk = list(islice(messages, chunk_size))
+            if not chunk:
+                return
+            yield from self._process_chunk(chunk, batch_size, n_process)
+    
+    def _process_chunk(self, raw: List[str], batch_size: int, n_process: int) -> List[NLPResult]:
+        chunk = [message.lower().strip() for message in raw]
+        analyses = [self._analyze_without_parse(message, original) for message, original in zip(chunk, raw)]
+        fallback = [i for i, analysis in enumerate(analyses) if analysis is None]
+        docs = dict(zip(fallback, self.nlp.pipe((chunk[i] for i in fallback),
+                                                batch_size=batch_size, n_process=n_process)))
+        
+        results = []
+        for i, message in enumerate(chunk):
+            if analyses[i] is not None:
+                analysis = analyses[i]
+                doc = self.nlp.make_doc(message)
+            else:
+                doc = docs[i]
+                analysis = self._analysis_from_doc(message, doc)
+            results.append(NLPResult(analysis.intent, analysis.title, self._sentiment_from_doc(doc)))
+        return results
+    
+    def spot_title(self, text: str, slot: bool = False) -> Optional[TitleMatch]:
+        """
+        The longest known title in the text, if the gazetteer is confident about it.
+        `slot` marks text that is already the title part of a recognised request.
+        """
+        if self.gazetteer is None:
+            return None
+        match = self.gazetteer.best(text, slot)
+        return match if match and match.confidence >= self.title_confidence else None
+    
+    def predict_intent(self, clean_message: str) -> Optional[Tuple[str, float]]:
+        """Classifier prediction, or None when no model is loaded or it is not confident"""
+        if self.classifier is None:
+            return None
+        intent, probability = self.classifier.predict(clean_message)
+        return (intent, probability) if probability >= self.model_confidence else None
+    
+    def _analyze_without_parse(self, clean_message: str, message: Optional[str] = None) -> Optional[NLPAnalysis]:
+        """Analysis of a message when it needs no parse, else None"""
+        matched = self._match_without_parse(clean_message, message)
+        # A rule match is explicit, so it wins over the model
+        if matched and matched.source == 'rules':
+            return matched
+        predicted = self.predict_intent(clean_message)
+        if predicted is None:
+            return matched
+        
+        intent, probability = predicted
+        if intent not in TITLE_INTENTS:
+            return NLPAnalysis(intent, None, probability, 'model')
+        if matched and matched.title:
+            return NLPAnalysis(intent, matched.title, probability, 'model')
+        # The title has to come from the parse
+        return None
+    
+    def _analysis_from_doc(self, clean_message: str, doc) -> NLPAnalysis:
+        """NER fallback (no rule matched), keeping a confident classifier intent when a title is found"""
+        intent, title = self._intent_from_doc(doc)
+        predicted = self.predict_intent(clean_message)
+        if predicted and title:
+            return NLPAnalysis(predicted[0], title, predicted[1], 'model')
+        return NLPAnalysis(intent, title, FALLBACK_CONFIDENCE, 'ner')
+    
+    def _match_without_parse(self, clean_message: str, message: Optional[str] = None) -> Optional[NLPAnalysis]:
+        """
+        Intent from the rules, with the title replaced by a confidently spotted known title.
+        `message` is the text as typed, so the gazetteer can see quotes and capitals.
+        """
+        matched = self.intent_engine.match(clean_message)
+        if matched:
+            intent, title = matched
+            spotted = self.spot_title(title, slot=True) if title else None
+            return NLPAnalysis(intent, spotted.title if spotted else title, RULE_CONFIDENCE, 'rules')
         
-        # Process with spaCy
-        doc = self.nlp(clean_message)
-        
-        # Try to match intents using regex patterns first
-        for intent, patterns in self.intent_patterns.items():
-            for pattern in patterns:
-                match = re.search(pattern, clean_message)
-                if match:
-                    # If the pattern has a capture group, it's the entity (movie title)
-                    if len(match.groups()) > 0:
-                        return intent, match.group(1).strip()
-                    else:
-                        return intent, None
-        
-        # If no regex match, try to extract movie titles using NER
-        # This is a fallback and might be less accurate
+        # A known title on its own is a question about that movie
+        spotted = self.spot_title(message if message is not None else clean_message)
+        return NLPAnalysis('get_info', spotted.title, spotted.confidence, 'gazetteer') if spotted else None
+    
+    def _intent_from_doc(self, doc) -> Tuple[str, Optional[str]]:
+        """NER fallback for a parsed message no intent rule matched"""
         movie_title = self._extract_potential_movie_title(doc)
         
         if movie_title:
@@ -84,8 +252,8 @@ class NLPService:
             # Return the longest entity as it's more likely to be a movie title
             return max(entities, key=len)
         
-        # If no entities found, look for noun phrases
-        noun_phrases = [chunk.text for chunk in doc.noun_chunks]
+        # If no entities found, look for noun phrases (unless the parser was excluded)
+        noun_phrases = [chunk.text for chunk in doc.noun_chunks] if doc.has_annotation("DEP") else []
         
         if noun_phrases:
             # Return the longest noun phrase
@@ -98,20 +266,20 @@ class NLPService:
         Extract sentiment from a message
         Returns a score from -1 (negative) to 1 (positive)
         """
-        doc = self.nlp(message.lower())
-        
+        # Only token text is needed, so tokenise instead of running the whole pipeline
+        return self._sentiment_from_doc(self.nlp.make_doc(message.lower()))
+    
+    def _sentiment_from_doc(self, doc) -> float:
         # Simple sentiment analysis based on polarity of tokens
         # This is very basic - a proper sentiment analyzer would be better
-        positive_words = {'good', 'great', 'excellent', 'amazing', 'love', 'enjoy', 'like', 'best', 'favorite', 'recommend'}
-        negative_words = {'bad', 'terrible', 'awful', 'horrible', 'hate', 'dislike', 'worst', 'boring', 'waste'}
         
         # Count positive and negative words
-        positive_count = sum(1 for token in doc if token.text in positive_words)
-        negative_count = sum(1 for token in doc if token.text in negative_words)
+        positive_count = sum(1 for token in doc if token.text in POSITIVE_WORDS)
+        negative_count = sum(1 for token in doc if token.text in NEGATIVE_WORDS)
         
         # Calculate simple sentiment score
         total = positive_count + negative_count
         if total == 0:
             return 0  # Neutral
         
-        return (positive_count - negative_count) / total 
\ No newline at end of file
+        return (positive_count - negative_count) / total
@@ -0,0 +1,328 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Optional
+
+import openai
+
+from services.execution_plan import remaining_budget
+from services.metrics import Counters, LatencyStats
+from services.rate_limiter import RateLimitExceeded, RateLimiter, get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+
+class OpenAIDeadlineExceeded(Exception):
+    """A completion could not finish (or start) within the request deadline"""
+
+
+def _parse_limits(spec: str) -> Dict[str, int]:
+    """Parse 'gpt-4o=8,gpt-4o-mini=16' into {'gpt-4o': 8, ...}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        model, _, limit = item.partition('=')
+        limits[model.strip()] = int(limit)
+    return limits
+
+
+class ResilientCompletions:
+    """
+    Guarded chat.completions.create for the sync and async OpenAI clients.
+
+    Every call holds a global in-flight slot and one for its model, and is
+    given whatever remains of the request budget (minus `reserve` seconds kept
+    for a fallback answer) as its timeout. A call that cannot get a slot or
+    finish in that time raises OpenAIDeadlineExceeded, so the caller can answer
+    locally instead. With hedging on, a call still running after the model's
+    recent p95 latency gets a duplicate request and the first reply wins; the
+    duplicate goes out only if a global and a model slot are free right away,
+    and each request frees its own slots when it finishes.
+    Every request, duplicates included, takes an 'openai' rate limit token
+    first; one that cannot be had before the deadline counts as a miss too.
+    """
+
+    def __init__(self, max_in_flight: int = 32, model_limits: Optional[Dict[str, int]] = None,
+                 default_timeout: float = 20.0, reserve: float = 0.5, min_call_seconds: float = 0.3,
+                 hedge: bool = False, hedge_percentile: float = 95.0, hedge_min_samples: int = 20,
+                 limiter: Optional[RateLimiter] = None):
+        self.max_in_flight = max_in_flight
+        self.model_limits = model_limits or {}
+        self.default_timeout = default_timeout
+        self.reserve = reserve
+        self.min_call_seconds = min_call_seconds
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.limiter = limiter
+
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._model_slots: Dict[str, threading.BoundedSemaphore] = {}
+        # Created on first async use, inside the event loop
+        self._async_slots: Optional[asyncio.Semaphore] = None
+        self._async_model_slots: Dict[str, asyncio.Semaphore] = {}
+        self._lock = threading.Lock()
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+
+        self._latency: Dict[str, LatencyStats] = {}
+        self.counters = Counters()
+
+    @classmethod
+    def from_env(cls) -> 'ResilientCompletions':
+        """Configured by OPENAI_MAX_IN_FLIGHT, OPENAI_MODEL_MAX_IN_FLIGHT, OPENAI_TIMEOUT and OPENAI_HEDGE*"""
+        return cls(
+            max_in_flight=int(os.getenv('OPENAI_MAX_IN_FLIGHT', '32')),
+            model_limits=_parse_limits(os.getenv('OPENAI_MODEL_MAX_IN_FLIGHT', '')),
+            default_timeout=float(os.getenv('OPENAI_TIMEOUT', '20')),
+            reserve=float(os.getenv('OPENAI_DEADLINE_RESERVE', '0.5')),
+            hedge=os.getenv('OPENAI_HEDGE', 'false').lower() == 'true',
+            hedge_percentile=float(os.getenv('OPENAI_HEDGE_PERCENTILE', '95')),
+            hedge_min_samples=int(os.getenv('OPENAI_HEDGE_MIN_SAMPLES', '20')),
+            limiter=get_rate_limiter(),
+        )
+
+    def create(self, client, **kwargs) -> Any:
+        """client.chat.completions.create(**kwargs) within the limits and the request deadline"""
+        model = kwargs.get('model', '')
+        deadline = self._deadline()
+        if not self._acquire(model, deadline):
+            self.counters.incr('busy')
+            raise OpenAIDeadlineExceeded(f"No OpenAI slot for {model} before the deadline")
+        hedge_after = self._hedge_after(model)
+        if hedge_after is None or hedge_after >= deadline - time.monotonic():
+            try:
+                return self._call(client, model, deadline, kwargs)
+            finally:
+                self._release(model)
+        # The worker thread running the call releases its slots
+        return self._call_hedged(client, model, deadline, hedge_after, kwargs)
+
+    async def create_async(self, client, **kwargs) -> Any:
+        """Asyncio variant of create() for AsyncOpenAI clients"""
+        model = kwargs.get('model', '')
+        deadline = self._deadline()
+        slots = self._async_semaphores(model)
+        acquired = []
+        try:
+            for slot in slots:
+                await asyncio.wait_for(slot.acquire(), timeout=max(0.0, deadline - time.monotonic()))
+                acquired.append(slot)
+        except asyncio.TimeoutError:
+            for slot in acquired:
+                slot.release()
+            self.counters.incr('busy')
+            raise OpenAIDeadlineExceeded(f"No OpenAI slot for {model} before the deadline")
+
+        primary = self._task_holding(acquired, self._call_async(client, model, deadline, kwargs))
+        tasks = {primary}
+        try:
+            hedge_after = self._hedge_after(model)
+            if hedge_after is not None and hedge_after < deadline - time.monotonic():
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                # The duplicate only goes out if it can get its own slots right away
+                if not done and all(not slot.locked() for slot in slots):
+                    for slot in slots:
+                        await slot.acquire()
+                    self.counters.incr('hedges')
+                    tasks.add(self._task_holding(slots, self._call_async(client, model, deadline, kwargs)))
+            return await self._first_success(tasks, primary)
+        finally:
+            # Requests still running are not needed any more; each frees its slots as it ends
+            for task in tasks:
+                task.cancel()
+
+    def metrics(self) -> Dict[str, object]:
+        with self._lock:
+            latency = {model: stats.snapshot() for model, stats in self._latency.items()}
+        return {
+            'max_in_flight': self.max_in_flight,
+            'hedging': self.hedge,
+            'counters': self.counters.snapshot(),
+            'latency': latency,
+        }
+
+    def _deadline(self) -> float:
+        """Monotonic time by which the completion must be done"""
+        budget = remaining_budget()
+        seconds = self.default_timeout if budget is None else min(self.default_timeout, budget - self.reserve)
+        if seconds < self.min_call_seconds:
+            self.counters.incr('no_budget')
+            raise OpenAIDeadlineExceeded("Not enough of the request budget left for an OpenAI call")
+        return time.monotonic() + seconds
+
+    def _model_semaphore(self, model: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if model not in self._model_slots:
+                self._model_slots[model] = threading.BoundedSemaphore(
+                    self.model_limits.get(model, self.max_in_flight))
+            return self._model_slots[model]
+
+    def _acquire(self, model: str, deadline: float) -> bool:
+        if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            return False
+        if not self._model_semaphore(model).acquire(timeout=max(0.0, deadline - time.monotonic())):
+            self._slots.release()
+            return False
+        return True
+
+    def _try_acquire(self, model: str) -> bool:
+        """Take a global and a model slot only if both are free now"""
+        if not self._slots.acquire(blocking=False):
+            return False
+        if not self._model_semaphore(model).acquire(blocking=False):
+            self._slots.release()
+            return False
+        return True
+
+    def _release(self, model: str) -> None:
+        self._model_semaphore(model).release()
+        self._slots.release()
+
+    def _submit_holding(self, client, model: str, deadline: float, kwargs: Dict[str, Any]):
+        """
+        Run _call in a hedge pool thread, in a copy of the caller's context so the
+        request deadline and rate limit priority apply; the slots the caller took
+        for it are released when the call returns
+        """
+        try:
+            future = self._get_hedge_pool().submit(contextvars.copy_context().run,
+                                                   self._call, client, model, deadline, kwargs)
+        except BaseException:
+            self._release(model)
+            raise
+        future.add_done_callback(lambda _: self._release(model))
+        return future
+
+    @staticmethod
+    def _task_holding(slots, coro) -> asyncio.Future:
+        """Schedule `coro`, releasing the acquired `slots` when it ends"""
+        def release(_):
+            for slot in slots:
+                slot.release()
+
+        task = asyncio.ensure_future(coro)
+        task.add_done_callback(release)
+        return task
+
+    def _async_semaphores(self, model: str):
+        with self._lock:
+            if self._async_slots is None:
+                self._async_slots = asyncio.Semaphore(self.max_in_flight)
+            if model not in self._async_model_slots:
+                self._async_model_slots[model] = asyncio.Semaphore(
+                    self.model_limits.get(model, self.max_in_flight))
+            return self._async_slots, self._async_model_slots[model]
+
+    def _stats(self, model: str) -> LatencyStats:
+        with self._lock:
+            if model not in self._latency:
+                self._latency[model] = LatencyStats()
+            return self._latency[model]
+
+    def _hedge_after(self, model: str) -> Optional[float]:
+        """Seconds after which a duplicate request is sent, or None when hedging does not apply"""
+        if not self.hedge:
+            return None
+        stats = self._stats(model)
+        if stats.count < self.hedge_min_samples:
+            return None
+        return stats.percentile(self.hedge_percentile)
+
+    def _call(self, client, model: str, deadline: float, kwargs: Dict[str, Any]) -> Any:
+        if self.limiter is not None:
+            try:
+                self.limiter.acquire('openai', model, deadline)
+            except RateLimitExceeded as e:
+                self.counters.incr('rate_limited')
+                raise OpenAIDeadlineExceeded(str(e)) from e
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            raise OpenAIDeadlineExceeded(f"OpenAI {model} deadline passed")
+        started = time.perf_counter()
+        self.counters.incr('calls')
+        try:
+            response = client.with_options(timeout=timeout, max_retries=0).chat.completions.create(**kwargs)
+        except openai.APITimeoutError as e:
+            self.counters.incr('timeouts')
+            raise OpenAIDeadlineExceeded(f"OpenAI {model} call timed out after {timeout:.2f}s") from e
+        except Exception:
+            self.counters.incr('errors')
+            raise
+        self._stats(model).record(time.perf_counter() - started)
+        return response
+
+    async def _call_async(self, client, model: str, deadline: float, kwargs: Dict[str, Any]) -> Any:
+        if self.limiter is not None:
+            try:
+                await self.limiter.acquire_async('openai', model, deadline)
+            except RateLimitExceeded as e:
+                self.counters.incr('rate_limited')
+                raise OpenAIDeadlineExceeded(str(e)) from e
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            raise OpenAIDeadlineExceeded(f"OpenAI {model} deadline passed")
+        started = time.perf_counter()
+        self.counters.incr('calls')
+        try:
+            response = await client.with_options(timeout=timeout, max_retries=0).chat.completions.create(**kwargs)
+        except openai.APITimeoutError as e:
+            self.counters.incr('timeouts')
+            raise OpenAIDeadlineExceeded(f"OpenAI {model} call timed out after {timeout:.2f}s") from e
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.counters.incr('errors')
+            raise
+        self._stats(model).record(time.perf_counter() - started)
+        return response
+
+    def _call_hedged(self, client, model: str, deadline: float, hedge_after: float, kwargs: Dict[str, Any]) -> Any:
+        """
+        Run the call (whose slots the caller holds) in a worker thread and send a
+        duplicate if it is still running after `hedge_after`
+        """
+        primary = self._submit_holding(client, model, deadline, kwargs)
+        futures = {primary}
+        done, _ = wait(futures, timeout=hedge_after)
+        # The duplicate only goes out if it can get its own slots right away. A sync
+        # request cannot be cancelled, so each keeps its slots until it returns.
+        if not done and self._try_acquire(model):
+            self.counters.incr('hedges')
+            futures.add(self._submit_holding(client, model, deadline, kwargs))
+
+        errors = []
+        while futures:
+            done, futures = wait(futures, timeout=max(0.0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                self.counters.incr('timeouts')
+                raise OpenAIDeadlineExceeded(f"OpenAI {model} call missed its deadline")
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self.counters.incr('hedge_wins')
+                    return future.result()
+                errors.append(future.exception())
+        raise errors[0]
+
+    async def _first_success(self, tasks, primary) -> Any:
+        errors = []
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        self.counters.incr('hedge_wins')
+                    return task.result()
+                errors.append(task.exception())
+        raise errors[0]
+
+    def _get_hedge_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=self.max_in_flight * 2,
+                                                      thread_name_prefix="openai-hedge")
+            return self._hedge_pool
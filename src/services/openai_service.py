@@ -1,14 +1,135 @@
+import contextvars
+import hashlib
+import json
 import os
+from contextlib import contextmanager
 from openai import OpenAI
-from typing import Tuple, Optional, Dict, Any, List
+from typing import Tuple, Optional, Dict, Any, List, Callable
 from dotenv import load_dotenv
+from services.cache import MISSING, build_cache_from_env
+from services.context_builder import ContextBuilder
+from services.history_store import build_history_store_from_env
+from services.metrics import Counters, SampleStats
+from services.openai_client import OpenAIDeadlineExceeded, ResilientCompletions
 
 load_dotenv()
 
+# Chat completions made by the request currently being counted, if any
+_request_calls: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar(
+    'openai_request_calls', default=None
+)
+
+
+@contextmanager
+def counting_calls():
+    """Collect the chat completions made in this block (thread or asyncio task); yields their call names"""
+    calls: List[str] = []
+    token = _request_calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _request_calls.reset(token)
+
+INTENT_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": """
+    You are a movie recommendation assistant. Your job is to:
+    1. Understand what the user is asking about movies
+    2. Extract the intent of their message (get_info, mark_watched, help, list_watched, or unknown)
+    3. Extract any movie titles mentioned
+    4. Provide additional context that might be helpful
+    
+    Respond in JSON format with the following structure:
+    {
+        "intent": "get_info|mark_watched|help|list_watched|unknown",
+        "movie_title": "extracted movie title or null if none",
+        "context": {
+            "additional_info": "any additional information extracted",
+            "sentiment": "positive|negative|neutral",
+            "confidence": 0.0-1.0
+        }
+    }
+    """
+}
+
+# Strict schema for the intent reply (OPENAI_STRUCTURED_OUTPUTS=true), so it always parses
+INTENT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "movie_intent",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "intent": {"type": "string",
+                           "enum": ["get_info", "mark_watched", "help", "list_watched", "unknown"]},
+                "movie_title": {"type": ["string", "null"]},
+                "context": {
+                    "type": "object",
+                    "properties": {
+                        "additional_info": {"type": "string"},
+                        "sentiment": {"type": "string", "enum": ["positive", "negative", "neutral"]},
+                        "confidence": {"type": "number"}
+                    },
+                    "required": ["additional_info", "sentiment", "confidence"],
+                    "additionalProperties": False
+                }
+            },
+            "required": ["intent", "movie_title", "context"],
+            "additionalProperties": False
+        }
+    }
+}
+
+TOOLS_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": """
+    You are a friendly movie recommendation assistant on WhatsApp.
+    Use the tools to look up movies, mark movies the user has watched and list their watched movies.
+    Never invent scores or release dates; only use what the tools return.
+    If the user asks for help, explain that they can ask about a movie, say they watched one, or ask for their watched list.
+    Keep your responses conversational, helpful, and concise (suitable for WhatsApp).
+    """
+}
+
+
+def _function_tool(name: str, description: str, properties: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "strict": True,
+            "parameters": {
+                "type": "object",
+                "properties": properties,
+                "required": list(properties),
+                "additionalProperties": False
+            }
+        }
+    }
+
+
+TITLE_PARAMETER = {"title": {"type": "string", "description": "Movie title as the user wrote it"}}
+
+# Operations offered to the model with OPENAI_MODE=tools; MessageHandler supplies the implementations
+MOVIE_TOOLS = [
+    _function_tool("get_movie_info", "Score, release date, overview and similar movies for a movie",
+                   TITLE_PARAMETER),
+    _function_tool("mark_watched", "Mark a movie as watched by the user and get recommendations based on it",
+                   TITLE_PARAMETER),
+    _function_tool("list_watched", "The user's watched movie count and most recently watched movies", {}),
+]
+
+# Generated replies are reused for identical requests for a day unless OPENAI_CACHE_TTLS says otherwise
+DEFAULT_RESPONSE_CACHE_TTLS = {'response': 86400}
+
+RESPONSE_FAILURE_MESSAGE = "I'm having trouble generating a response right now. Please try again later."
+
 class OpenAIService:
     """Service for advanced natural language processing using OpenAI models"""
     
-    def __init__(self):
+    def __init__(self, mode: Optional[str] = None):
         # Get API key from environment variables
         self.api_key = os.getenv('OPENAI_API_KEY')
         if not self.api_key:
@@ -20,95 +141,260 @@ class OpenAIService:
         # Default model to use
         self.model = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
         
-        # Initialize conversation history
-        self.conversation_histories = {}
+        # In-flight limits, deadlines from the request budget and optional hedging for every call
+        self.completions = ResilientCompletions.from_env()
+        
+        # Bounded per-user conversation history, in memory or shared through Mongo
+        self.history = build_history_store_from_env()
+        # Separate token-budgeted histories for classification and generation, older turns summarised
+        self.context = ContextBuilder(
+            self.history,
+            budgets={'intent': int(os.getenv('OPENAI_INTENT_CONTEXT_TOKENS', '300')),
+                     'chat': int(os.getenv('OPENAI_CHAT_CONTEXT_TOKENS', '500'))},
+            summary_tokens=int(os.getenv('OPENAI_SUMMARY_TOKENS', '120'))
+        )
+        
+        # 'two_call' (intent extraction, then response) or 'tools' (one conversation with tool calls)
+        self.mode = (mode or os.getenv('OPENAI_MODE', 'two_call')).lower()
+        # Strict JSON schema for intent replies; needs a model that supports structured outputs
+        self.structured_outputs = os.getenv('OPENAI_STRUCTURED_OUTPUTS', 'false').lower() == 'true'
+        self.max_tool_rounds = int(os.getenv('OPENAI_TOOL_ROUNDS', '3'))
+        # 'model' writes the answer from tool results (a second completion); 'template' renders it locally
+        self.tool_reply = os.getenv('OPENAI_TOOL_REPLY', 'model').lower()
+        
+        # Completions made and tokens used, in total and per request for each kind of call
+        self.usage = Counters()
+        self.request_tokens = {call: {'prompt': SampleStats(), 'completion': SampleStats()}
+                               for call in ('intent', 'response', 'tools')}
+        
+        # Replies for identical (model, system prompt, prompt, history) requests.
+        # Intents listed in OPENAI_STATELESS_INTENTS (none by default) are answered
+        # without history or per-message context, so their replies are shared by every user.
+        self.response_cache = (build_cache_from_env('OPENAI', DEFAULT_RESPONSE_CACHE_TTLS)
+                               if os.getenv('OPENAI_RESPONSE_CACHE', 'true').lower() == 'true' else None)
+        self.stateless_intents = set(filter(None, (
+            intent.strip() for intent in os.getenv('OPENAI_STATELESS_INTENTS', '').split(','))))
     
     def process_message(self, message: str, user_id: str) -> Tuple[str, Optional[str], Dict[str, Any]]:
         """
         Process a message using OpenAI to determine intent and extract entities
         Returns: (intent, entity, context)
         """
-        # Get or initialize conversation history for this user
-        if user_id not in self.conversation_histories:
-            self.conversation_histories[user_id] = []
-        
-        # Add user message to history
-        self.conversation_histories[user_id].append({
-            "role": "user",
-            "content": message
-        })
-        
-        # Prepare the system message with instructions
-        system_message = {
-            "role": "system",
-            "content": """
-            You are a movie recommendation assistant. Your job is to:
-            1. Understand what the user is asking about movies
-            2. Extract the intent of their message (get_info, mark_watched, help, list_watched, or unknown)
-            3. Extract any movie titles mentioned
-            4. Provide additional context that might be helpful
-            
-            Respond in JSON format with the following structure:
-            {
-                "intent": "get_info|mark_watched|help|list_watched|unknown",
-                "movie_title": "extracted movie title or null if none",
-                "context": {
-                    "additional_info": "any additional information extracted",
-                    "sentiment": "positive|negative|neutral",
-                    "confidence": 0.0-1.0
-                }
-            }
-            """
-        }
-        
-        # Create the messages array with system message and conversation history
-        # Limit history to last 5 messages to keep context manageable
-        messages = [system_message] + self.conversation_histories[user_id][-5:]
+        messages = self._build_intent_messages(message, user_id)
         
         try:
             # Call the OpenAI API using the new format
-            response = self.client.chat.completions.create(
+            response = self.completions.create(
+                self.client,
                 model=self.model,
                 messages=messages,
                 temperature=0.3,  # Lower temperature for more consistent outputs
-                max_tokens=150    # Limit token usage
+                max_tokens=150,   # Limit token usage
+                **self._intent_options()
             )
+            self._record_usage('intent', response)
             
             # Extract the response content
             content = response.choices[0].message.content
-            
-            # Add assistant response to history
-            self.conversation_histories[user_id].append({
-                "role": "assistant",
-                "content": content
-            })
-            
-            # Parse the JSON response
-            import json
-            try:
-                parsed = json.loads(content)
-                intent = parsed.get("intent", "unknown")
-                movie_title = parsed.get("movie_title")
-                context = parsed.get("context", {})
-                
-                return intent, movie_title, context
+            return self._parse_intent_response(content, user_id)
                 
-            except json.JSONDecodeError:
-                # If JSON parsing fails, fall back to default values
-                return "unknown", None, {"error": "Failed to parse response"}
+        except OpenAIDeadlineExceeded:
+            # The caller answers without OpenAI
+            raise
                 
         except Exception as e:
             # Handle API errors
             print(f"Error calling OpenAI API: {str(e)}")
             return "unknown", None, {"error": str(e)}
     
-    def generate_response(self, prompt: str, user_id: str, context: Dict[str, Any] = None) -> str:
+    def generate_response(self, prompt: str, user_id: str, context: Dict[str, Any] = None,
+                          intent: Optional[str] = None) -> str:
         """
         Generate a natural language response using OpenAI
         """
+        messages = self._build_response_messages(prompt, user_id, context, intent)
+        cache_key, cached = self._cached_response(messages)
+        if cached is not None:
+            return self._remember_reply(user_id, cached)
+        
+        try:
+            # Call the OpenAI API using the new format
+            response = self.completions.create(
+                self.client,
+                model=self.model,
+                messages=messages,
+                temperature=0.7,  # Higher temperature for more creative responses
+                max_tokens=300    # Allow longer responses
+            )
+            self._record_usage('response', response)
+            
+            # Extract and return the response content
+            return self._remember_reply(user_id, self._store_response(cache_key, response))
+            
+        except OpenAIDeadlineExceeded:
+            # The caller answers without OpenAI
+            raise
+            
+        except Exception as e:
+            # Handle API errors
+            print(f"Error generating response: {str(e)}")
+            return RESPONSE_FAILURE_MESSAGE
+
+    def respond_with_tools(self, message: str, user_id: str, tools: Dict[str, Callable[[Dict[str, Any]], Any]],
+                           render: Optional[Callable[[str, Dict[str, Any], Any], str]] = None) -> str:
+        """
+        Answer a message in one conversation: the model calls the movie tools it
+        needs (implemented by `tools`, keyed by name) and writes the reply from
+        their results. Messages that need no data take a single completion.
+        With OPENAI_TOOL_REPLY=template, tool results are turned into the reply
+        by `render(name, arguments, result)` instead, so every message takes one.
+        """
+        messages = self._build_tool_messages(message, user_id)
+        
+        try:
+            for round_number in range(self.max_tool_rounds):
+                response = self.completions.create(
+                    self.client,
+                    model=self.model,
+                    messages=messages,
+                    **self._tool_options(round_number)
+                )
+                self._record_usage('tools', response)
+                reply = response.choices[0].message
+                if not reply.tool_calls:
+                    return self._finish_tool_conversation(reply.content, user_id)
+                
+                messages.append(self._tool_call_message(reply))
+                results = [(call, self._run_tool(call, tools)) for call in reply.tool_calls]
+                if render is not None and self.tool_reply == 'template':
+                    return self._finish_tool_conversation(self._render_tool_results(results, render), user_id)
+                for call, result in results:
+                    messages.append(self._tool_result_message(call, result))
+            
+            return RESPONSE_FAILURE_MESSAGE
+            
+        except OpenAIDeadlineExceeded:
+            # The caller answers without OpenAI
+            raise
+            
+        except Exception as e:
+            # Handle API errors
+            print(f"Error generating response with tools: {str(e)}")
+            return RESPONSE_FAILURE_MESSAGE
+
+    # Prompt building and parsing shared with AsyncOpenAIService
+
+    def _intent_options(self) -> Dict[str, Any]:
+        return {'response_format': INTENT_RESPONSE_FORMAT} if self.structured_outputs else {}
+
+    def _tool_options(self, round_number: int) -> Dict[str, Any]:
+        # The last round has to answer instead of calling more tools
+        last_round = round_number == self.max_tool_rounds - 1
+        return {
+            'tools': MOVIE_TOOLS,
+            'tool_choice': 'none' if last_round else 'auto',
+            'temperature': 0.7,
+            'max_tokens': 300
+        }
+
+    def _record_usage(self, call: str, response) -> None:
+        self.usage.incr(f"{call}_calls")
+        calls = _request_calls.get()
+        if calls is not None:
+            calls.append(call)
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            self.usage.incr('prompt_tokens', usage.prompt_tokens or 0)
+            self.usage.incr('completion_tokens', usage.completion_tokens or 0)
+            self.request_tokens[call]['prompt'].record(usage.prompt_tokens or 0)
+            self.request_tokens[call]['completion'].record(usage.completion_tokens or 0)
+
+    def _remember_reply(self, user_id: str, content: Optional[str]) -> Optional[str]:
+        """Keep a generated reply in the generation history"""
+        if content:
+            self.context.record('chat', user_id, "assistant", content)
+        return content
+
+    def _build_tool_messages(self, message: str, user_id: str) -> List[Dict[str, Any]]:
+        """Record the user message and build the tool-calling conversation"""
+        self.context.record('chat', user_id, "user", message)
+        return [TOOLS_SYSTEM_MESSAGE] + self.context.context('chat', user_id)
+
+    @staticmethod
+    def _tool_call_message(reply) -> Dict[str, Any]:
+        """The assistant turn requesting tool calls, as it has to be sent back"""
+        return {
+            "role": "assistant",
+            "content": reply.content,
+            "tool_calls": [{
+                "id": call.id,
+                "type": "function",
+                "function": {"name": call.function.name, "arguments": call.function.arguments}
+            } for call in reply.tool_calls]
+        }
+
+    @staticmethod
+    def _run_tool(call, tools: Dict[str, Callable[[Dict[str, Any]], Any]]) -> Any:
+        """Call the implementation of a requested tool; async callers await the result"""
+        implementation = tools.get(call.function.name)
+        if implementation is None:
+            return {"error": f"Unknown tool '{call.function.name}'"}
+        return implementation(OpenAIService._tool_arguments(call))
+
+    @staticmethod
+    def _tool_arguments(call) -> Dict[str, Any]:
+        # Strict schemas guarantee the arguments match the tool's parameters
+        return json.loads(call.function.arguments or "{}")
+
+    @staticmethod
+    def _render_tool_results(results: List[Tuple[Any, Any]], render: Callable[[str, Dict[str, Any], Any], str]) -> str:
+        return "\n\n".join(render(call.function.name, OpenAIService._tool_arguments(call), result)
+                            for call, result in results)
+
+    @staticmethod
+    def _tool_result_message(call, result: Any) -> Dict[str, Any]:
+        return {"role": "tool", "tool_call_id": call.id, "content": json.dumps(result, default=str)}
+
+    def _finish_tool_conversation(self, content: Optional[str], user_id: str) -> str:
+        """Record the final answer; only plain answers are kept in the history"""
+        if not content:
+            return RESPONSE_FAILURE_MESSAGE
+        return self._remember_reply(user_id, content)
+
+    def _build_intent_messages(self, message: str, user_id: str) -> List[Dict[str, str]]:
+        """Record the user message and build the intent extraction request"""
+        # The message belongs to both conversations; each keeps its own replies
+        self.context.record('intent', user_id, "user", message)
+        self.context.record('chat', user_id, "user", message)
+        
+        # Create the messages array with system message and the token-budgeted classification history
+        return [INTENT_SYSTEM_MESSAGE] + self.context.context('intent', user_id)
+
+    def _parse_intent_response(self, content: str, user_id: str) -> Tuple[str, Optional[str], Dict[str, Any]]:
+        """Record the assistant reply and parse it into (intent, entity, context)"""
+        # Parse the JSON response
+        try:
+            parsed = json.loads(content)
+            intent = parsed.get("intent", "unknown")
+            movie_title = parsed.get("movie_title")
+            context = parsed.get("context", {})
+        except json.JSONDecodeError:
+            # If JSON parsing fails, fall back to default values
+            intent, movie_title, context = "unknown", None, {"error": "Failed to parse response"}
+        
+        # Only the intent and title are worth keeping for the next classification
+        self.context.record('intent', user_id, "assistant",
+                            json.dumps({"intent": intent, "movie_title": movie_title}))
+        return intent, movie_title, context
+
+    def _build_response_messages(self, prompt: str, user_id: str, context: Dict[str, Any] = None,
+                                 intent: Optional[str] = None) -> List[Dict[str, str]]:
+        """Build the response generation request"""
+        stateless = intent in self.stateless_intents
+        
         # Prepare context information
         context_str = ""
-        if context:
+        if context and not stateless:
             context_str = f"Context: {context}\n\n"
         
         # Create the system message
@@ -122,33 +408,64 @@ class OpenAIService:
             """
         }
         
-        # Get conversation history for this user
-        history = self.conversation_histories.get(user_id, [])
+        # Token-budgeted generation history (user messages and earlier replies, never intent JSON)
+        history = [] if stateless else self.context.context('chat', user_id)
         
         # Create messages array
-        messages = [system_message] + history[-5:] + [{
+        return [system_message] + history + [{
             "role": "user",
             "content": prompt
         }]
-        
-        try:
-            # Call the OpenAI API using the new format
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,  # Higher temperature for more creative responses
-                max_tokens=300    # Allow longer responses
-            )
-            
-            # Extract and return the response content
-            return response.choices[0].message.content
-            
-        except Exception as e:
-            # Handle API errors
-            print(f"Error generating response: {str(e)}")
-            return "I'm having trouble generating a response right now. Please try again later."
     
+    def _response_cache_key(self, messages: List[Dict[str, str]]) -> str:
+        """
+        'response:<digest>' of the model, the system prompt, the prompt and a
+        fingerprint of the history in between. The prompt is built from TMDb and
+        watched-list data, so it is hashed exactly: "7.5/10" and "7 5 10" differ.
+        """
+        system, history, prompt = messages[0], messages[1:-1], messages[-1]
+        fingerprint = hashlib.sha256(json.dumps(history, sort_keys=True).encode()).hexdigest()
+        material = json.dumps([self.model, system['content'], prompt['content'], fingerprint])
+        return f"response:{hashlib.sha256(material.encode()).hexdigest()}"
+
+    def _cached_response(self, messages: List[Dict[str, str]]) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Look up a generated reply
+        Returns: (cache key, reply or None)
+        """
+        if self.response_cache is None:
+            return None, None
+        key = self._response_cache_key(messages)
+        entry = self.response_cache.get(key)
+        if entry is MISSING:
+            return key, None
+        self.usage.incr('cached_responses')
+        self.usage.incr('tokens_saved', entry.get('tokens', 0))
+        return key, entry['content']
+
+    def _store_response(self, cache_key: Optional[str], response) -> str:
+        """Cache a generated reply with the tokens it cost, and return its text"""
+        content = response.choices[0].message.content
+        if cache_key is not None and content:
+            usage = getattr(response, 'usage', None)
+            self.response_cache.set(cache_key, {'content': content,
+                                                'tokens': usage.total_tokens if usage is not None else 0})
+        return content
+
     def clear_history(self, user_id: str) -> None:
         """Clear conversation history for a user"""
-        if user_id in self.conversation_histories:
-            self.conversation_histories[user_id] = [] 
\ No newline at end of file
+        self.context.clear(user_id)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Conversation history gauges, token usage, response cache hit rate and call limits"""
+        metrics = {
+            'mode': self.mode,
+            'client': self.completions.metrics(),
+            'history': self.history.metrics(),
+            'usage': self.usage.snapshot(),
+            'request_tokens': {call: {kind: stats.snapshot() for kind, stats in kinds.items()}
+                               for call, kinds in self.request_tokens.items()},
+        }
+        if self.response_cache is not None:
+            metrics['response_cache'] = self.response_cache.metrics()
+        return metrics
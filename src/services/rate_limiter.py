@@ -0,0 +1,368 @@
+import asyncio
+import contextvars
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from services.execution_plan import remaining_budget
+from services.metrics import Counters, LatencyStats
+
+logger = logging.getLogger(__name__)
+
+# Priority classes: live user requests may borrow ahead of the bucket and are
+# served first; background work (prewarming, refreshes, bulk jobs) only takes
+# tokens while the bucket holds more than its reserve for live traffic
+LIVE, BACKGROUND = 'live', 'background'
+
+# Requests per second (and optional burst) per provider or provider.endpoint
+DEFAULT_LIMITS = 'tmdb=40'
+
+# Buckets that pace a background worker on their own (see RateLimiter.try_take),
+# outside the provider limits: the TMDb refresher's TMDB_REFRESH_RPS
+REFRESH_BUCKET = 'tmdb_refresh'
+PACING_BUCKETS = (REFRESH_BUCKET,)
+
+_request_priority: contextvars.ContextVar[str] = contextvars.ContextVar('request_priority', default=LIVE)
+
+
+class RateLimitExceeded(Exception):
+    """A token could not be had within the time the caller may wait"""
+
+
+@contextmanager
+def request_priority(priority: str):
+    """Set the priority class of outbound calls made by the current thread or asyncio task"""
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+def current_priority() -> str:
+    return _request_priority.get()
+
+
+def _parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Parse 'tmdb=40,tmdb.search=20:40' into {'tmdb': (40.0, 40.0), 'tmdb.search': (20.0, 40.0)}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, value = item.partition('=')
+        rate, _, burst = value.partition(':')
+        limits[name.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+def _take(tokens: float, updated: float, now: float, rate: float, burst: float,
+          borrow: bool, floor: float) -> Tuple[float, bool, float]:
+    """
+    Refill a bucket and try to take one token
+    Returns: (tokens left, granted, seconds to wait)
+
+    Borrowing always takes the token, possibly into debt, and the wait is the
+    time until it is paid off. Otherwise the token is only taken if at least
+    `floor` tokens remain, and the wait is the time until that is the case.
+    """
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate) if updated else burst
+    if borrow:
+        tokens -= 1
+        return tokens, True, max(0.0, -tokens / rate)
+    if tokens - 1 >= floor:
+        return tokens - 1, True, 0.0
+    return tokens, False, (floor + 1 - tokens) / rate
+
+
+class MemoryBuckets:
+    """Bucket state for one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, Tuple[float, float]] = {}
+
+    def take(self, name: str, rate: float, burst: float, borrow: bool, floor: float) -> Tuple[bool, float]:
+        with self._lock:
+            tokens, updated = self._state.get(name, (0.0, 0.0))
+            now = time.monotonic()
+            tokens, granted, wait = _take(tokens, updated, now, rate, burst, borrow, floor)
+            self._state[name] = (tokens, now)
+        return granted, wait
+
+    def refund(self, name: str, burst: float) -> None:
+        with self._lock:
+            tokens, updated = self._state.get(name, (burst, 0.0))
+            self._state[name] = (min(burst, tokens + 1), updated)
+
+
+class SharedMemoryBuckets:
+    """
+    Bucket state in a memory-mapped file (under /dev/shm where available),
+    shared by every worker on the node and guarded by an exclusive file lock.
+
+    Buckets get fixed slots by sorted name. The file name ends with a
+    fingerprint of the names ('<path>.<crc32>'), so workers started with
+    different limits (say, during a rolling restart) use different files
+    instead of resizing or resetting one another's mapping, which could crash
+    a worker still reading it (SIGBUS). A file is only ever sized once, when
+    it is created. Times are CLOCK_MONOTONIC, which all processes on a host share.
+    """
+
+    HEADER = struct.Struct('<II')
+    SLOT = struct.Struct('<dd')
+
+    def __init__(self, path: str, names: List[str]):
+        import fcntl
+        self._fcntl = fcntl
+        self._slots = {name: index for index, name in enumerate(sorted(names))}
+        self._size = self.HEADER.size + self.SLOT.size * max(1, len(self._slots))
+        fingerprint = zlib.crc32("\n".join(sorted(names)).encode('utf-8'))
+        self.path = f"{path}.{fingerprint:08x}"
+
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._file_lock():
+            size = os.fstat(self._fd).st_size
+            if size == 0:
+                os.ftruncate(self._fd, self._size)
+            elif size != self._size:
+                os.close(self._fd)
+                raise ValueError(f"Rate limit file {self.path} is {size} bytes, expected {self._size}")
+            self._map = mmap.mmap(self._fd, self._size)
+            if self.HEADER.unpack_from(self._map, 0) != (fingerprint, len(self._slots)):
+                # A new file: every bucket starts full
+                self.HEADER.pack_into(self._map, 0, fingerprint, len(self._slots))
+
+    @contextmanager
+    def _file_lock(self):
+        # flock excludes other processes; the thread lock, other threads of this one
+        with self._lock:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+    def take(self, name: str, rate: float, burst: float, borrow: bool, floor: float) -> Tuple[bool, float]:
+        offset = self.HEADER.size + self.SLOT.size * self._slots[name]
+        with self._file_lock():
+            tokens, updated = self.SLOT.unpack_from(self._map, offset)
+            now = time.monotonic()
+            tokens, granted, wait = _take(tokens, updated, now, rate, burst, borrow, floor)
+            self.SLOT.pack_into(self._map, offset, tokens, now)
+        return granted, wait
+
+    def refund(self, name: str, burst: float) -> None:
+        offset = self.HEADER.size + self.SLOT.size * self._slots[name]
+        with self._file_lock():
+            tokens, updated = self.SLOT.unpack_from(self._map, offset)
+            self.SLOT.pack_into(self._map, offset, min(burst, tokens + 1), updated)
+
+
+class MongoBuckets:
+    """
+    Bucket state in a MongoDB collection, shared by every worker on every node.
+    Each take is one atomic pipeline update; times are wall-clock seconds.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def take(self, name: str, rate: float, burst: float, borrow: bool, floor: float) -> Tuple[bool, float]:
+        from pymongo import ReturnDocument
+
+        now = time.time()
+        elapsed = {'$max': [0, {'$subtract': [now, {'$ifNull': ['$updated', now]}]}]}
+        refill = {'$min': [burst, {'$add': [{'$ifNull': ['$tokens', burst]}, {'$multiply': [elapsed, rate]}]}]}
+        if borrow:
+            pipeline = [{'$set': {'tokens': {'$subtract': [refill, 1]}, 'updated': now}}]
+        else:
+            pipeline = [
+                {'$set': {'tokens': refill, 'updated': now}},
+                {'$set': {'granted': {'$gte': [{'$subtract': ['$tokens', 1]}, floor]}}},
+                {'$set': {'tokens': {'$cond': ['$granted', {'$subtract': ['$tokens', 1]}, '$tokens']}}},
+            ]
+        doc = self.collection.find_one_and_update({'_id': name}, pipeline, upsert=True,
+                                                  return_document=ReturnDocument.AFTER)
+        tokens = doc['tokens']
+        if borrow:
+            return True, max(0.0, -tokens / rate)
+        if doc['granted']:
+            return True, 0.0
+        return False, (floor + 1 - tokens) / rate
+
+    def refund(self, name: str, burst: float) -> None:
+        self.collection.update_one({'_id': name}, [{'$set': {'tokens': {'$min': [burst, {'$add': ['$tokens', 1]}]}}}])
+
+
+class RateLimiter:
+    """
+    Token buckets for outbound calls, per provider ('tmdb', 'openai',
+    'twilio') and optionally per endpoint ('tmdb.search', 'openai.gpt-4o').
+    A call takes a token from each configured bucket that applies to it;
+    providers and endpoints without a limit are not limited.
+
+    Live calls reserve their token and wait until it is due, giving up with
+    RateLimitExceeded when that is longer than `max_wait` or the request
+    budget left. Background calls (see request_priority) never go into debt
+    and only take tokens while more than `background_reserve` of the burst
+    remains, so live requests always find tokens first; they wait up to
+    `background_max_wait`. Waits are recorded per provider and priority.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], buckets=None, background_reserve: float = 0.5,
+                 max_wait: float = 5.0, background_max_wait: float = 60.0):
+        self.limits = limits
+        self.buckets = buckets or MemoryBuckets()
+        self.background_reserve = background_reserve
+        self.max_wait = max_wait
+        self.background_max_wait = background_max_wait
+        self._lock = threading.Lock()
+        self._waits: Dict[str, LatencyStats] = {}
+        self.counters = Counters()
+
+    @classmethod
+    def from_env(cls) -> 'RateLimiter':
+        """
+        Configured by RATE_LIMITS ('tmdb=40,openai=50,twilio=1', rate[:burst]),
+        RATE_LIMIT_BACKEND (memory|shm|mongo), RATE_LIMIT_SHM_PATH,
+        RATE_LIMIT_BACKGROUND_RESERVE, RATE_LIMIT_MAX_WAIT and
+        RATE_LIMIT_BACKGROUND_MAX_WAIT
+        """
+        limits = _parse_limits(os.getenv('RATE_LIMITS', DEFAULT_LIMITS))
+        backend = os.getenv('RATE_LIMIT_BACKEND', 'memory').lower()
+        buckets = None
+        if backend == 'shm':
+            directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            path = os.getenv('RATE_LIMIT_SHM_PATH', os.path.join(directory, 'agent_movies_rate_limits'))
+            buckets = SharedMemoryBuckets(path, list(limits) + list(PACING_BUCKETS))
+        elif backend == 'mongo':
+            from pymongo import MongoClient
+            client = MongoClient(os.getenv('MONGODB_URI'))
+            buckets = MongoBuckets(client.movie_score.rate_limits)
+        return cls(limits, buckets,
+                   background_reserve=float(os.getenv('RATE_LIMIT_BACKGROUND_RESERVE', '0.5')),
+                   max_wait=float(os.getenv('RATE_LIMIT_MAX_WAIT', '5')),
+                   background_max_wait=float(os.getenv('RATE_LIMIT_BACKGROUND_MAX_WAIT', '60')))
+
+    def acquire(self, provider: str, endpoint: str = '', deadline: Optional[float] = None) -> float:
+        """
+        Take a token for a call, sleeping until it is due
+        Returns: seconds waited
+        """
+        names = self._bucket_names(provider, endpoint)
+        if not names:
+            return 0.0
+        priority = current_priority()
+        started = time.monotonic()
+        while True:
+            wait, retry = self._take(names, priority, self._allowed_wait(priority, started, deadline))
+            time.sleep(wait)
+            if not retry:
+                return self._record(provider, priority, started)
+
+    async def acquire_async(self, provider: str, endpoint: str = '', deadline: Optional[float] = None) -> float:
+        """Asyncio variant of acquire(); the shared-memory and Mongo backends run off the event loop"""
+        names = self._bucket_names(provider, endpoint)
+        if not names:
+            return 0.0
+        priority = current_priority()
+        started = time.monotonic()
+        while True:
+            allowed = self._allowed_wait(priority, started, deadline)
+            if isinstance(self.buckets, MemoryBuckets):
+                wait, retry = self._take(names, priority, allowed)
+            else:
+                wait, retry = await asyncio.to_thread(self._take, names, priority, allowed)
+            await asyncio.sleep(wait)
+            if not retry:
+                return self._record(provider, priority, started)
+
+    def try_take(self, name: str, rate: float, burst: float = 1.0) -> Tuple[bool, float]:
+        """
+        Take a token from a pacing bucket without waiting. With a shared backend
+        every worker paces against the same bucket.
+        Returns: (granted, seconds until a token is due)
+        """
+        return self.buckets.take(name, rate, burst, False, 0.0)
+
+    def metrics(self) -> Dict[str, object]:
+        with self._lock:
+            waits = {name: stats.snapshot() for name, stats in self._waits.items()}
+        return {
+            'backend': type(self.buckets).__name__,
+            'limits': {name: {'rate': rate, 'burst': burst} for name, (rate, burst) in self.limits.items()},
+            'wait': waits,
+            'counters': self.counters.snapshot(),
+        }
+
+    def _bucket_names(self, provider: str, endpoint: str) -> List[str]:
+        names = [provider, f"{provider}.{endpoint}"] if endpoint else [provider]
+        return [name for name in names if name in self.limits]
+
+    def _allowed_wait(self, priority: str, started: float, deadline: Optional[float]) -> float:
+        if priority == BACKGROUND:
+            return self.background_max_wait - (time.monotonic() - started)
+        allowed = min(self.max_wait, remaining_budget(self.max_wait))
+        if deadline is not None:
+            allowed = min(allowed, deadline - time.monotonic())
+        return allowed
+
+    def _take(self, names: List[str], priority: str, allowed: float) -> Tuple[float, bool]:
+        """
+        Take a token from every bucket
+        Returns: (seconds to sleep, whether to try again afterwards)
+        """
+        borrow = priority != BACKGROUND
+        taken, wait, granted = [], 0.0, True
+        for name in names:
+            rate, burst = self.limits[name]
+            ok, bucket_wait = self.buckets.take(name, rate, burst, borrow, burst * self.background_reserve)
+            wait = max(wait, bucket_wait)
+            if ok:
+                taken.append(name)
+            granted = granted and ok
+
+        if wait > allowed:
+            for name in taken:
+                self.buckets.refund(name, self.limits[name][1])
+            self.counters.incr(f"{names[0]}.{priority}.rejected")
+            raise RateLimitExceeded(f"No {names[-1]} rate limit token within {max(0.0, allowed):.2f}s")
+        if not granted:
+            # Background work that found too few tokens gives back what it took and tries later
+            for name in taken:
+                self.buckets.refund(name, self.limits[name][1])
+            return wait, True
+        return wait, False
+
+    def _record(self, provider: str, priority: str, started: float) -> float:
+        waited = time.monotonic() - started
+        name = f"{provider}.{priority}"
+        with self._lock:
+            if name not in self._waits:
+                self._waits[name] = LatencyStats()
+            stats = self._waits[name]
+        stats.record(waited)
+        self.counters.incr(f"{name}.granted")
+        if waited > 0.001:
+            self.counters.incr(f"{name}.waited")
+        return waited
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the process-wide rate limiter shared by every outbound client"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter.from_env()
+    return _limiter
@@ -0,0 +1,176 @@
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from services.metrics import LatencyStats, Counters
+
+logger = logging.getLogger(__name__)
+
+BACKPRESSURE_POLICIES = ('reject', 'block', 'inline')
+
+
+class ReplyQueue:
+    """
+    Acknowledge-then-reply pipeline for incoming WhatsApp messages.
+
+    The webhook enqueues (message, sender) and returns right away; a bounded
+    pool of worker threads runs MessageHandler and delivers the answer through
+    WhatsAppService.send_message.
+
+    Backpressure when the queue is full:
+      - reject: do not enqueue, the caller answers with a "busy" reply
+      - block:  wait up to `block_timeout` seconds for a free slot, then reject
+      - inline: the caller processes the message synchronously instead
+
+    A `max_queue` of 0 leaves the queue unbounded.
+    """
+
+    def __init__(self, message_handler, whatsapp_service,
+                 workers: Optional[int] = None,
+                 max_queue: Optional[int] = None,
+                 backpressure: Optional[str] = None,
+                 block_timeout: Optional[float] = None):
+        self.message_handler = message_handler
+        self.whatsapp_service = whatsapp_service
+
+        self.workers = workers if workers is not None else int(os.getenv('REPLY_WORKERS', '4'))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv('REPLY_QUEUE_SIZE', '100'))
+        self.backpressure = (backpressure or os.getenv('REPLY_BACKPRESSURE', 'reject')).lower()
+        self.block_timeout = block_timeout if block_timeout is not None else float(
+            os.getenv('REPLY_BLOCK_TIMEOUT', '2.0'))
+
+        if self.workers < 1:
+            raise ValueError(f"Reply queue needs at least one worker, got {self.workers}")
+        if self.backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{self.backpressure}', "
+                             f"expected one of {BACKPRESSURE_POLICIES}")
+
+        self._queue: queue.Queue = queue.Queue(maxsize=self.max_queue)
+        self._threads = []
+        self._running = False
+
+        self.queue_wait = LatencyStats()
+        self.processing = LatencyStats()
+        self.counters = Counters()
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"reply-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Reply queue started with {self.workers} workers, depth {self.max_queue}, "
+                    f"backpressure '{self.backpressure}'")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Stop taking messages and let the workers deliver the ones already queued
+        for up to `timeout` seconds; messages still queued after that are dropped
+        """
+        if not self._running:
+            return
+        self._running = False
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        # Make room for the stop markers, so a full queue cannot hang shutdown
+        dropped = self._drain()
+        if dropped:
+            self.counters.incr('dropped', dropped)
+            logger.warning(f"Reply queue stopped with {dropped} undelivered messages")
+        for _ in self._threads:
+            try:
+                self._queue.put(None, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    def submit(self, message: str, sender: str) -> bool:
+        """
+        Queue a message for background processing
+        Returns: True if queued, False if the backpressure policy turned it away
+        or the queue is stopped
+        """
+        if not self._running:
+            self.counters.incr('rejected')
+            return False
+        item = (message, sender, time.perf_counter())
+        try:
+            if self.backpressure == 'block':
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            self.counters.incr('rejected')
+            logger.warning(f"Reply queue full ({self.max_queue}), turning away message from {sender}")
+            return False
+
+        self.counters.incr('enqueued')
+        return True
+
+    def process_inline(self, message: str, sender: str) -> Tuple[str, bool]:
+        """Process a message on the caller's thread (used by the 'inline' policy)"""
+        self.counters.incr('inline')
+        started = time.perf_counter()
+        try:
+            return self.message_handler.handle_message(message, sender)
+        finally:
+            self.processing.record(time.perf_counter() - started)
+
+    def metrics(self) -> Dict[str, object]:
+        return {
+            'queue_depth': self._queue.qsize(),
+            'max_queue': self.max_queue,
+            'workers': self.workers,
+            'backpressure': self.backpressure,
+            'counters': self.counters.snapshot(),
+            'queue_wait': self.queue_wait.snapshot(),
+            'processing': self.processing.snapshot(),
+        }
+
+    def _drain(self) -> int:
+        """
+        Remove every queued message without processing it
+        Returns: number of messages removed
+        """
+        dropped = 0
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return dropped
+            self._queue.task_done()
+            if item is not None:
+                dropped += 1
+
+    def _worker(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+
+            message, sender, enqueued_at = item
+            started = time.perf_counter()
+            self.queue_wait.record(started - enqueued_at)
+            try:
+                response_text, success = self.message_handler.handle_message(message, sender)
+                to_number = sender.replace('whatsapp:', '')
+                if self.whatsapp_service.send_message(to_number, response_text):
+                    self.counters.incr('delivered')
+                else:
+                    self.counters.incr('delivery_failed')
+            except Exception as e:
+                self.counters.incr('failed')
+                logger.error(f"Error processing queued message from {sender}: {str(e)}", exc_info=True)
+            finally:
+                self.processing.record(time.perf_counter() - started)
+                self._queue.task_done()
@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from services.cache import MISSING, TieredCache, build_cache_from_env, cache_key, normalize_query
+from services.metrics import Counters
+from services.title_index import trigrams
+
+# Confirmed mappings are kept for 30 days, unconfirmed candidates for a day;
+# override with TMDB_CORRECTION_CACHE_TTLS="correction=...,candidate=..."
+DEFAULT_CORRECTION_TTLS = {'correction': 30 * 24 * 3600, 'candidate': 24 * 3600}
+
+
+def similarity(first: str, second: str) -> float:
+    """Trigram Jaccard similarity of two normalised queries"""
+    first_grams, second_grams = trigrams(first), trigrams(second)
+    return len(first_grams & second_grams) / max(len(first_grams | second_grams), 1)
+
+
+class SearchCorrections:
+    """
+    Learned rewrites from failed title searches to the movie the user meant.
+
+    When a user's search finds nothing and a later search by the same user,
+    within `window` seconds, finds a movie with a similar query (trigram
+    similarity of at least `min_similarity`, so a typo and its fix rather than
+    a change of subject), the failed query becomes a candidate for that movie.
+    Once `confirmations` different users have made the same correction, it is
+    applied: the next time anyone sends the failed query, the movie is looked
+    up by id with no search at all. Candidates expire after a day unless
+    confirmed. Mappings live in their own tiered cache (TMDB_CORRECTION_CACHE_*,
+    TMDB_CORRECTION_SHARED_CACHE), so every worker can share them; recent
+    failures are kept per user, in process.
+    """
+
+    def __init__(self, cache: TieredCache, language: str = 'en-US', window: float = 300.0,
+                 max_failures: int = 3, max_users: int = 10000, min_similarity: float = 0.3,
+                 confirmations: int = 2):
+        self.cache = cache
+        self.language = language
+        self.window = window
+        self.min_similarity = min_similarity
+        self.confirmations = confirmations
+        self.max_failures = max_failures
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        # user id -> [(normalised query, time of the failure)], oldest user first
+        self._failures: "OrderedDict[str, List[Tuple[str, float]]]" = OrderedDict()
+        self.counters = Counters()
+
+    @classmethod
+    def from_env(cls, language: str) -> 'SearchCorrections':
+        """
+        Configured by TMDB_CORRECTION_WINDOW, TMDB_CORRECTION_MIN_SIMILARITY,
+        TMDB_CORRECTION_CONFIRMATIONS and the TMDB_CORRECTION cache settings
+        """
+        return cls(build_cache_from_env('TMDB_CORRECTION', DEFAULT_CORRECTION_TTLS), language,
+                   window=float(os.getenv('TMDB_CORRECTION_WINDOW', '300')),
+                   min_similarity=float(os.getenv('TMDB_CORRECTION_MIN_SIMILARITY', '0.3')),
+                   confirmations=int(os.getenv('TMDB_CORRECTION_CONFIRMATIONS', '2')))
+
+    def lookup(self, title: str) -> Optional[int]:
+        """Movie id learned (and confirmed) for a query that failed before, if any"""
+        movie_id = self.cache.get(self._key(title))
+        if movie_id is MISSING:
+            return None
+        self.counters.incr('applied')
+        return movie_id
+
+    def failed(self, user_id: str, title: str) -> None:
+        """Remember that a user's search found nothing"""
+        query = normalize_query(title)
+        if not query:
+            return
+        with self._lock:
+            failures = [f for f in self._failures.pop(user_id, []) if f[0] != query]
+            self._failures[user_id] = (failures + [(query, time.monotonic())])[-self.max_failures:]
+            while len(self._failures) > self.max_users:
+                self._failures.popitem(last=False)
+
+    def resolved(self, user_id: str, title: str, movie_id: int) -> None:
+        """A user's search found a movie: propose it for their recent, similar failed queries"""
+        with self._lock:
+            failures = self._failures.pop(user_id, None)
+        if not failures:
+            return
+        query = normalize_query(title)
+        cutoff = time.monotonic() - self.window
+        for failed_query, failed_at in failures:
+            if failed_at < cutoff or failed_query == query:
+                continue
+            if similarity(failed_query, query) < self.min_similarity:
+                self.counters.incr('dissimilar')
+                continue
+            self._confirm(user_id, failed_query, movie_id)
+
+    def _confirm(self, user_id: str, failed_query: str, movie_id: int) -> None:
+        """Count one user's vote for a correction and apply it once enough users agree"""
+        candidate_key = cache_key('candidate', failed_query, language=self.language)
+        candidate = self.cache.get(candidate_key)
+        users = candidate['users'] if candidate is not MISSING and candidate['movie_id'] == movie_id else []
+        if user_id not in users:
+            users = users + [user_id]
+        if len(users) < self.confirmations:
+            self.cache.set(candidate_key, {'movie_id': movie_id, 'users': users}, tags=[movie_id])
+            self.counters.incr('proposed')
+            return
+        self.cache.set(self._key(failed_query), movie_id, tags=[movie_id])
+        self.counters.incr('learned')
+
+    def invalidate_movie(self, movie_id: int) -> int:
+        """
+        Forget the corrections and candidates pointing at a movie
+        Returns: number of entries removed
+        """
+        return self.cache.invalidate_tag(movie_id)
+
+    def metrics(self) -> Dict[str, object]:
+        with self._lock:
+            pending = len(self._failures)
+        return {'pending_users': pending, 'cache': self.cache.metrics(), 'counters': self.counters.snapshot()}
+
+    def _key(self, title: str) -> str:
+        return cache_key('correction', title, language=self.language)
@@ -0,0 +1,122 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from services.execution_plan import remaining_budget
+from services.metrics import Counters
+
+
+class FlightTimeout(TimeoutError):
+    """A follower's request deadline passed while the call it joined was still running"""
+
+
+class _Flight:
+    """A call in progress; followers wait on `done` and share its outcome"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one execution.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is running wait for it and get the same result, or the
+    same exception. The key is forgotten as soon as the call finishes, so
+    nothing is cached here: a later call runs again (and will usually be
+    served by the cache the leader filled).
+
+    Threads use do(), asyncio tasks do_async(). The two keep separate tables,
+    so a thread and a task asking for the same key concurrently each make
+    their own call. An asyncio call runs in its own task, so cancelling one
+    waiter, the leader included, does not cancel it for the others.
+
+    A follower waits no longer than its own request budget (remaining_budget),
+    then raises `timeout_error` (FlightTimeout unless the caller expects
+    another exception type) while the call carries on for the others.
+    """
+
+    def __init__(self, name: str = '', timeout_error: Callable[[str], BaseException] = FlightTimeout):
+        self.name = name
+        self.timeout_error = timeout_error
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.counters = Counters()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run fn() unless a call for `key` is already in flight, in which case wait for its outcome"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+
+        if not leader:
+            self.counters.incr('coalesced')
+            if not flight.done.wait(remaining_budget()):
+                with self._lock:
+                    flight.waiters -= 1
+                raise self._timeout(key)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        self.counters.incr('calls')
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            self.counters.incr('errors')
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Asyncio variant of do(); fn is a coroutine function"""
+        task = self._tasks.get(key)
+        if task is None:
+            self.counters.incr('calls')
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._forget(key, done))
+            return await asyncio.shield(task)
+        self.counters.incr('coalesced')
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout=remaining_budget())
+        except asyncio.TimeoutError:
+            if task.done():
+                # The call itself timed out
+                raise
+            raise self._timeout(key) from None
+
+    def _timeout(self, key: str) -> BaseException:
+        self.counters.incr('timeouts')
+        return self.timeout_error(f"{self.name or 'call'} for {key} still running at the request deadline")
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Mark the outcome as retrieved even when every waiter was cancelled
+        if not task.cancelled() and task.exception() is not None:
+            self.counters.incr('errors')
+
+    def busy(self, key: str) -> bool:
+        """Whether a call for `key` is in flight, from a thread or an asyncio task"""
+        with self._lock:
+            return key in self._flights or key in self._tasks
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights) + len(self._tasks)
+
+    def metrics(self) -> Dict[str, object]:
+        return {'in_flight': self.in_flight(), 'counters': self.counters.snapshot()}
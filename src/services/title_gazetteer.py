@@ -0,0 +1,277 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from spacy.lang.en.stop_words import STOP_WORDS
+
+from services.cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+# Words that make up everyday phrases; a title made only of these ("Home",
+# "Thank You", "Good Morning") is usually the phrase, not the movie
+COMMON_WORDS = frozenset(STOP_WORDS) | {
+    'thank', 'thanks', 'hello', 'hi', 'hey', 'good', 'morning', 'afternoon', 'evening', 'night',
+    'day', 'home', 'ok', 'okay', 'yes', 'yeah', 'no', 'nope', 'please', 'sorry', 'bye', 'goodbye',
+    'love', 'like', 'great', 'nice', 'cool', 'fine', 'awesome', 'sure', 'welcome', 'help', 'lol',
+}
+
+QUOTES = "\"'“”‘’«»`"
+
+
+class TitleMatch(NamedTuple):
+    movie_id: int
+    title: str
+    matched: str
+    start: int
+    end: int
+    confidence: float
+
+
+class _Automaton:
+    """
+    Word-level Aho-Corasick automaton over normalised titles. Matching is linear
+    in the number of words in the text and only reports matches on word boundaries.
+    """
+
+    def __init__(self, patterns: Dict[Tuple[str, ...], List[Tuple[int, str, float]]]):
+        # Node 0 is the root; goto[n] maps a word to the next node
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.outputs: List[List[Tuple[str, ...]]] = [[]]
+        self.patterns = patterns
+
+        for words in patterns:
+            node = 0
+            for word in words:
+                nxt = self.goto[node].get(word)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][word] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                node = nxt
+            self.outputs[node].append(words)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for word, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(word, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def find(self, words: List[str]) -> List[Tuple[int, int, Tuple[str, ...]]]:
+        """All (start, end, pattern) word spans found in `words`"""
+        found = []
+        node = 0
+        for position, word in enumerate(words):
+            while node and word not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(word, 0)
+            for pattern in self.outputs[node]:
+                found.append((position + 1 - len(pattern), position + 1, pattern))
+        return found
+
+
+class TitleGazetteer:
+    """
+    Spots known movie titles and aliases inside a message.
+
+    Built from the most popular titles of the local title index (TMDB_TITLE_INDEX)
+    and an optional alias file (TITLE_ALIASES: 'alias<TAB>movie_id' per line).
+    When either file changes, a new automaton is built in the background and
+    swapped in, so updated title lists apply without a restart.
+    """
+
+    def __init__(self, index_path: Optional[str] = None, aliases_path: Optional[str] = None,
+                 size: int = 20000, refresh_interval: float = 60.0):
+        self.index_path = index_path
+        self.aliases_path = aliases_path
+        self.size = size
+        self.refresh_interval = refresh_interval
+
+        self._automaton: Optional[_Automaton] = None
+        self._sources: Tuple = ()
+        self._last_check = time.monotonic()
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self.generation = 0
+        if index_path or aliases_path:
+            self.reload()
+
+    @classmethod
+    def from_env(cls) -> Optional['TitleGazetteer']:
+        """Gazetteer over TMDB_TITLE_INDEX and TITLE_ALIASES, or None when neither exists"""
+        index_path = os.getenv('TMDB_TITLE_INDEX')
+        aliases_path = os.getenv('TITLE_ALIASES')
+        index_path = index_path if index_path and os.path.exists(index_path) else None
+        aliases_path = aliases_path if aliases_path and os.path.exists(aliases_path) else None
+        if not index_path and not aliases_path:
+            return None
+        return cls(index_path, aliases_path,
+                   size=int(os.getenv('TITLE_GAZETTEER_SIZE', '20000')),
+                   refresh_interval=float(os.getenv('TMDB_TITLE_INDEX_REFRESH', '60')))
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict], aliases: Optional[Dict[str, int]] = None) -> 'TitleGazetteer':
+        """Gazetteer over in-memory {'id', 'title', 'popularity'} records"""
+        gazetteer = cls()
+        gazetteer._automaton = cls._build(list(records), aliases or {})
+        gazetteer.generation = 1
+        return gazetteer
+
+    def find(self, text: str, slot: bool = False) -> List[TitleMatch]:
+        """
+        Every known title in the text, longest first.
+
+        `text` should keep the user's casing and quotes. Unless it is the title
+        slot of an already recognised request (`slot`), a match that is the
+        whole message or made only of common words scores lower when the user
+        did not quote or capitalise it.
+        """
+        self._check_for_update()
+        automaton = self._automaton
+        tokens = list(re.finditer(r"\w+", text))
+        words = [token.group().casefold() for token in tokens]
+        if automaton is None or not words:
+            return []
+
+        matches = []
+        for start, end, pattern in automaton.find(words):
+            candidates = automaton.patterns[pattern]
+            movie_id, title, _ = candidates[0]
+            confidence = self._confidence(pattern, words, len(candidates))
+            if not slot and not self._marked(text, tokens, start, end):
+                if all(word in COMMON_WORDS for word in pattern):
+                    confidence *= 0.5
+                if start == 0 and end == len(words):
+                    confidence -= 0.1
+            matches.append(TitleMatch(movie_id, title, " ".join(pattern), start, end, round(confidence, 3)))
+        matches.sort(key=lambda m: (m.end - m.start, len(m.matched), m.confidence), reverse=True)
+        return matches
+
+    def best(self, text: str, slot: bool = False) -> Optional[TitleMatch]:
+        """The longest known title in the text"""
+        matches = self.find(text, slot)
+        return matches[0] if matches else None
+
+    def reload(self) -> None:
+        """Rebuild the automaton from the source files and swap it in"""
+        sources = self._source_ids()
+        records = self._load_index() if self.index_path else []
+        aliases = self._load_aliases() if self.aliases_path else {}
+        automaton = self._build(records, aliases)
+        with self._lock:
+            self._automaton = automaton
+            self._sources = sources
+            self.generation += 1
+        logger.info(f"Title gazetteer built: {len(automaton.patterns)} titles and aliases")
+
+    def stats(self) -> Dict[str, object]:
+        automaton = self._automaton
+        return {
+            'generation': self.generation,
+            'patterns': len(automaton.patterns) if automaton else 0,
+            'nodes': len(automaton.goto) if automaton else 0,
+        }
+
+    @staticmethod
+    def _marked(text: str, tokens: List[re.Match], start: int, end: int) -> bool:
+        """Whether the user quoted the span or capitalised it (outside the message's first word)"""
+        before = text[tokens[start].start() - 1] if tokens[start].start() > 0 else ''
+        after = text[tokens[end - 1].end()] if tokens[end - 1].end() < len(text) else ''
+        if before and after and before in QUOTES and after in QUOTES:
+            return True
+        # All-caps or all-title-case messages say nothing about the span
+        if text.upper() == text or all(token.group()[0].isupper() for token in tokens):
+            return False
+        return any(tokens[i].group()[0].isupper() for i in range(max(start, 1), end))
+
+    @staticmethod
+    def _confidence(pattern: Tuple[str, ...], words: List[str], candidates: int) -> float:
+        """
+        How sure we are the match is the title the user meant: it covers more of
+        the text, is long enough not to be a common word, and names one movie only
+        """
+        matched_chars = sum(len(w) for w in pattern)
+        coverage = matched_chars / max(sum(len(w) for w in words), 1)
+        specificity = min(1.0, (matched_chars + len(pattern) - 1) / 12)
+        uniqueness = 1.0 / candidates
+        return round(0.35 * coverage + 0.35 * specificity + 0.3 * uniqueness, 3)
+
+    @staticmethod
+    def _build(records: List[Dict], aliases: Dict[str, int]) -> _Automaton:
+        patterns: Dict[Tuple[str, ...], List[Tuple[int, str, float]]] = {}
+        titles: Dict[int, Tuple[str, float]] = {}
+        for record in records:
+            titles[record['id']] = (record['title'], float(record.get('popularity') or 0.0))
+            words = tuple(normalize_query(record['title']).split())
+            if words:
+                patterns.setdefault(words, []).append((record['id'], record['title'], titles[record['id']][1]))
+        for alias, movie_id in aliases.items():
+            words = tuple(normalize_query(alias).split())
+            title, popularity = titles.get(movie_id, (alias, 0.0))
+            if words and all(existing[0] != movie_id for existing in patterns.get(words, [])):
+                patterns.setdefault(words, []).append((movie_id, title, popularity))
+        # Most popular movie first for titles shared by several movies
+        for candidates in patterns.values():
+            candidates.sort(key=lambda c: c[2], reverse=True)
+        return _Automaton(patterns)
+
+    def _load_index(self) -> List[Dict]:
+        conn = sqlite3.connect(f"file:{self.index_path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute("SELECT id, title, popularity FROM titles ORDER BY popularity DESC LIMIT ?",
+                                (self.size,)).fetchall()
+        finally:
+            conn.close()
+        return [{'id': row[0], 'title': row[1], 'popularity': row[2]} for row in rows]
+
+    def _load_aliases(self) -> Dict[str, int]:
+        aliases = {}
+        with open(self.aliases_path, encoding='utf-8') as f:
+            for line in f:
+                alias, _, movie_id = line.rstrip('\n').partition('\t')
+                if alias and movie_id.strip().isdigit():
+                    aliases[alias] = int(movie_id)
+        return aliases
+
+    def _source_ids(self) -> Tuple:
+        ids = []
+        for path in (self.index_path, self.aliases_path):
+            try:
+                stat = os.stat(path) if path else None
+                ids.append((stat.st_ino, stat.st_mtime_ns) if stat else None)
+            except FileNotFoundError:
+                ids.append(None)
+        return tuple(ids)
+
+    def _check_for_update(self) -> None:
+        now = time.monotonic()
+        if not (self.index_path or self.aliases_path) or now - self._last_check < self.refresh_interval:
+            return
+        with self._lock:
+            self._last_check = now
+            if self._rebuilding or self._source_ids() == self._sources:
+                return
+            self._rebuilding = True
+        # Keep answering from the current automaton while the new one is built
+        threading.Thread(target=self._rebuild_in_background, name="gazetteer-rebuild", daemon=True).start()
+
+    def _rebuild_in_background(self) -> None:
+        try:
+            self.reload()
+        except Exception as e:
+            logger.error(f"Title gazetteer rebuild failed: {str(e)}", exc_info=True)
+        finally:
+            self._rebuilding = False
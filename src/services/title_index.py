@@ -0,0 +1,270 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from services.cache import normalize_query
+
+SCHEMA = """
+CREATE TABLE titles (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    popularity REAL NOT NULL
+);
+CREATE TABLE names (
+    norm TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    popularity REAL NOT NULL
+);
+CREATE TABLE trigrams (
+    gram TEXT NOT NULL,
+    id INTEGER NOT NULL
+);
+CREATE TABLE grams (
+    gram TEXT PRIMARY KEY,
+    df INTEGER NOT NULL
+);
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Built after the bulk load, which is much faster than maintaining them row by row
+INDEXES = """
+CREATE INDEX names_norm ON names (norm, popularity DESC);
+CREATE INDEX names_id ON names (id);
+CREATE INDEX trigrams_gram ON trigrams (gram, id);
+INSERT INTO grams (gram, df) SELECT gram, COUNT(*) FROM trigrams GROUP BY gram;
+"""
+
+
+def trigrams(norm: str) -> set:
+    """Character trigrams of a normalised title, padded so short words still match"""
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def build_index(records: Iterable[Dict], path: str, fuzzy_min_popularity: float = 1.0,
+                batch_size: int = 10000) -> int:
+    """
+    Write a fresh title index to `path` from TMDb export records
+    ({"id", "original_title", "popularity", "adult", "video"}, plus "title"
+    when the source has the localised title).
+
+    The title and the original title are both indexed as names of the movie,
+    so a query in either language finds it.
+
+    The index is written next to `path` and moved into place atomically, so
+    running servers pick it up on their next refresh check without a restart.
+    Only titles at or above `fuzzy_min_popularity` get trigram postings,
+    which keeps the typo-tolerant index small.
+    Returns: number of titles indexed
+    """
+    tmp_path = f"{path}.building"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript("PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;")
+    conn.executescript(SCHEMA)
+
+    count = 0
+    title_rows, name_rows, gram_rows = [], [], []
+    for record in records:
+        if record.get('adult') or record.get('video'):
+            continue
+        names = {}
+        for field in ('title', 'original_title'):
+            norm = normalize_query(record.get(field) or '')
+            if norm and norm not in names:
+                names[norm] = record[field]
+        if not names:
+            continue
+        popularity = float(record.get('popularity') or 0.0)
+        # The localised title, when there is one, is the one shown to users
+        title_rows.append((record['id'], next(iter(names.values())), popularity))
+        name_rows.extend((norm, record['id'], popularity) for norm in names)
+        if popularity >= fuzzy_min_popularity:
+            grams = set().union(*(trigrams(norm) for norm in names))
+            gram_rows.extend((gram, record['id']) for gram in grams)
+        count += 1
+
+        if len(title_rows) >= batch_size:
+            _flush(conn, title_rows, name_rows, gram_rows)
+
+    _flush(conn, title_rows, name_rows, gram_rows)
+    conn.executescript(INDEXES)
+    conn.execute("INSERT INTO meta (key, value) VALUES ('built_at', ?), ('titles', ?)",
+                 (str(time.time()), str(count)))
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+    os.replace(tmp_path, path)
+    return count
+
+
+def _flush(conn: sqlite3.Connection, title_rows: List, name_rows: List, gram_rows: List) -> None:
+    conn.executemany("INSERT OR REPLACE INTO titles (id, title, popularity) VALUES (?, ?, ?)", title_rows)
+    conn.executemany("INSERT INTO names (norm, id, popularity) VALUES (?, ?, ?)", name_rows)
+    conn.executemany("INSERT INTO trigrams (gram, id) VALUES (?, ?)", gram_rows)
+    title_rows.clear()
+    name_rows.clear()
+    gram_rows.clear()
+
+
+class TitleIndex:
+    """
+    Read-only, memory-mapped title index built from TMDb's daily ID export.
+
+    SQLite maps the file into memory (PRAGMA mmap_size), so every worker process
+    on the host shares one copy through the OS page cache. The file is checked
+    for replacement at most every `refresh_interval` seconds and reopened when a
+    new build has been moved into place.
+
+    Only exact() matches are certain enough to skip a TMDb search; fuzzy()
+    matches are for when the search found nothing.
+    """
+
+    def __init__(self, path: str, refresh_interval: float = 60.0,
+                 mmap_size: int = 1 << 30, fuzzy_threshold: float = 0.6,
+                 max_candidates: int = 500):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.mmap_size = mmap_size
+        self.fuzzy_threshold = fuzzy_threshold
+        self.max_candidates = max_candidates
+
+        self._local = threading.local()
+        self._generation = 0
+        self._file_id = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._check_for_update(force=True)
+
+    @classmethod
+    def from_env(cls) -> Optional['TitleIndex']:
+        """Open the index named by TMDB_TITLE_INDEX, or None when unset or not built yet"""
+        path = os.getenv('TMDB_TITLE_INDEX')
+        if not path or not os.path.exists(path):
+            return None
+        return cls(path,
+                   refresh_interval=float(os.getenv('TMDB_TITLE_INDEX_REFRESH', '60')),
+                   fuzzy_threshold=float(os.getenv('TMDB_TITLE_INDEX_FUZZY_THRESHOLD', '0.6')),
+                   max_candidates=int(os.getenv('TMDB_TITLE_INDEX_MAX_CANDIDATES', '500')))
+
+    def exact(self, title: str) -> Optional[Dict]:
+        """Most popular movie with a title or original title whose normalised form equals the query"""
+        norm = normalize_query(title)
+        row = self._conn().execute(
+            "SELECT t.id, t.title, t.popularity FROM names n JOIN titles t ON t.id = n.id "
+            "WHERE n.norm = ? ORDER BY n.popularity DESC LIMIT 1",
+            (norm,)
+        ).fetchone()
+        return self._row(row, 1.0) if row else None
+
+    def prefix(self, text: str, limit: int = 10) -> List[Dict]:
+        """Movies with a name starting with the query, most popular first"""
+        norm = normalize_query(text)
+        if not norm:
+            return []
+        rows = self._conn().execute(
+            "SELECT t.id, t.title, t.popularity, n.norm FROM names n JOIN titles t ON t.id = n.id "
+            "WHERE n.norm >= ? AND n.norm < ? ORDER BY n.popularity DESC LIMIT ?",
+            (norm, norm + "\uffff", limit * 2)
+        ).fetchall()
+        matches, seen = [], set()
+        for row in rows:
+            if row[0] not in seen and len(matches) < limit:
+                seen.add(row[0])
+                matches.append(self._row(row, len(norm) / max(len(row[3]), 1)))
+        return matches
+
+    def fuzzy(self, text: str, limit: int = 5) -> List[Dict]:
+        """
+        Typo-tolerant lookup: names scored by trigram Jaccard similarity, ranked
+        by similarity weighted by popularity.
+
+        A name at least `fuzzy_threshold` similar must contain all but a few of
+        the query's trigrams, so it must contain one of the rarest few. Only
+        those rare trigrams' postings are read (prefix filtering), and every
+        candidate's names come back in the same query.
+        """
+        norm = normalize_query(text)
+        grams = trigrams(norm) if norm else set()
+        if not grams:
+            return []
+
+        conn = self._conn()
+        placeholders = ",".join("?" * len(grams))
+        df = dict(conn.execute(f"SELECT gram, df FROM grams WHERE gram IN ({placeholders})",
+                               tuple(grams)).fetchall())
+        # Trigrams no title has cannot be shared, so only the others can make up the overlap
+        ranked = sorted((gram for gram in grams if gram in df), key=df.get)
+        required = max(1, math.ceil(self.fuzzy_threshold * len(grams)))
+        if len(ranked) < required:
+            return []
+        rare = ranked[:len(ranked) - required + 1]
+
+        placeholders = ",".join("?" * len(rare))
+        rows = conn.execute(
+            f"SELECT t.id, t.title, t.popularity, n.norm FROM names n JOIN titles t ON t.id = n.id "
+            f"WHERE n.id IN (SELECT id FROM trigrams WHERE gram IN ({placeholders}) LIMIT ?)",
+            (*rare, self.max_candidates)
+        ).fetchall()
+
+        best: Dict[int, tuple] = {}
+        for movie_id, title, popularity, name in rows:
+            name_grams = trigrams(name)
+            similarity = len(grams & name_grams) / len(grams | name_grams)
+            if similarity >= self.fuzzy_threshold and similarity > best.get(movie_id, (0.0,))[0]:
+                best[movie_id] = (similarity, (movie_id, title, popularity))
+
+        scored = sorted(best.values(), key=lambda item: item[0] * (1 + math.log1p(item[1][2]) / 10), reverse=True)
+        return [self._row(row, similarity) for similarity, row in scored[:limit]]
+
+    def lookup(self, title: str) -> Optional[Dict]:
+        """Exact match first, then the best typo-tolerant match"""
+        match = self.exact(title)
+        if match:
+            return match
+        matches = self.fuzzy(title, limit=1)
+        return matches[0] if matches else None
+
+    def stats(self) -> Dict[str, object]:
+        conn = self._conn()
+        meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        return {'path': self.path, 'generation': self._generation, **meta}
+
+    def _row(self, row, score: float) -> Dict:
+        return {'id': row[0], 'title': row[1], 'popularity': row[2], 'score': round(score, 3)}
+
+    def _conn(self) -> sqlite3.Connection:
+        self._check_for_update()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'generation', None) != self._generation:
+            if conn is not None:
+                conn.close()
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+            self._local.conn = conn
+            self._local.generation = self._generation
+        return conn
+
+    def _check_for_update(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._last_check < self.refresh_interval:
+            return
+        with self._lock:
+            self._last_check = now
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return
+            file_id = (stat.st_ino, stat.st_mtime_ns)
+            if file_id != self._file_id:
+                self._file_id = file_id
+                self._generation += 1
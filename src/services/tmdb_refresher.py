@@ -0,0 +1,237 @@
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from services.metrics import Counters
+from services.rate_limiter import BACKGROUND, REFRESH_BUCKET, RateLimiter, get_rate_limiter, request_priority
+
+logger = logging.getLogger(__name__)
+
+# Queue priorities: stale entries users are reading first, then prewarming
+REVALIDATE, PREWARM = 0, 1
+
+# TMDb movie lists fetched when prewarming
+LISTS = ('trending', 'popular')
+
+
+class TMDbRefresher:
+    """
+    Background worker that keeps hot TMDb cache entries fresh.
+
+    - Stale-while-revalidate: TMDbService answers from a stale entry at once
+      and queues it here to be fetched again.
+    - Access counts per cache key, decayed after every prewarm.
+    - Prewarming, at start() and every `interval` seconds: the `top` most
+      requested keys that would expire before the next run, plus details and
+      similar movies for every movie on TMDb's trending and popular lists.
+
+    One worker thread does all refresh requests at background priority. They
+    are paced to at most `rps` requests per second by a bucket of the rate
+    limiter, so with a shared backend (RATE_LIMIT_BACKEND=shm or mongo) the
+    refreshers of every worker share that budget instead of multiplying it.
+    """
+
+    def __init__(self, tmdb_service, rps: float = 2.0, interval: float = 0.0, top: int = 50,
+                 lists: Tuple[str, ...] = LISTS, max_tracked: int = 10000, limiter: Optional[RateLimiter] = None):
+        self.tmdb_service = tmdb_service
+        self.rps = rps
+        self.limiter = limiter or get_rate_limiter()
+        self.interval = interval
+        self.top = top
+        self.lists = lists
+        self.max_tracked = max_tracked
+
+        self._lock = threading.Lock()
+        # cache key -> access count, and the request that fills it
+        self._counts: Dict[str, float] = {}
+        self._requests: Dict[str, Tuple[str, str, Dict[str, Any]]] = {}
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._queued = set()
+        self._sequence = itertools.count()
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.counters = Counters()
+
+    @classmethod
+    def from_env(cls, tmdb_service) -> Optional['TMDbRefresher']:
+        """
+        Refresher configured by TMDB_REFRESH_RPS, TMDB_PREWARM_INTERVAL,
+        TMDB_PREWARM_TOP and TMDB_PREWARM_LISTS; None unless stale entries are
+        kept (TMDB_CACHE_STALE_TTL) or prewarming is on
+        """
+        interval = float(os.getenv('TMDB_PREWARM_INTERVAL', '0'))
+        if tmdb_service.cache.stale_ttl <= 0 and interval <= 0:
+            return None
+        lists = os.getenv('TMDB_PREWARM_LISTS', ','.join(LISTS))
+        return cls(tmdb_service,
+                   rps=float(os.getenv('TMDB_REFRESH_RPS', '2')),
+                   interval=interval,
+                   top=int(os.getenv('TMDB_PREWARM_TOP', '50')),
+                   lists=tuple(filter(None, (name.strip() for name in lists.split(',')))))
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="tmdb-refresher", daemon=True)
+        self._thread.start()
+        logger.info(f"TMDb refresher started: {self.rps} requests/s, prewarm every {self.interval}s")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def record_access(self, endpoint: str, url: str, params: Dict[str, Any], key: str) -> None:
+        """Count a lookup of `key` and remember how to fetch it again"""
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+            self._requests[key] = (endpoint, url, params)
+            if len(self._counts) > self.max_tracked:
+                # Forget the least requested half
+                for stale_key in sorted(self._counts, key=self._counts.get)[:len(self._counts) // 2]:
+                    del self._counts[stale_key]
+                    del self._requests[stale_key]
+
+    def revalidate(self, endpoint: str, url: str, params: Dict[str, Any], key: str) -> None:
+        """Queue a stale entry to be fetched again; a key already queued is not queued twice"""
+        if self._enqueue(REVALIDATE, 'fetch', endpoint, url, params, key):
+            self.counters.incr('revalidations')
+
+    def prewarm(self) -> None:
+        """Queue the most requested keys that would expire before the next run, and the movie lists"""
+        with self._lock:
+            ranked = sorted(self._counts, key=self._counts.get, reverse=True)
+            hot = [(key, self._requests[key]) for key in ranked[:self.top]]
+            # Decay, so the ranking follows what is requested now
+            self._counts = {key: count / 2 for key, count in self._counts.items() if count >= 1}
+            self._requests = {key: self._requests[key] for key in self._counts}
+
+        for key, (endpoint, url, params) in hot:
+            if self._fresh_for(key) <= self.interval:
+                self._enqueue(PREWARM, 'fetch', endpoint, url, params, key)
+        for name in self.lists:
+            url, params = self.tmdb_service._list_request(name)
+            self._enqueue(PREWARM, 'list', name, url, params, self.tmdb_service._list_key(name))
+        self.counters.incr('prewarm_runs')
+
+    def run_pending(self) -> int:
+        """
+        Process everything queued, in the calling thread
+        Returns: number of requests made
+        """
+        done = 0
+        while not self._stop.is_set():
+            try:
+                _, _, item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            done += self._process(*item)
+        return done
+
+    def metrics(self) -> Dict[str, object]:
+        with self._lock:
+            tracked = len(self._counts)
+        return {
+            'rps': self.rps,
+            'queued': self._queue.qsize(),
+            'tracked_keys': tracked,
+            'counters': self.counters.snapshot(),
+        }
+
+    def _enqueue(self, priority: int, kind: str, endpoint: str, url: str, params: Dict[str, Any], key: str) -> bool:
+        with self._lock:
+            if key in self._queued:
+                return False
+            self._queued.add(key)
+        self._queue.put((priority, next(self._sequence), (kind, endpoint, url, params, key)))
+        return True
+
+    def _fresh_for(self, key: str) -> float:
+        """Seconds the local copy of `key` stays fresh, without counting as a cache lookup"""
+        entry = self.tmdb_service.cache.local.get_entry(key)
+        if entry is None:
+            return 0.0
+        return entry[1] - self.tmdb_service.cache.stale_ttl - time.time()
+
+    def _pace(self) -> bool:
+        """Wait for a token from the refresh bucket; False when stopping"""
+        while True:
+            granted, wait = self.limiter.try_take(REFRESH_BUCKET, self.rps)
+            if granted:
+                return True
+            self.counters.incr('throttled_ms', int(wait * 1000))
+            if self._stop.wait(wait):
+                return False
+
+    def _process(self, kind: str, endpoint: str, url: str, params: Dict[str, Any], key: str) -> int:
+        with self._lock:
+            self._queued.discard(key)
+        # A live request may have refreshed it while it was queued
+        if kind == 'fetch' and self._fresh_for(key) > self.interval:
+            self.counters.incr('skipped')
+            return 0
+        if not self._pace():
+            return 0
+
+        tmdb = self.tmdb_service
+        # A live request is already fetching it. Background fetches also stay out of
+        # tmdb.flights: a live caller joining one would wait at background priority.
+        if tmdb.flights.busy(key):
+            self.counters.incr('skipped')
+            return 0
+        try:
+            # Takes rate limit tokens only while live traffic has enough left
+            with request_priority(BACKGROUND):
+                payload = tmdb._fetch_and_store(endpoint, url, params, key)
+        except Exception as e:
+            logger.warning(f"TMDb refresh of {key} failed: {str(e)}")
+            self.counters.incr('errors')
+            return 1
+        self.counters.incr('refreshed')
+
+        if kind == 'list':
+            for movie in payload.get('results', []):
+                self._prewarm_movie(movie)
+        return 1
+
+    def _prewarm_movie(self, movie: Dict[str, Any]) -> None:
+        """
+        Queue details and similar movies for a listed movie. Search entries are
+        left to real searches: a title's list entry is not what TMDb would
+        answer for that query (remakes, other movies with the same title).
+        """
+        tmdb = self.tmdb_service
+        if 'id' not in movie:
+            return
+        for endpoint, (url, params), key in (
+            ('details', tmdb._details_request(movie['id']), tmdb._details_key(movie['id'])),
+            ('similar', tmdb._similar_request(movie['id']), tmdb._similar_key(movie['id'])),
+        ):
+            if self._fresh_for(key) <= self.interval:
+                self._enqueue(PREWARM, 'fetch', endpoint, url, params, key)
+
+    def _run(self) -> None:
+        next_prewarm = time.monotonic() if self.interval > 0 else float('inf')
+        while not self._stop.is_set():
+            if time.monotonic() >= next_prewarm:
+                try:
+                    self.prewarm()
+                except Exception as e:
+                    logger.error(f"TMDb prewarm failed: {str(e)}", exc_info=True)
+                next_prewarm = time.monotonic() + self.interval
+            try:
+                _, _, item = self._queue.get(timeout=min(1.0, max(0.05, next_prewarm - time.monotonic())))
+            except queue.Empty:
+                continue
+            try:
+                self._process(*item)
+            except Exception as e:
+                logger.error(f"TMDb refresh failed: {str(e)}", exc_info=True)
@@ -1,118 +1,325 @@
 import os
-from typing import List, Optional, Dict, Tuple
+from typing import Any, List, Optional, Dict, Tuple
 import requests
 from dotenv import load_dotenv
+from services.http_transport import HTTPTransport, TransportError
+from services.cache import MISSING, build_cache_from_env, cache_key
+from services.metrics import Counters
+from services.search_corrections import SearchCorrections
+from services.singleflight import SingleFlight
+from services.title_index import TitleIndex
+from services.tmdb_refresher import TMDbRefresher
 
 load_dotenv()
 
+# (connect, read) timeouts in seconds; override with TMDB_TIMEOUTS="search=2:5,..."
+DEFAULT_TIMEOUTS = {
+    'search': (3.05, 5.0),
+    'details': (3.05, 8.0),
+    'similar': (3.05, 5.0),
+    'list': (3.05, 5.0),
+}
+
+# Cache TTLs in seconds; override with TMDB_CACHE_TTLS="search=3600,..."
+DEFAULT_CACHE_TTLS = {
+    'search': 6 * 3600,
+    'details': 24 * 3600,
+    'similar': 24 * 3600,
+    'list': 3600,
+    # Searches that found nothing; short, so new releases are found soon after they appear
+    'negative': 600,
+}
+
+# TMDb movie lists that can be prewarmed, by name
+LIST_PATHS = {
+    'trending': 'trending/movie/day',
+    'popular': 'movie/popular',
+}
+
 class TMDbService:
     """Service to interact with TMDb API"""
-    
+
     def __init__(self):
         self.api_key = os.getenv('TMDB_API_KEY')
-        self.base_url = "https://api.themoviedb.org/3"
-        
+        # Overridable so the service can be pointed at a local stub server
+        self.base_url = os.getenv('TMDB_BASE_URL', "https://api.themoviedb.org/3")
+
         if not self.api_key:
             raise ValueError("TMDB_API_KEY not found in environment variables")
-    
-    def search_movie(self, title: str) -> Tuple[Optional[Dict], str]:
+
+        # One pooled keep-alive transport shared by every TMDb endpoint
+        self.transport = HTTPTransport.from_env('tmdb', 'TMDB', DEFAULT_TIMEOUTS)
+
+        # In-process LRU plus optional shared tier (TMDB_SHARED_CACHE=mongo|disk)
+        self.language = os.getenv('TMDB_LANGUAGE', 'en-US')
+        self.cache = build_cache_from_env('TMDB', DEFAULT_CACHE_TTLS)
+
+        # Local title index built by build_title_index.py (TMDB_TITLE_INDEX)
+        self.title_index = TitleIndex.from_env()
+        self.counters = Counters()
+        # Concurrent misses for the same cache key share one TMDb request; a caller
+        # whose budget runs out while waiting gets a TransportError like any failed fetch
+        self.flights = SingleFlight('tmdb', timeout_error=TransportError)
+        # Serves stale entries while refreshing them and prewarms hot titles
+        # (TMDB_CACHE_STALE_TTL, TMDB_PREWARM_INTERVAL); started by the container
+        self.refresher = TMDbRefresher.from_env(self)
+        # Failed queries mapped to the movie the same user found next
+        self.corrections = SearchCorrections.from_env(self.language)
+
+    def warm_up(self) -> bool:
+        """Open the pooled TMDb connection so the first lookup does not pay for connection setup"""
+        return self.transport.warm_up(self.base_url)
+
+    def search_movie(self, title: str, user_id: Optional[str] = None) -> Tuple[Optional[Dict], str]:
         """
-        Search for a movie by title
+        Search for a movie by title; with a user id, failed searches followed by
+        a successful one teach the correction map
         Returns: (movie_data, message)
         """
+        # A query that failed before and was corrected goes straight to its movie
+        corrected_id = self.corrections.lookup(title)
+        if corrected_id is not None:
+            movie, _ = self.get_movie_details(corrected_id)
+            if movie:
+                self.record_search_result(user_id, title, movie)
+                return movie, "Movie found successfully"
+
+        # An exact title match in the local index skips the search API
+        match = self._lookup_title_index(title)
+        if match:
+            movie, _ = self.get_movie_details(match['id'])
+            if movie:
+                self.record_search_result(user_id, title, movie)
+                return movie, "Movie found successfully"
+
         try:
-            endpoint = f"{self.base_url}/search/movie"
-            params = {
-                'api_key': self.api_key,
-                'query': title,
-                'language': 'en-US',
-                'page': 1
-            }
-            
-            response = requests.get(endpoint, params=params)
-            response.raise_for_status()
-            
-            results = response.json().get('results', [])
-            if not results:
-                return None, f"No movies found matching '{title}'"
-                
-            # Return the most popular result
-            movie = results[0]
-            return movie, "Movie found successfully"
-            
+            payload = self._fetch('search', *self._search_request(title), self._search_key(title))
+
+            movie, message = self._parse_search(payload, title)
+
         except requests.exceptions.RequestException as e:
             return None, f"Error searching for movie: {str(e)}"
-    
+
+        # A fuzzy match is only a guess, so it is used when TMDb found nothing
+        if not movie:
+            match = self._lookup_title_index(title, fuzzy=True)
+            if match:
+                movie, _ = self.get_movie_details(match['id'])
+                if movie:
+                    message = "Movie found successfully"
+        self.record_search_result(user_id, title, movie)
+        return movie, message
+
+    def record_search_result(self, user_id: Optional[str], title: str, movie: Optional[Dict]) -> None:
+        """Tell the correction map whether a user's title resolved to a movie"""
+        if user_id is None:
+            return
+        if movie:
+            self.corrections.resolved(user_id, title, movie['id'])
+        else:
+            self.corrections.failed(user_id, title)
+
     def get_movie_details(self, movie_id: int) -> Tuple[Optional[Dict], str]:
         """
         Get detailed information about a movie
         Returns: (movie_details, message)
         """
         try:
-            endpoint = f"{self.base_url}/movie/{movie_id}"
-            params = {
-                'api_key': self.api_key,
-                'language': 'en-US',
-                'append_to_response': 'credits,reviews'
-            }
-            
-            response = requests.get(endpoint, params=params)
-            response.raise_for_status()
-            
-            movie = response.json()
-            return movie, "Movie details retrieved successfully"
-            
+            payload = self._fetch('details', *self._details_request(movie_id), self._details_key(movie_id))
+
+            return payload, "Movie details retrieved successfully"
+
         except requests.exceptions.RequestException as e:
             return None, f"Error getting movie details: {str(e)}"
-    
+
     def get_similar_movies(self, movie_id: int, min_score: float = 0.0) -> Tuple[List[Dict], str]:
         """
         Get similar movies with optional minimum score filter
         Returns: (similar_movies, message)
         """
         try:
-            endpoint = f"{self.base_url}/movie/{movie_id}/similar"
-            params = {
-                'api_key': self.api_key,
-                'language': 'en-US',
-                'page': 1
-            }
-            
-            response = requests.get(endpoint, params=params)
-            response.raise_for_status()
-            
-            movies = response.json().get('results', [])
-            
-            # Filter by minimum score and sort by popularity
-            filtered_movies = [
-                movie for movie in movies 
-                if movie.get('vote_average', 0) >= min_score
-            ]
-            
-            # Sort by popularity (descending)
-            sorted_movies = sorted(
-                filtered_movies,
-                key=lambda x: x.get('popularity', 0),
-                reverse=True
-            )
-            
-            if not sorted_movies:
-                return [], f"No similar movies found with minimum score of {min_score}"
-                
-            return sorted_movies, "Similar movies found successfully"
-            
+            payload = self._fetch('similar', *self._similar_request(movie_id), self._similar_key(movie_id))
+
+            return self._parse_similar(payload, min_score)
+
         except requests.exceptions.RequestException as e:
             return [], f"Error getting similar movies: {str(e)}"
 
+    def invalidate_movie(self, movie_id: int) -> int:
+        """
+        Drop every cached entry that mentions a movie (its details, its similar
+        list, and searches or similar lists that returned it) from both tiers,
+        and the search corrections and candidates that lead to it
+        Returns: number of entries removed
+        """
+        return self.cache.invalidate_tag(movie_id) + self.corrections.invalidate_movie(movie_id)
+
+    def metrics(self) -> Dict[str, object]:
+        """Per-endpoint latency, error and circuit breaker state plus cache statistics"""
+        metrics = {
+            'transport': self.transport.metrics(),
+            'cache': self.cache.metrics(),
+            'counters': self.counters.snapshot(),
+            'singleflight': self.flights.metrics(),
+        }
+        if self.refresher is not None:
+            metrics['refresher'] = self.refresher.metrics()
+        metrics['corrections'] = self.corrections.metrics()
+        if self.title_index is not None:
+            metrics['title_index'] = self.title_index.stats()
+        return metrics
+
     def format_movie_info(self, movie: Dict) -> str:
         """Format movie information for display"""
         title = movie.get('title', 'Unknown Title')
         score = movie.get('vote_average', 0.0)
         year = movie.get('release_date', '')[:4]
         overview = movie.get('overview', 'No overview available')
-        
+
         return (
             f"Title: {title} ({year})\n"
             f"Score: {score}/10\n"
             f"Overview: {overview}\n"
-        ) 
\ No newline at end of file
+        )
+
+    def _lookup_title_index(self, title: str, fuzzy: bool = False) -> Optional[Dict]:
+        """Resolve a title to {'id', 'title', 'popularity', 'score'} without the network, exactly or fuzzily"""
+        if self.title_index is None:
+            return None
+        try:
+            if fuzzy:
+                matches = self.title_index.fuzzy(title, limit=1)
+                match = matches[0] if matches else None
+            else:
+                match = self.title_index.exact(title)
+        except Exception as e:
+            print(f"Error reading title index: {str(e)}")
+            return None
+        prefix = 'title_index.fuzzy_' if fuzzy else 'title_index.'
+        self.counters.incr(f"{prefix}hits" if match else f"{prefix}misses")
+        return match
+
+    def _fetch(self, endpoint: str, url: str, params: Dict[str, Any], key: str) -> Dict:
+        """Serve a TMDb payload from the cache, fetching and storing it on a miss"""
+        payload = self._serve_cached(endpoint, url, params, key, *self.cache.lookup(key))
+        if payload is not MISSING:
+            return payload
+        return self.flights.do(key, lambda: self._fetch_uncached(endpoint, url, params, key))
+
+    def _serve_cached(self, endpoint: str, url: str, params: Dict[str, Any], key: str,
+                      payload: Any, fresh_for: float) -> Any:
+        """The cached payload to answer with, or MISSING when it has to be fetched now"""
+        if self.refresher is not None:
+            self.refresher.record_access(endpoint, url, params, key)
+        if endpoint == 'search' and payload is not MISSING and not payload.get('results'):
+            self.counters.incr('search.negative_hits')
+        if payload is MISSING or fresh_for > 0:
+            return payload
+        if self.refresher is not None:
+            # Answer from the stale copy; the refresher fetches a new one in the background
+            self.refresher.revalidate(endpoint, url, params, key)
+            return payload
+        return MISSING
+
+    def _fetch_uncached(self, endpoint: str, url: str, params: Dict[str, Any], key: str) -> Dict:
+        # A call that finished just before this one started may already have filled the cache
+        payload = self.cache.get_local(key)
+        if payload is not MISSING:
+            return payload
+        return self._fetch_and_store(endpoint, url, params, key)
+
+    def _fetch_and_store(self, endpoint: str, url: str, params: Dict[str, Any], key: str) -> Dict:
+        payload = self.transport.get(endpoint, url, params)
+        self._store(endpoint, key, payload)
+        return payload
+
+    def _store(self, endpoint: str, key: str, payload: Dict) -> None:
+        ttl = None
+        if endpoint == 'search':
+            # Only the top result is ever used, so keep cached searches small
+            payload['results'] = payload.get('results', [])[:1]
+            if not payload['results']:
+                ttl = self.cache.ttl_for('negative')
+        self.cache.set(key, payload, tags=self._tags(payload, key), ttl=ttl)
+
+    def _tags(self, payload: Dict, key: str) -> List[int]:
+        """Movie ids mentioned by a payload, used to invalidate it by movie id"""
+        tags = [movie['id'] for movie in payload.get('results', []) if 'id' in movie]
+        if 'id' in payload:
+            tags.append(payload['id'])
+        if key.startswith('similar:'):
+            tags.append(int(key.rsplit(':', 1)[1]))
+        return tags
+
+    # Request building and response parsing shared with AsyncTMDbService
+
+    def _search_key(self, title: str) -> str:
+        return cache_key('search', title, language=self.language)
+
+    def _details_key(self, movie_id: int) -> str:
+        return cache_key('details', movie_id, language=self.language)
+
+    def _similar_key(self, movie_id: int) -> str:
+        return cache_key('similar', movie_id, language=self.language)
+
+    def _list_key(self, name: str) -> str:
+        return cache_key('list', name, language=self.language)
+
+    def _list_request(self, name: str) -> Tuple[str, Dict[str, Any]]:
+        return f"{self.base_url}/{LIST_PATHS[name]}", {
+            'api_key': self.api_key,
+            'language': self.language,
+            'page': 1
+        }
+
+    def _search_request(self, title: str) -> Tuple[str, Dict[str, Any]]:
+        return f"{self.base_url}/search/movie", {
+            'api_key': self.api_key,
+            'query': title,
+            'language': self.language,
+            'page': 1
+        }
+
+    def _details_request(self, movie_id: int) -> Tuple[str, Dict[str, Any]]:
+        return f"{self.base_url}/movie/{movie_id}", {
+            'api_key': self.api_key,
+            'language': self.language,
+            'append_to_response': 'credits,reviews'
+        }
+
+    def _similar_request(self, movie_id: int) -> Tuple[str, Dict[str, Any]]:
+        return f"{self.base_url}/movie/{movie_id}/similar", {
+            'api_key': self.api_key,
+            'language': self.language,
+            'page': 1
+        }
+
+    def _parse_search(self, payload: Dict, title: str) -> Tuple[Optional[Dict], str]:
+        results = payload.get('results', [])
+        if not results:
+            return None, f"No movies found matching '{title}'"
+
+        # Return the most popular result
+        movie = results[0]
+        return movie, "Movie found successfully"
+
+    def _parse_similar(self, payload: Dict, min_score: float) -> Tuple[List[Dict], str]:
+        movies = payload.get('results', [])
+
+        # Filter by minimum score and sort by popularity
+        filtered_movies = [
+            movie for movie in movies
+            if movie.get('vote_average', 0) >= min_score
+        ]
+
+        # Sort by popularity (descending)
+        sorted_movies = sorted(
+            filtered_movies,
+            key=lambda x: x.get('popularity', 0),
+            reverse=True
+        )
+
+        if not sorted_movies:
+            return [], f"No similar movies found with minimum score of {min_score}"
+
+        return sorted_movies, "Similar movies found successfully"
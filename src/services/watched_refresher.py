@@ -0,0 +1,96 @@
+import logging
+import os
+import threading
+from datetime import timedelta
+from typing import Dict, Optional
+
+from services.metrics import Counters
+from services.rate_limiter import BACKGROUND, request_priority
+
+logger = logging.getLogger(__name__)
+
+
+class WatchedRefresher:
+    """
+    Background thread that keeps the title, score and year stored with each
+    watched entry current.
+
+    Scores change slowly, so every `interval` seconds it finds up to
+    `batch_size` distinct movies with an entry refreshed longer than `max_age`
+    ago (from the refreshed_at index), fetches each once from TMDb (through the
+    service cache, at background priority) and rewrites every user's entry for
+    those movies with one bulk write of one update per movie. Movies whose
+    lookup fails are left alone for `retry_delay` seconds, so a movie gone from
+    TMDb does not come back in every batch.
+    """
+
+    def __init__(self, db_service, tmdb_service,
+                 interval: Optional[float] = None,
+                 max_age: Optional[float] = None,
+                 batch_size: Optional[int] = None,
+                 retry_delay: Optional[float] = None):
+        self.db_service = db_service
+        self.tmdb_service = tmdb_service
+
+        self.interval = interval if interval is not None else float(os.getenv('WATCHED_REFRESH_INTERVAL', '3600'))
+        if max_age is None:
+            max_age = float(os.getenv('WATCHED_REFRESH_MAX_AGE', '604800'))
+        self.max_age = timedelta(seconds=max_age)
+        self.batch_size = batch_size if batch_size is not None else int(os.getenv('WATCHED_REFRESH_BATCH', '200'))
+        if retry_delay is None:
+            retry_delay = float(os.getenv('WATCHED_REFRESH_RETRY_DELAY', '86400'))
+        self.retry_delay = timedelta(seconds=retry_delay)
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.counters = Counters()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="watched-refresher", daemon=True)
+        self._thread.start()
+        logger.info(f"Watched refresher started: every {self.interval}s, max age {self.max_age}")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def refresh_once(self) -> int:
+        """
+        Refresh one batch of stale entries
+        Returns: number of watched entries updated
+        """
+        stale_ids = self.db_service.find_stale_movie_ids(self.max_age, limit=self.batch_size)
+        movies, failed = [], []
+        for movie_id in stale_ids:
+            if self._stop.is_set():
+                break
+            movie, _ = self.tmdb_service.get_movie_details(movie_id)
+            if movie:
+                movies.append(movie)
+            else:
+                failed.append(movie_id)
+        self.counters.incr('lookup_failures', len(failed))
+        self.db_service.postpone_refresh(failed, self.retry_delay)
+
+        updated = self.db_service.refresh_movie_metadata(movies)
+        self.counters.incr('movies_refreshed', len(movies))
+        self.counters.incr('entries_updated', updated)
+        return updated
+
+    def metrics(self) -> Dict[str, int]:
+        return self.counters.snapshot()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                # Its TMDb lookups yield rate limit tokens to live requests
+                with request_priority(BACKGROUND):
+                    self.refresh_once()
+            except Exception as e:
+                logger.error(f"Watched refresh failed: {str(e)}", exc_info=True)
@@ -3,11 +3,12 @@ from typing import Optional, Tuple
 import os
 from dotenv import load_dotenv
 from services.nlp_service import NLPService
+from services.rate_limiter import get_rate_limiter
 
 load_dotenv()
 
 class WhatsAppService:
-    def __init__(self):
+    def __init__(self, nlp_service: Optional[NLPService] = None):
         self.account_sid = os.getenv('TWILIO_ACCOUNT_SID')
         self.auth_token = os.getenv('TWILIO_AUTH_TOKEN')
         self.from_number = os.getenv('TWILIO_WHATSAPP_NUMBER')
@@ -16,11 +17,15 @@ class WhatsAppService:
             raise ValueError("Twilio credentials not found in environment variables")
             
         self.client = Client(self.account_sid, self.auth_token)
-        self.nlp_service = NLPService()
+        # Outbound messages share the 'twilio' rate limit with every other worker
+        self.limiter = get_rate_limiter()
+        # Share an already loaded spaCy model when one is provided
+        self.nlp_service = nlp_service or NLPService()
 
     def send_message(self, to_number: str, message: str) -> bool:
         """Send WhatsApp message using Twilio"""
         try:
+            self.limiter.acquire('twilio', 'messages')
             self.client.messages.create(
                 body=message,
                 from_=f"whatsapp:{self.from_number}",
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Tests for the OpenAI conversation history: the bounded in-process store,
+the MongoDB store (on mongomock) and the token-budgeted ContextBuilder that
+folds old turns into a rolling summary. Needs no network.
+"""
+
+import time
+
+import mongomock
+
+from services.context_builder import SUMMARY_HEADER, ContextBuilder
+from services.history_store import MemoryHistoryStore, MongoHistoryStore, estimate_tokens
+
+
+def test_memory_store_caps_each_user():
+    store = MemoryHistoryStore(max_messages=3, max_tokens=50)
+    for i in range(5):
+        store.append('u1', 'user', f"message {i}")
+    assert [m['content'] for m in store.recent('u1')] == ["message 2", "message 3", "message 4"]
+    assert [m['content'] for m in store.recent('u1', limit=1)] == ["message 4"]
+
+    # The token cap drops old messages too, but always keeps the newest one
+    store.append('u1', 'assistant', "x" * 190)
+    assert [m['role'] for m in store.recent('u1')] == ['assistant']
+    store.append('u1', 'user', "y" * 400)
+    assert len(store.recent('u1')) == 1
+
+    metrics = store.metrics()
+    assert metrics['users'] == 1 and metrics['messages'] == 1
+    assert metrics['tokens'] == estimate_tokens("y" * 400)
+    store.clear('u1')
+    assert store.recent('u1') == [] and store.metrics()['tokens'] == 0
+
+
+def test_memory_store_evicts_users():
+    store = MemoryHistoryStore(max_users=2, idle_ttl=0.2)
+    for user in ('a', 'b'):
+        store.append(user, 'user', "hi")
+    store.recent('a')
+    # 'b' is the least recently used, so a third user pushes it out
+    store.append('c', 'user', "hi")
+    assert store.recent('b') == [] and store.recent('a') and store.recent('c')
+    assert store.metrics()['lru_evictions'] == 1
+
+    time.sleep(0.25)
+    assert store.recent('a') == []
+    store.append('d', 'user', "hi")
+    assert store.metrics()['users'] == 1
+
+
+def test_mongo_store_applies_limits_on_read():
+    store = MongoHistoryStore(mongomock.MongoClient().movie_score, max_messages=3, max_tokens=10)
+    for i in range(5):
+        store.append('u1', 'user', f"m{i}")
+    store.append('u2', 'user', "other user")
+    assert [m['content'] for m in store.recent('u1')] == ["m2", "m3", "m4"]
+
+    # Clearing writes a marker that reads stop at
+    store.clear('u1')
+    assert store.recent('u1') == []
+    store.append('u1', 'user', "a" * 30)
+    store.append('u1', 'assistant', "b" * 30)
+    # Two 8-token messages exceed the 10-token cap, so only the newest is read
+    assert [m['role'] for m in store.recent('u1')] == ['assistant']
+    assert [m['content'] for m in store.recent('u2')] == ["other user"]
+
+
+def test_context_builder_folds_old_turns_into_summary():
+    store = MemoryHistoryStore(max_messages=6, max_tokens=10000)
+    builder = ContextBuilder(store, budgets={'chat': 40, 'intent': 1000}, summary_tokens=40)
+    for i in range(6):
+        builder.record('chat', 'u1', 'user', f"Tell me about movie number {i}. It is great.")
+        builder.record('chat', 'u1', 'assistant', f"Movie {i} scores {i}.5/10.")
+
+    context = builder.context('chat', 'u1')
+    summary = context[0]
+    assert summary['role'] == 'system' and summary['content'].startswith(SUMMARY_HEADER)
+    # The summary keeps the first sentence of folded turns, newest lines last, within its budget
+    assert "- user: Tell me about movie number" in summary['content']
+    assert "It is great" not in summary['content']
+    assert estimate_tokens(summary['content']) <= 40
+    # Recent turns stay verbatim and within the channel budget
+    recent = context[1:]
+    assert recent[-1]['content'] == "Movie 5 scores 5.5/10."
+    assert sum(estimate_tokens(m['content']) for m in recent) <= 40
+    assert len(context) <= store.max_messages
+
+
+def test_mongo_context_builder_folds_with_one_conditional_write():
+    store = MongoHistoryStore(mongomock.MongoClient().movie_score, max_messages=6, max_tokens=10000)
+    builder = ContextBuilder(store, budgets={'chat': 40, 'intent': 1000}, summary_tokens=40)
+    for i in range(6):
+        builder.record('chat', 'u1', 'user', f"Tell me about movie number {i}. It is great.")
+        builder.record('chat', 'u1', 'assistant', f"Movie {i} scores {i}.5/10.")
+    context = builder.context('chat', 'u1')
+    assert context[0]['content'].startswith(SUMMARY_HEADER)
+    assert "- user: Tell me about movie number" in context[0]['content']
+    assert context[-1]['content'] == "Movie 5 scores 5.5/10."
+    assert len(context) <= store.max_messages
+
+    # Two workers read the same history and fold the same turns: the slower
+    # write finds the summary moved on and changes nothing
+    for key in ('chat:u1', 'chat:u2'):
+        store.append(key, 'user', "first")
+        store.append(key, 'user', "second")
+        oldest = [m for m in store.recent(key) if m['role'] != 'system'][:1]
+        stale = store._window(key)
+        assert store.fold(key, f"{SUMMARY_HEADER}\n- worker 1", oldest)
+        store._window = lambda user_id: stale
+        try:
+            assert not store.fold(key, f"{SUMMARY_HEADER}\n- worker 2", oldest)
+        finally:
+            del store._window
+        assert store.recent(key)[0]['content'] == f"{SUMMARY_HEADER}\n- worker 1"
+        assert store.recent(key)[-1]['content'] == "second"
+    assert store.metrics()['fold_conflicts'] == 2
+
+    builder.clear('u1')
+    assert builder.context('chat', 'u1') == []
+
+
+def test_context_builder_keeps_channels_apart():
+    builder = ContextBuilder(MemoryHistoryStore(max_messages=5))
+    builder.record('intent', 'u1', 'user', "tell me about alien")
+    builder.record('chat', 'u1', 'assistant', "Alien scores 8.2/10.")
+    assert [m['content'] for m in builder.context('intent', 'u1')] == ["tell me about alien"]
+    assert [m['content'] for m in builder.context('chat', 'u1')] == ["Alien scores 8.2/10."]
+    builder.clear('u1')
+    assert builder.context('intent', 'u1') == [] and builder.context('chat', 'u1') == []
+
+
+def test_max_users_counts_users_not_channels():
+    store = MemoryHistoryStore(max_users=2)
+    builder = ContextBuilder(store)
+    for user in ('a', 'b'):
+        builder.record('intent', user, 'user', "tell me about alien")
+        builder.record('chat', user, 'assistant', "Alien scores 8.2/10.")
+    # Two users with two channels each fit in max_users=2
+    assert store.metrics()['users'] == 2 and 'lru_evictions' not in store.metrics()
+    assert builder.context('chat', 'a') and builder.context('intent', 'b')
+
+    # A third user evicts the least recently used one with all of its channels
+    builder.record('intent', 'c', 'user', "help")
+    assert builder.context('intent', 'a') == [] and builder.context('chat', 'a') == []
+    assert store.metrics()['lru_evictions'] == 1 and store.metrics()['messages'] == 3
+
+
+if __name__ == "__main__":
+    test_memory_store_caps_each_user()
+    test_memory_store_evicts_users()
+    test_mongo_store_applies_limits_on_read()
+    test_context_builder_folds_old_turns_into_summary()
+    test_mongo_context_builder_folds_with_one_conditional_write()
+    test_context_builder_keeps_channels_apart()
+    test_max_users_counts_users_not_channels()
+    print("All conversation history tests passed!")
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+Tests for ExecutionPlan: steps see the caller's request budget and priority on
+the thread pool, and non-critical steps are dropped at the deadline.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from services.execution_plan import ExecutionPlan, remaining_budget, request_budget
+from services.rate_limiter import BACKGROUND, current_priority, request_priority
+
+
+def test_steps_inherit_request_context():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        with request_budget(5.0), request_priority(BACKGROUND):
+            plan = ExecutionPlan()
+            plan.step('budget', lambda: remaining_budget())
+            plan.step('priority', lambda: current_priority())
+            plan.step('both', lambda budget, priority: (remaining_budget(), priority), deps=['budget', 'priority'])
+            results = plan.run(executor)
+        assert 4.0 < results['budget'] <= 5.0, results
+        assert results['priority'] == BACKGROUND
+        assert results['both'][0] is not None and results['both'][1] == BACKGROUND
+
+        # Without a request budget, steps get the plan's own deadline
+        plan = ExecutionPlan(deadline=time.monotonic() + 2.0)
+        plan.step('budget', lambda: remaining_budget())
+        assert 1.0 < plan.run(executor)['budget'] <= 2.0
+
+
+def test_non_critical_steps_dropped_at_deadline():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        plan = ExecutionPlan(deadline=time.monotonic() + 0.2)
+        plan.step('movie', lambda: 'movie')
+        plan.step('similar', lambda movie: time.sleep(1.0), deps=['movie'], critical=False)
+        plan.step('after', lambda similar: 'never', deps=['similar'], critical=False)
+        started = time.monotonic()
+        results = plan.run(executor)
+        assert time.monotonic() - started < 0.6
+    assert results == {'movie': 'movie'}
+    assert plan.timed_out == ['similar'] and plan.skipped == ['after'] and plan.degraded
+
+
+if __name__ == "__main__":
+    test_steps_inherit_request_context()
+    test_non_critical_steps_dropped_at_deadline()
+    print("All execution plan tests passed!")
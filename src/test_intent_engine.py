@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Regression test for the compiled intent rules against the labelled corpus.
+Needs no spaCy model. Every row must match its exact (intent, title), except
+rows marked "ner": true, which are left to NLPService's NER fallback, and
+unknown rows, which no rule may match.
+"""
+
+import json
+import os
+import tempfile
+
+from services.cache import normalize_query
+from services.intent_classifier import DEFAULT_HELDOUT_PATH, IntentClassifier, load_corpus
+from services.intent_engine import IntentEngine, IntentRule
+
+CORPUS = os.path.join(os.path.dirname(__file__), 'data', 'intent_corpus.jsonl')
+
+
+def test_corpus():
+    engine = IntentEngine()
+    with open(CORPUS, encoding='utf-8') as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    failures = []
+    for row in corpus:
+        if row.get('ner'):
+            continue
+        matched = engine.match(row['text'].lower().strip())
+        expected = None if row['intent'] == 'unknown' else (row['intent'], row['title'])
+        if matched != expected:
+            failures.append((row['text'], matched, expected))
+
+    for text, got, expected in failures:
+        print(f"'{text}': got {got}, expected {expected}")
+    assert not failures
+    print(f"{len(corpus)} corpus messages matched")
+
+
+def test_priority_beats_rule_order():
+    engine = IntentEngine([
+        IntentRule('get_info', r"(.+)", 1),
+        IntentRule('help', r"\bhelp\b", 10),
+    ])
+    assert engine.match("help") == ('help', None)
+    assert engine.match("inception") == ('get_info', 'inception')
+
+
+def test_classifier_round_trip():
+    texts = ["help", "what can you do", "i watched inception", "i have seen up",
+             "tell me about alien", "is jaws good", "show my watched movies", "list my watched list"]
+    labels = ['help', 'help', 'mark_watched', 'mark_watched', 'get_info', 'get_info', 'list_watched', 'list_watched']
+    model = IntentClassifier.train(texts, labels, n_features=1024)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'model.npz')
+        model.save(path)
+        loaded = IntentClassifier.load(path)
+    assert loaded.labels == model.labels
+    for text, label in zip(texts, labels):
+        assert loaded.predict(text)[0] == label
+        assert abs(loaded.predict(text)[1] - model.predict(text)[1]) < 1e-6
+
+
+def test_model_gated_on_heldout_accuracy():
+    model = IntentClassifier.train(["help", "i watched up"], ['help', 'mark_watched'], n_features=64)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'model.npz')
+        saved = {name: os.environ.get(name) for name in ('INTENT_MODEL', 'INTENT_MODEL_MIN_ACCURACY')}
+        os.environ.update({'INTENT_MODEL': path, 'INTENT_MODEL_MIN_ACCURACY': '0.9'})
+        try:
+            # No held-out report, or a poor one: not used
+            model.save(path)
+            assert IntentClassifier.from_env() is None
+            model.heldout = {'accuracy': 0.8, 'confident_accuracy': 0.85}
+            model.save(path)
+            assert IntentClassifier.from_env() is None
+            model.heldout = {'accuracy': 0.8, 'confident_accuracy': 0.95}
+            model.save(path)
+            assert IntentClassifier.from_env().heldout['confident_accuracy'] == 0.95
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    del os.environ[name]
+                else:
+                    os.environ[name] = value
+
+
+def test_heldout_is_separate_from_corpus():
+    trained_on = {normalize_query(row['text']) for row in load_corpus(CORPUS)}
+    heldout = load_corpus(DEFAULT_HELDOUT_PATH)
+    assert not [row['text'] for row in heldout if normalize_query(row['text']) in trained_on]
+    # The shipped model was scored on the whole held-out file
+    model = IntentClassifier.load(os.path.join(os.path.dirname(CORPUS), 'intent_model.npz'))
+    assert model.heldout['messages'] == len(heldout)
+
+
+if __name__ == "__main__":
+    test_corpus()
+    test_priority_beats_rule_order()
+    test_classifier_round_trip()
+    test_model_gated_on_heldout_accuracy()
+    test_heldout_is_separate_from_corpus()
+    print("All intent engine tests passed!")
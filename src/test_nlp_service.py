@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Tests for NLPService on a blank spaCy pipeline (no trained model needed):
+batched classification with nlp.pipe, rules before the intent classifier,
+known-title spotting and the hybrid router's local/OpenAI decisions.
+"""
+
+import os
+import tempfile
+
+import spacy
+
+from services.hybrid_router import HybridRouter
+from services.intent_classifier import IntentClassifier
+from services.nlp_service import NLPAnalysis, NLPService, load_model
+from services.title_gazetteer import TitleGazetteer
+
+_blank_path = None
+
+
+def make_nlp_service(**env) -> NLPService:
+    """NLPService on a blank English pipeline, with no classifier or gazetteer unless configured"""
+    global _blank_path
+    if _blank_path is None:
+        _blank_path = os.path.join(tempfile.mkdtemp(), 'blank_en')
+        spacy.blank('en').to_disk(_blank_path)
+    env = {'SPACY_MODEL': _blank_path, 'INTENT_MODEL': '', 'TMDB_TITLE_INDEX': '', 'TITLE_ALIASES': '', **env}
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        return NLPService()
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+
+class CountingPipeline:
+    """Wraps a spaCy pipeline and counts the texts sent through nlp.pipe"""
+
+    def __init__(self, nlp):
+        self.nlp = nlp
+        self.piped = []
+
+    def pipe(self, texts, **kwargs):
+        texts = list(texts)
+        self.piped.extend(texts)
+        return self.nlp.pipe(texts, **kwargs)
+
+    def __call__(self, text):
+        return self.nlp(text)
+
+    def __getattr__(self, name):
+        return getattr(self.nlp, name)
+
+
+def test_batch_parses_only_unmatched_messages():
+    service = make_nlp_service()
+    service.nlp = CountingPipeline(load_model(_blank_path))
+    messages = ["Tell me about Inception", "help", "I watched Alien",
+                "what have i watched", "hmm, a great one", "what a terrible waste"] * 3
+
+    results = list(service.process_batch(messages, batch_size=4, chunk_size=5))
+    assert len(results) == len(messages)
+    assert [r.intent for r in results[:6]] == ['get_info', 'help', 'mark_watched', 'list_watched',
+                                               'unknown', 'unknown']
+    assert results[0].title == 'inception' and results[2].title == 'alien'
+    assert results[4].sentiment > 0 and results[5].sentiment < 0
+    # Same answers as one-at-a-time analysis, in input order
+    assert [(r.intent, r.title) for r in results] == [service.process_message(m) for m in messages]
+    # Only the messages no rule recognised were parsed, each once
+    assert sorted(service.nlp.piped) == sorted(["hmm, a great one", "what a terrible waste"] * 3)
+
+
+def test_rules_win_over_classifier():
+    service = make_nlp_service()
+    # A model that is sure every message asks for help
+    service.classifier = IntentClassifier.train(["help me", "what can you do"], ['help', 'help'], n_features=64)
+    assert service.analyze("tell me about alien") == NLPAnalysis('get_info', 'alien', 0.9, 'rules')
+    assert service.analyze("i watched alien").intent == 'mark_watched'
+    # It only decides messages no rule matches
+    analysis = service.analyze("hmm, not sure")
+    assert (analysis.intent, analysis.source) == ('help', 'model')
+
+
+def test_everyday_phrases_are_not_movie_questions():
+    service = make_nlp_service()
+    service.gazetteer = TitleGazetteer.from_records([
+        {'id': 1, 'title': 'Thank You', 'popularity': 5},
+        {'id': 27205, 'title': 'Inception', 'popularity': 90},
+    ])
+    assert service.analyze("thank you").source != 'gazetteer'
+    assert service.analyze("Thank you!").source != 'gazetteer'
+    assert service.analyze('"Thank You"')[:2] == ('get_info', 'Thank You')
+    assert service.analyze("Inception")[:2] == ('get_info', 'Inception')
+    # The raw message reaches the gazetteer in batches too
+    results = list(service.process_batch(["thank you", '"thank you"']))
+    assert results[1].title == 'Thank You' and results[0].title != 'Thank You'
+
+
+class FakeNLP:
+    def __init__(self, analyses):
+        self.analyses = analyses
+
+    def analyze(self, message):
+        return self.analyses[message]
+
+
+def test_router_decisions():
+    router = HybridRouter(FakeNLP({
+        "tell me about alien": NLPAnalysis('get_info', 'alien', 0.9, 'rules'),
+        "help": NLPAnalysis('help', None, 0.95, 'model'),
+        "tell me about": NLPAnalysis('get_info', None, 0.9, 'rules'),
+        "alien maybe": NLPAnalysis('get_info', 'alien maybe', 0.5, 'ner'),
+        "is alien better than aliens": NLPAnalysis('get_info', 'alien', 0.9, 'rules'),
+        "???": NLPAnalysis('unknown', None, 0.5, 'ner'),
+    }), min_confidence=0.8, max_words=12)
+
+    routes = {message: router.route(message)[:2] for message in router.nlp_service.analyses}
+    assert routes == {
+        "tell me about alien": ('local', 'confident'),
+        "help": ('local', 'confident'),
+        "tell me about": ('openai', 'no_title'),
+        "alien maybe": ('openai', 'low_confidence'),
+        "is alien better than aliens": ('openai', 'complex'),
+        "???": ('openai', 'unknown'),
+    }
+    assert router.metrics()['llm_calls_avoided'] == 0
+    router.record(router.route("help"), 0.01)
+    # Two-call mode, then a response cache hit, then tools mode answering in one completion
+    router.record(router.route("???"), 1.5, llm_calls=2)
+    router.record(router.route("???"), 0.8, llm_calls=1)
+    router.record(router.route("???"), 0.9, llm_calls=1)
+    metrics = router.metrics()
+    print(f"Router metrics: {metrics}")
+    assert metrics['routes']['local'] == 3
+    assert metrics['llm_calls_per_openai_message']['avg'] == round(4 / 3, 1)
+    assert metrics['llm_calls_avoided'] == 4
+    assert metrics['latency_saved_seconds'] > 0
+
+
+if __name__ == "__main__":
+    test_batch_parses_only_unmatched_messages()
+    test_rules_win_over_classifier()
+    test_everyday_phrases_are_not_movie_questions()
+    test_router_decisions()
+    print("All NLP service tests passed!")
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+"""
+Tests for ResilientCompletions against a local stub of the chat completions
+endpoint whose reply delay is set per test: calls give up at the request
+deadline, MessageHandler answers from the templates when they do, the
+in-flight cap holds under load, a hedged duplicate wins over a stalled
+request while each request holds its own slots, and generated replies are cached per exact prompt. Needs no API key
+or network access.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from openai import AsyncOpenAI, OpenAI
+
+from services.execution_plan import request_budget
+from services.openai_client import OpenAIDeadlineExceeded, ResilientCompletions
+from services.rate_limiter import BACKGROUND, current_priority, request_priority
+
+MODEL = 'gpt-4o-mini'
+MESSAGES = [{'role': 'user', 'content': 'hello'}]
+
+
+class Stub:
+    """Chat completions stub; `delay(n)` gives the seconds to wait before answering request n"""
+
+    def __init__(self):
+        self.delay = lambda n: 0.0
+        self.requests = 0
+        # Requests still stalled from an earlier test do not count towards the next one
+        self.generation = 0
+        self.in_flight = {}
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with stub.lock:
+                    number, generation = stub.requests, stub.generation
+                    stub.requests += 1
+                    stub.in_flight[generation] = stub.in_flight.get(generation, 0) + 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight[generation])
+                try:
+                    time.sleep(stub.delay(number))
+                    payload = json.dumps({
+                        'id': f"chatcmpl-{uuid.uuid4().hex[:12]}", 'object': 'chat.completion',
+                        'created': int(time.time()), 'model': body['model'],
+                        'choices': [{'index': 0, 'finish_reason': 'stop',
+                                     'message': {'role': 'assistant', 'content': f"reply {number}"}}],
+                        'usage': {'prompt_tokens': 5, 'completion_tokens': 2, 'total_tokens': 7},
+                    }).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up on this request
+                    pass
+                finally:
+                    with stub.lock:
+                        stub.in_flight[generation] -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def reset(self, delay):
+        with self.lock:
+            self.delay = delay
+            self.generation += 1
+            self.requests = 0
+            self.max_in_flight = 0
+
+    def client(self) -> OpenAI:
+        return OpenAI(api_key='stub', base_url=self.base_url)
+
+
+STUB = Stub()
+
+
+def test_deadline():
+    STUB.reset(lambda n: 5.0)
+    completions = ResilientCompletions(reserve=0.3)
+    started = time.monotonic()
+    try:
+        with request_budget(0.8):
+            completions.create(STUB.client(), model=MODEL, messages=MESSAGES)
+        raise AssertionError("expected OpenAIDeadlineExceeded")
+    except OpenAIDeadlineExceeded:
+        pass
+    elapsed = time.monotonic() - started
+    assert elapsed < 1.0, elapsed
+    assert completions.counters.get('timeouts') == 1
+
+    # Too little budget left: no request is sent at all
+    requests = STUB.requests
+    try:
+        with request_budget(0.5):
+            completions.create(STUB.client(), model=MODEL, messages=MESSAGES)
+        raise AssertionError("expected OpenAIDeadlineExceeded")
+    except OpenAIDeadlineExceeded:
+        pass
+    assert STUB.requests == requests
+    assert completions.counters.get('no_budget') == 1
+
+
+def test_handler_answers_locally():
+    from services.message_handler import MessageHandler
+    from services.openai_service import OpenAIService
+
+    STUB.reset(lambda n: 5.0)
+    os.environ['OPENAI_API_KEY'] = 'stub'
+    os.environ['OPENAI_BASE_URL'] = STUB.base_url
+    os.environ['OPENAI_ROUTING'] = 'always'
+    os.environ['REQUEST_BUDGET_SECONDS'] = '1.0'
+    try:
+        openai_service = OpenAIService(mode='two_call')
+        nlp_service = SimpleNamespace(process_message=lambda text: ('help', None), spot_title=lambda text, slot=False: None)
+        container = SimpleNamespace(tmdb_service=None, db_service=None, whatsapp_service=None,
+                                    openai_service=openai_service, nlp_service=nlp_service)
+        handler = MessageHandler(container=container)
+        started = time.monotonic()
+        response, success = handler.handle_message("what can you do?", "resilience-test")
+        handler.executor.shutdown()
+    finally:
+        del os.environ['REQUEST_BUDGET_SECONDS']
+
+    assert success
+    assert response == handler._handle_help_request()
+    assert time.monotonic() - started < 1.2
+    assert openai_service.completions.counters.get('fallbacks') == 1
+
+
+def test_concurrency_cap():
+    STUB.reset(lambda n: 0.2)
+    completions = ResilientCompletions(max_in_flight=8, model_limits={MODEL: 3})
+    client = STUB.client()
+    with ThreadPoolExecutor(max_workers=12) as pool:
+        replies = list(pool.map(lambda _: completions.create(client, model=MODEL, messages=MESSAGES), range(12)))
+    assert len(replies) == 12
+    assert STUB.max_in_flight <= 3, STUB.max_in_flight
+
+    async def burst():
+        client = AsyncOpenAI(api_key='stub', base_url=STUB.base_url)
+        try:
+            return await asyncio.gather(*(completions.create_async(client, model=MODEL, messages=MESSAGES)
+                                          for _ in range(12)))
+        finally:
+            await client.close()
+
+    STUB.reset(lambda n: 0.2)
+    assert len(asyncio.run(burst())) == 12
+    assert STUB.max_in_flight <= 3, STUB.max_in_flight
+
+
+def test_hedging():
+    # Warm up the latency history with fast replies, then stall the next request
+    STUB.reset(lambda n: 0.02)
+    completions = ResilientCompletions(hedge=True, hedge_min_samples=5)
+    client = STUB.client()
+    for _ in range(5):
+        completions.create(client, model=MODEL, messages=MESSAGES)
+
+    STUB.reset(lambda n: 3.0 if n == 0 else 0.02)
+    started = time.monotonic()
+    response = completions.create(client, model=MODEL, messages=MESSAGES)
+    assert time.monotonic() - started < 1.0
+    assert response.choices[0].message.content == "reply 1"
+    counters = completions.counters.snapshot()
+    assert counters['hedges'] == 1 and counters['hedge_wins'] == 1, counters
+
+
+class RecordingLimiter:
+    """Grants every request and records the priority it was made under"""
+
+    def __init__(self):
+        self.priorities = []
+
+    def acquire(self, service, key, deadline):
+        self.priorities.append(current_priority())
+
+    async def acquire_async(self, service, key, deadline):
+        self.priorities.append(current_priority())
+
+
+def wait_until(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_hedged_requests_hold_their_own_slots():
+    STUB.reset(lambda n: 0.02)
+    limiter = RecordingLimiter()
+    completions = ResilientCompletions(max_in_flight=4, model_limits={MODEL: 2}, hedge=True,
+                                       hedge_min_samples=5, limiter=limiter)
+    client = STUB.client()
+    for _ in range(5):
+        completions.create(client, model=MODEL, messages=MESSAGES)
+
+    STUB.reset(lambda n: 0.8 if n == 0 else 0.02)
+    with request_priority(BACKGROUND):
+        assert completions.create(client, model=MODEL, messages=MESSAGES).choices[0].message.content == "reply 1"
+    # The stalled request still holds its slots; the duplicate has freed its own
+    assert completions._slots._value == 3 and completions._model_semaphore(MODEL)._value == 1
+    assert wait_until(lambda: completions._slots._value == 4 and completions._model_semaphore(MODEL)._value == 2)
+    # Both requests ran in the caller's context
+    assert limiter.priorities[-2:] == [BACKGROUND, BACKGROUND]
+
+    # With the model's only slot taken by the request itself, no duplicate goes out
+    single = ResilientCompletions(model_limits={MODEL: 1}, hedge=True, hedge_min_samples=5)
+    STUB.reset(lambda n: 0.02)
+    for _ in range(5):
+        single.create(client, model=MODEL, messages=MESSAGES)
+    STUB.reset(lambda n: 0.3 if n == 0 else 0.02)
+    assert single.create(client, model=MODEL, messages=MESSAGES).choices[0].message.content == "reply 0"
+    assert single.counters.get('hedges') == 0
+    assert single._model_semaphore(MODEL)._value == 1
+
+    async def hedged_async():
+        client = AsyncOpenAI(api_key='stub', base_url=STUB.base_url)
+        try:
+            STUB.reset(lambda n: 0.02)
+            for _ in range(5):
+                await completions.create_async(client, model=MODEL, messages=MESSAGES)
+            STUB.reset(lambda n: 0.8 if n == 0 else 0.02)
+            response = await completions.create_async(client, model=MODEL, messages=MESSAGES)
+            global_slots, model_slots = completions._async_semaphores(MODEL)
+            # Well before the stalled reply would arrive
+            for _ in range(20):
+                if (global_slots._value, model_slots._value) == (4, 2):
+                    break
+                await asyncio.sleep(0.01)
+            return response, global_slots._value, model_slots._value
+        finally:
+            await client.close()
+
+    response, global_free, model_free = asyncio.run(hedged_async())
+    assert response.choices[0].message.content == "reply 1"
+    # The stalled request was cancelled and freed its slots along with the duplicate
+    assert (global_free, model_free) == (4, 2)
+    assert completions.counters.get('hedges') == 2
+
+
+def test_response_cache_keys_exact_prompt():
+    from services.openai_service import OpenAIService, counting_calls
+
+    STUB.reset(lambda n: 0.0)
+    os.environ['OPENAI_API_KEY'] = 'stub'
+    os.environ['OPENAI_BASE_URL'] = STUB.base_url
+    service = OpenAIService(mode='two_call')
+    # No intent skips history unless OPENAI_STATELESS_INTENTS lists it
+    assert not service.stateless_intents
+    service.context.record('chat', 'cache-test', 'user', "tell me about alien")
+    assert len(service._build_response_messages("prompt", 'cache-test', intent='get_info')) == 3
+
+    with counting_calls() as calls:
+        first = service.generate_response("Alien scores 7.5/10.", 'cache-user-1')
+    assert calls == ['response']
+    # A cache hit makes no completion for the hybrid router to count
+    with counting_calls() as calls:
+        assert service.generate_response("Alien scores 7.5/10.", 'cache-user-2') == first
+    assert calls == []
+    # Data that only differs in punctuation is different data
+    assert service.generate_response("Alien scores 7 5 10.", 'cache-user-3') != first
+    assert STUB.requests == 2
+    assert service.usage.get('cached_responses') == 1
+
+
+if __name__ == "__main__":
+    test_deadline()
+    test_handler_answers_locally()
+    test_concurrency_cap()
+    test_hedging()
+    test_hedged_requests_hold_their_own_slots()
+    test_response_cache_keys_exact_prompt()
+    print("All OpenAI resilience tests passed!")
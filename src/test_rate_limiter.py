@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Tests for the shared token-bucket rate limiter: pacing, per-endpoint limits,
+giving up within the request budget, live requests beating background work,
+one shared-memory bucket paced across processes, and workers with different
+limits keeping to their own files. Needs no network.
+"""
+
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from services.execution_plan import request_budget
+from services.rate_limiter import (BACKGROUND, RateLimitExceeded, RateLimiter, SharedMemoryBuckets,
+                                   request_priority)
+
+
+def test_pacing():
+    limiter = RateLimiter({'tmdb': (20.0, 2.0)})
+    started = time.monotonic()
+    for _ in range(10):
+        limiter.acquire('tmdb', 'search')
+    elapsed = time.monotonic() - started
+    # Two tokens of burst, then one every 50 ms
+    assert 0.35 <= elapsed < 0.8, elapsed
+    # Providers without a limit are not held up
+    assert limiter.acquire('twilio', 'messages') == 0.0
+    counters = limiter.metrics()['counters']
+    assert counters['tmdb.live.granted'] == 10 and counters['tmdb.live.waited'] >= 7, counters
+
+
+def test_endpoint_limits():
+    limiter = RateLimiter({'tmdb': (1000.0, 1000.0), 'tmdb.search': (10.0, 1.0)})
+    started = time.monotonic()
+    for _ in range(5):
+        limiter.acquire('tmdb', 'details')
+    assert time.monotonic() - started < 0.05
+    for _ in range(3):
+        limiter.acquire('tmdb', 'search')
+    assert time.monotonic() - started >= 0.18
+
+
+def test_gives_up_within_budget():
+    limiter = RateLimiter({'openai': (1.0, 1.0)}, max_wait=5.0)
+    limiter.acquire('openai', 'gpt-4o-mini')
+    started = time.monotonic()
+    try:
+        with request_budget(0.3):
+            limiter.acquire('openai', 'gpt-4o-mini')
+        raise AssertionError("expected RateLimitExceeded")
+    except RateLimitExceeded:
+        pass
+    # Rejected without sleeping, and the borrowed token was handed back
+    assert time.monotonic() - started < 0.05
+    assert limiter.metrics()['counters']['openai.live.rejected'] == 1
+    time.sleep(1.0)
+    assert limiter.acquire('openai', 'gpt-4o-mini') < 0.05
+
+
+def test_live_beats_background():
+    limiter = RateLimiter({'tmdb': (40.0, 4.0)}, background_reserve=0.5)
+    finished = {}
+
+    def run(name, priority):
+        with request_priority(priority):
+            for _ in range(12):
+                limiter.acquire('tmdb', 'details')
+        finished[name] = time.monotonic()
+
+    threads = [threading.Thread(target=run, args=('background', BACKGROUND)),
+               threading.Thread(target=run, args=('live', 'live'))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    waits = limiter.metrics()['wait']
+    print(f"Wait by priority: {waits}")
+    assert finished['live'] < finished['background']
+    assert waits['tmdb.live']['avg_ms'] < waits['tmdb.background']['avg_ms']
+
+
+def _acquire_in_process(path, count):
+    limiter = RateLimiter({'tmdb': (20.0, 1.0)}, SharedMemoryBuckets(path, ['tmdb']))
+    for _ in range(count):
+        limiter.acquire('tmdb', 'search')
+
+
+def test_shared_memory_across_processes():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'buckets')
+        SharedMemoryBuckets(path, ['tmdb'])
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=_acquire_in_process, args=(path, 5)) for _ in range(2)]
+        started = time.monotonic()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(10)
+        elapsed = time.monotonic() - started
+    assert all(process.exitcode == 0 for process in processes)
+    # Ten tokens from one 20/s bucket: on their own, each process would finish in about 0.2 s
+    assert elapsed >= 0.4, elapsed
+
+
+def test_shared_memory_file_per_configuration():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'buckets')
+        old = SharedMemoryBuckets(path, ['tmdb'])
+        assert old.take('tmdb', 1.0, 2.0, False, 0.0)[0]
+        size = os.path.getsize(old.path)
+
+        # A worker started with other limits neither resizes nor resets the old file
+        new = SharedMemoryBuckets(path, ['openai', 'tmdb'])
+        assert new.path != old.path and os.path.getsize(old.path) == size
+        assert old.take('tmdb', 1.0, 2.0, False, 0.0)[0]
+        assert not old.take('tmdb', 1.0, 2.0, False, 0.0)[0]
+        # Workers with the same limits share state
+        assert not SharedMemoryBuckets(path, ['tmdb']).take('tmdb', 1.0, 2.0, False, 0.0)[0]
+        assert new.take('tmdb', 1.0, 2.0, False, 0.0)[0]
+
+
+if __name__ == "__main__":
+    test_pacing()
+    test_endpoint_limits()
+    test_gives_up_within_budget()
+    test_live_beats_background()
+    test_shared_memory_across_processes()
+    test_shared_memory_file_per_configuration()
+    print("All rate limiter tests passed!")
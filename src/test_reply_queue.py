@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Tests for the acknowledge-then-reply queue: delivery of queued messages,
+each backpressure policy when the queue is full, and shutdown with a full
+queue. Uses fake handler and WhatsApp services, so no network is needed.
+"""
+
+import threading
+import time
+
+from services.reply_queue import ReplyQueue
+
+
+class FakeHandler:
+    """Answers every message, optionally holding each one until `release` is set"""
+
+    def __init__(self, hold: bool = False):
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+        self.started = threading.Semaphore(0)
+
+    def handle_message(self, message, sender):
+        self.started.release()
+        self.release.wait()
+        return f"re: {message}", True
+
+
+class FakeWhatsApp:
+    def __init__(self):
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send_message(self, to_number, text):
+        with self.lock:
+            self.sent.append((to_number, text))
+        return True
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+def test_enqueue_and_deliver():
+    whatsapp = FakeWhatsApp()
+    replies = ReplyQueue(FakeHandler(), whatsapp, workers=2, max_queue=10, backpressure='reject')
+    replies.start()
+    for i in range(5):
+        assert replies.submit(f"message {i}", 'whatsapp:+100')
+    wait_for(lambda: len(whatsapp.sent) == 5)
+    replies.stop()
+    assert sorted(text for _, text in whatsapp.sent) == [f"re: message {i}" for i in range(5)]
+    assert all(number == '+100' for number, _ in whatsapp.sent)
+    counters = replies.metrics()['counters']
+    assert counters['enqueued'] == 5 and counters['delivered'] == 5, counters
+    # A stopped queue takes no more messages
+    assert not replies.submit("late", 'whatsapp:+100')
+
+
+def test_overflow_policies():
+    handler = FakeHandler(hold=True)
+    replies = ReplyQueue(handler, FakeWhatsApp(), workers=1, max_queue=1, backpressure='reject')
+    replies.start()
+    assert replies.submit("busy worker", 'whatsapp:+1')
+    handler.started.acquire(timeout=2)
+    assert replies.submit("fills the queue", 'whatsapp:+1')
+    assert not replies.submit("turned away", 'whatsapp:+1')
+    assert replies.metrics()['counters']['rejected'] == 1
+
+    # 'block' waits for a free slot before giving up
+    replies.backpressure = 'block'
+    replies.block_timeout = 0.2
+    started = time.monotonic()
+    assert not replies.submit("waits, then turned away", 'whatsapp:+1')
+    assert time.monotonic() - started >= 0.2
+
+    handler.release.set()
+    replies.stop()
+    counters = replies.metrics()['counters']
+    assert counters['rejected'] == 2 and counters['delivered'] == 2, counters
+
+    # 'inline' lets the caller answer on its own thread
+    inline = ReplyQueue(FakeHandler(), FakeWhatsApp(), workers=1, max_queue=1, backpressure='inline')
+    assert inline.process_inline("hello", 'whatsapp:+1') == ("re: hello", True)
+
+
+def test_stop_with_full_queue_does_not_hang():
+    handler = FakeHandler(hold=True)
+    replies = ReplyQueue(handler, FakeWhatsApp(), workers=2, max_queue=2, backpressure='reject')
+    replies.start()
+    for i in range(2):
+        assert replies.submit(f"stuck {i}", 'whatsapp:+1')
+    for _ in range(2):
+        handler.started.acquire(timeout=2)
+    for i in range(2):
+        assert replies.submit(f"queued {i}", 'whatsapp:+1')
+    assert not replies.submit("overflow", 'whatsapp:+1')
+
+    started = time.monotonic()
+    replies.stop(timeout=0.3)
+    elapsed = time.monotonic() - started
+    print(f"Stopped in {elapsed:.2f}s: {replies.metrics()['counters']}")
+    assert elapsed < 1.0, elapsed
+    assert replies.metrics()['counters']['dropped'] == 2
+    handler.release.set()
+
+
+def test_explicit_zero_settings():
+    # 0 is a value, not "unset": an unbounded queue, and no workers is an error
+    assert ReplyQueue(FakeHandler(), FakeWhatsApp(), workers=1, max_queue=0).max_queue == 0
+    try:
+        ReplyQueue(FakeHandler(), FakeWhatsApp(), workers=0)
+        raise AssertionError("expected ValueError")
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    test_enqueue_and_deliver()
+    test_overflow_policies()
+    test_stop_with_full_queue_does_not_hang()
+    test_explicit_zero_settings()
+    print("All reply queue tests passed!")
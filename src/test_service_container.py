@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Tests for the service container's warm-up: retries with backoff until the
+services are warm, stops retrying on shutdown, and importing the Flask app
+starts nothing. Replaces warm_up with a fake, so no network is needed.
+"""
+
+import os
+import threading
+import time
+
+import webhook_server
+from services.container import ServiceContainer, current_container
+
+
+class FlakyWarmUp:
+    """Fails the first `failures` attempts, then succeeds"""
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.attempts = []
+
+    def __call__(self) -> bool:
+        self.attempts.append(time.perf_counter())
+        return len(self.attempts) > self.failures
+
+
+def test_warm_up_retries_with_backoff():
+    os.environ['WARMUP_RETRY_DELAY'] = '0.02'
+    os.environ['WARMUP_RETRY_MAX_DELAY'] = '0.05'
+    try:
+        container = ServiceContainer(with_reply_queue=False)
+        container.warm_up = FlakyWarmUp(failures=4)
+        assert container.warm_up_until_ready()
+        attempts = container.warm_up.attempts
+        assert len(attempts) == 5
+        gaps = [later - earlier for earlier, later in zip(attempts, attempts[1:])]
+        # 0.02, 0.04, then capped at 0.05
+        assert gaps[0] >= 0.02 and gaps[1] >= 0.04
+        assert all(gap < 0.5 for gap in gaps)
+    finally:
+        del os.environ['WARMUP_RETRY_DELAY'], os.environ['WARMUP_RETRY_MAX_DELAY']
+
+
+def test_shutdown_stops_retrying():
+    os.environ['WARMUP_RETRY_DELAY'] = '10'
+    try:
+        container = ServiceContainer(with_reply_queue=False)
+        container.warm_up = FlakyWarmUp(failures=1000)
+        result = []
+        thread = threading.Thread(target=lambda: result.append(container.warm_up_until_ready()))
+        thread.start()
+        time.sleep(0.05)
+        container.shutdown()
+        thread.join(timeout=1)
+        assert not thread.is_alive() and result == [False]
+        assert len(container.warm_up.attempts) == 1
+    finally:
+        del os.environ['WARMUP_RETRY_DELAY']
+
+
+def test_import_starts_no_services():
+    assert not webhook_server._services_started
+    assert current_container() is None
+
+
+if __name__ == "__main__":
+    test_warm_up_retries_with_backoff()
+    test_shutdown_stops_retrying()
+    test_import_starts_no_services()
+    print("All service container tests passed!")
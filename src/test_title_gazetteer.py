@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Test script for the title gazetteer: longest-match spotting, confidence,
+everyday phrases that are also titles, and rebuilding from an updated title
+index without a restart.
+"""
+
+import os
+import tempfile
+import time
+
+from services.title_gazetteer import TitleGazetteer
+from services.title_index import build_index
+
+
+def test_longest_title_wins():
+    gazetteer = TitleGazetteer.from_records([
+        {'id': 603, 'title': 'The Matrix', 'popularity': 80},
+        {'id': 604, 'title': 'The Matrix Reloaded', 'popularity': 40},
+        {'id': 1, 'title': 'Up', 'popularity': 70},
+    ], aliases={'matrix 2': 604})
+    match = gazetteer.best("tell me about the matrix reloaded please")
+    assert (match.movie_id, match.title) == (604, 'The Matrix Reloaded')
+    assert gazetteer.best("is matrix 2 any good").movie_id == 604
+    assert gazetteer.best("the matrix").confidence > gazetteer.best("up").confidence
+    assert gazetteer.best("nothing known here") is None
+    print(f"Best match: {match}")
+
+
+def test_everyday_phrases_are_not_confident():
+    gazetteer = TitleGazetteer.from_records([
+        {'id': 1, 'title': 'Thank You', 'popularity': 5},
+        {'id': 2, 'title': 'Good Morning', 'popularity': 5},
+        {'id': 3, 'title': 'Home', 'popularity': 30},
+        {'id': 27205, 'title': 'Inception', 'popularity': 90},
+    ])
+    for message in ("thank you", "Thank you!", "good morning", "going home now", "home"):
+        match = gazetteer.best(message)
+        assert match.confidence < 0.8, match
+
+    # Quoting or capitalising a title shows the user means the movie
+    assert gazetteer.best('"thank you"').confidence >= 0.8
+    assert gazetteer.best("have you seen Good Morning").confidence >= 0.8
+    assert gazetteer.best("'home'").confidence > gazetteer.best("home").confidence
+    # A rule already found the title slot, so the phrase penalties do not apply
+    assert gazetteer.best("home", slot=True).confidence == gazetteer.best("'home'").confidence
+    # A distinctive title still stands on its own
+    assert gazetteer.best("inception").confidence >= 0.8
+    assert gazetteer.best("HOME").confidence < 0.8
+
+
+def test_rebuild_from_updated_index():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'titles.sqlite3')
+        build_index([{'id': 603, 'original_title': 'The Matrix', 'popularity': 80}], path)
+        gazetteer = TitleGazetteer(path, refresh_interval=0)
+        assert gazetteer.best("the matrix").movie_id == 603
+        assert gazetteer.best("inception") is None
+
+        build_index([{'id': 603, 'original_title': 'The Matrix', 'popularity': 80},
+                     {'id': 27205, 'original_title': 'Inception', 'popularity': 90}], path)
+        # The first lookup after the change starts a background rebuild
+        gazetteer.best("inception")
+        deadline = time.monotonic() + 5
+        while gazetteer.generation < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert gazetteer.best("inception").movie_id == 27205
+        print(f"Rebuilt gazetteer: {gazetteer.stats()}")
+
+
+if __name__ == "__main__":
+    test_longest_title_wins()
+    test_everyday_phrases_are_not_confident()
+    test_rebuild_from_updated_index()
+    print("All gazetteer tests passed!")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Tests for the local title index: exact lookups by title and by original title,
+typo-tolerant lookups and misses. Builds a small index in a temporary directory.
+"""
+
+import os
+import tempfile
+
+from services.title_index import TitleIndex, build_index
+
+RECORDS = [
+    {'id': 496243, 'title': 'Parasite', 'original_title': '기생충', 'popularity': 80},
+    {'id': 30519, 'original_title': 'Parasite', 'popularity': 3},
+    {'id': 129, 'title': 'Spirited Away', 'original_title': '千と千尋の神隠し', 'popularity': 90},
+    {'id': 27205, 'title': 'Inception', 'original_title': 'Inception', 'popularity': 85},
+    {'id': 603, 'original_title': 'The Matrix', 'popularity': 70},
+    {'id': 1, 'original_title': 'Obscure Short', 'popularity': 0.1},
+    {'id': 2, 'original_title': 'Adult Film', 'popularity': 50, 'adult': True},
+]
+
+
+def open_index(directory, **kwargs):
+    path = os.path.join(directory, 'titles.sqlite3')
+    assert build_index(RECORDS, path) == 6
+    return TitleIndex(path, **kwargs)
+
+
+def test_exact_and_alias_lookups():
+    with tempfile.TemporaryDirectory() as directory:
+        index = open_index(directory)
+        # The English title finds the film whose original title is Korean, over
+        # the less popular film that has it as its original title
+        match = index.exact("parasite")
+        assert (match['id'], match['title']) == (496243, 'Parasite'), match
+        assert index.exact("千と千尋の神隠し")['id'] == 129
+        assert index.exact("Spirited Away!")['title'] == 'Spirited Away'
+        assert index.exact("the matrix")['id'] == 603
+        assert [m['id'] for m in index.prefix("spirit")] == [129]
+
+
+def test_fuzzy_lookups_and_misses():
+    with tempfile.TemporaryDirectory() as directory:
+        index = open_index(directory)
+        assert index.exact("inceptio") is None
+        match = index.fuzzy("inceptio", limit=1)[0]
+        assert match['id'] == 27205 and 0.6 <= match['score'] < 1.0, match
+        assert index.fuzzy("spirted away", limit=1)[0]['id'] == 129
+        # Below fuzzy_min_popularity: found exactly, never fuzzily
+        assert index.exact("obscure short")['id'] == 1
+        assert index.fuzzy("obscure shorts") == []
+        # Misses, and adult titles are not indexed
+        assert index.lookup("completely unknown words") is None
+        assert index.lookup("adult film") is None
+        assert index.fuzzy("") == []
+
+
+def test_fuzzy_candidates_are_capped():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'titles.sqlite3')
+        build_index([{'id': i, 'original_title': f"Night Story {i}", 'popularity': 10} for i in range(1, 300)], path)
+        index = TitleIndex(path, max_candidates=20)
+        # Every title shares most trigrams with the query; only the capped candidates are scored
+        matches = index.fuzzy("night story 12", limit=50)
+        assert 0 < len(matches) <= 20, len(matches)
+
+
+if __name__ == "__main__":
+    test_exact_and_alias_lookups()
+    test_fuzzy_lookups_and_misses()
+    test_fuzzy_candidates_are_capped()
+    print("All title index tests passed!")
@@ -0,0 +1,691 @@
+#!/usr/bin/env python
+"""
+Test script for the pooled TMDb transport and its cache.
+Runs TMDbService against a local stub HTTP server, so no API key or network is needed.
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from services.execution_plan import request_budget
+from services.http_transport import CircuitOpenError, HTTPTransport, CircuitBreaker, TransportError
+from services.singleflight import SingleFlight
+
+
+class StubTMDbHandler(BaseHTTPRequestHandler):
+    """Serves scripted responses: each path pops the next (status, headers, body, delay)"""
+    protocol_version = 'HTTP/1.1'
+    script = {}
+    hits = {}
+    # Client (host, port) pairs seen, one per TCP connection
+    clients = set()
+
+    def do_HEAD(self):
+        StubTMDbHandler.clients.add(self.client_address)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        StubTMDbHandler.clients.add(self.client_address)
+        path = self.path.split('?')[0]
+        StubTMDbHandler.hits[path] = StubTMDbHandler.hits.get(path, 0) + 1
+        steps = StubTMDbHandler.script.get(path, [])
+        status, headers, body, delay = steps.pop(0) if len(steps) > 1 else steps[0]
+        time.sleep(delay)
+        try:
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            # bytes bodies are sent as they are, e.g. a proxy's HTML error page
+            data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+            self.send_header('Content-Type', 'text/html' if isinstance(body, bytes) else 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except BrokenPipeError:
+            # The client gave up (read timeout test)
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubTMDbHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/3"
+
+
+def test_retry_after_then_success():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {'/3/search/movie': [
+        (429, {'Retry-After': '0.1'}, {}, 0),
+        (503, {}, {}, 0),
+        (200, {}, {'results': [{'id': 27205, 'title': 'Inception'}]}, 0),
+    ]}
+    transport = HTTPTransport('tmdb', max_retries=2, backoff_base=0.05)
+    payload = transport.get('search', f"{base_url}/search/movie", {'query': 'inception'})
+    assert payload['results'][0]['id'] == 27205
+    counters = transport.metrics()['counters']
+    print(f"Retry metrics: {counters}")
+    assert counters['search.retries'] == 2
+    server.shutdown()
+
+
+def test_read_timeout():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {'/3/movie/1': [(200, {}, {'id': 1}, 1.0)]}
+    transport = HTTPTransport('tmdb', timeouts={'details': (0.5, 0.2)}, max_retries=0)
+    started = time.perf_counter()
+    try:
+        transport.get('details', f"{base_url}/movie/1", {})
+        raise AssertionError("expected a timeout")
+    except TransportError as e:
+        print(f"Timed out after {time.perf_counter() - started:.2f}s: {e}")
+    server.shutdown()
+
+
+def test_attempt_timeout_capped_by_budget():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {'/3/movie/1': [(200, {}, {'id': 1}, 1.0)]}
+    StubTMDbHandler.hits = {}
+    transport = HTTPTransport('tmdb', timeouts={'details': (5.0, 5.0)}, max_retries=0)
+    started = time.perf_counter()
+    with request_budget(0.2):
+        try:
+            transport.get('details', f"{base_url}/movie/1", {})
+            raise AssertionError("expected a timeout")
+        except TransportError:
+            pass
+        assert time.perf_counter() - started < 0.6
+
+        # Budget spent: no attempt is made
+        time.sleep(0.2)
+        try:
+            transport.get('details', f"{base_url}/movie/1", {})
+            raise AssertionError("expected a TransportError")
+        except TransportError:
+            pass
+    assert StubTMDbHandler.hits['/3/movie/1'] == 1
+    assert transport.metrics()['counters']['details.budget_exhausted'] == 1
+    server.shutdown()
+
+
+def test_circuit_breaker_fails_fast():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {'/3/movie/2/similar': [(500, {}, {}, 0)]}
+    StubTMDbHandler.hits = {}
+    transport = HTTPTransport('tmdb', max_retries=0,
+                              breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60))
+    for _ in range(3):
+        try:
+            transport.get('similar', f"{base_url}/movie/2/similar", {})
+        except TransportError:
+            pass
+    try:
+        transport.get('similar', f"{base_url}/movie/2/similar", {})
+        raise AssertionError("expected the circuit to be open")
+    except CircuitOpenError:
+        pass
+    print(f"Breaker state: {transport.breaker.state}, server hits: {StubTMDbHandler.hits}")
+    assert StubTMDbHandler.hits['/3/movie/2/similar'] == 3
+    server.shutdown()
+
+
+def test_client_errors_and_the_breaker():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {
+        '/3/movie/7': [(500, {}, {}, 0)],
+        '/3/movie/8': [(404, {}, {}, 0)],
+        '/3/movie/9': [(401, {}, {}, 0)],
+    }
+
+    def get(path):
+        try:
+            transport.get('details', f"{base_url}{path}", {})
+        except CircuitOpenError:
+            raise
+        except TransportError:
+            pass
+
+    # A 404 between two 500s does not reset the failure count
+    transport = HTTPTransport('tmdb', max_retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    get('/movie/7')
+    get('/movie/8')
+    assert transport.breaker.state == 'closed'
+    get('/movie/7')
+    assert transport.breaker.state == 'open'
+
+    # A rejected API key fails every call, so it trips the breaker
+    transport = HTTPTransport('tmdb', max_retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    get('/movie/9')
+    get('/movie/9')
+    assert transport.breaker.state == 'open'
+    assert transport.metrics()['counters']['details.errors.401'] == 2
+    server.shutdown()
+
+
+def test_retry_after_is_honoured():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {'/3/movie/4': [
+        (429, {'Retry-After': '0.3'}, {}, 0),
+        (200, {}, {'id': 4}, 0),
+    ]}
+    # Longer than backoff_max, but the server's wait is not cut short
+    transport = HTTPTransport('tmdb', max_retries=1, backoff_max=0.05)
+    started = time.monotonic()
+    assert transport.get('details', f"{base_url}/movie/4", {})['id'] == 4
+    assert time.monotonic() - started >= 0.3
+
+    # Longer than retry_after_max: fail at once instead of retrying into the throttle
+    StubTMDbHandler.script = {'/3/movie/5': [(429, {'Retry-After': '120'}, {}, 0)]}
+    StubTMDbHandler.hits = {}
+    transport = HTTPTransport('tmdb', max_retries=2, retry_after_max=30)
+    started = time.monotonic()
+    try:
+        transport.get('details', f"{base_url}/movie/5", {})
+        raise AssertionError("expected a TransportError")
+    except TransportError:
+        pass
+    assert time.monotonic() - started < 0.5
+    assert StubTMDbHandler.hits['/3/movie/5'] == 1
+    assert transport.metrics()['counters']['details.retry_after_exceeded'] == 1
+    server.shutdown()
+
+
+def test_cancelled_trial_releases_breaker():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {'/3/movie/6': [(200, {}, {'id': 6}, 1.0)]}
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+    transport = HTTPTransport('tmdb', max_retries=0, breaker=breaker)
+    breaker.record_failure()
+    time.sleep(0.15)
+    assert breaker.state == 'half_open'
+
+    async def cancel_trial():
+        try:
+            task = asyncio.ensure_future(transport.get_async('details', f"{base_url}/movie/6", {}))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        finally:
+            await transport.aclose()
+
+    asyncio.run(cancel_trial())
+    # The cancelled trial recorded no outcome, but the next call may be the trial
+    allowed, trial = breaker.admit()
+    assert allowed and trial is not None
+    breaker.end_trial(trial)
+    server.shutdown()
+
+
+def test_async_transport():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {'/3/movie/3': [
+        (502, {}, {}, 0),
+        (200, {}, {'id': 3, 'title': 'Stub'}, 0),
+    ]}
+    transport = HTTPTransport('tmdb', max_retries=1, backoff_base=0.05)
+
+    async def fetch():
+        try:
+            return await transport.get_async('details', f"{base_url}/movie/3", {})
+        finally:
+            await transport.aclose()
+
+    payload = asyncio.run(fetch())
+    print(f"Async payload: {payload}, metrics: {transport.metrics()['counters']}")
+    assert payload['id'] == 3
+    server.shutdown()
+
+
+def test_non_json_body_is_a_transport_error():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {'/3/movie/6': [(200, {}, b"<html>Bad gateway</html>", 0)]}
+    transport = HTTPTransport('tmdb', max_retries=0,
+                              breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    try:
+        transport.get('details', f"{base_url}/movie/6", {})
+        raise AssertionError("expected a TransportError")
+    except TransportError as e:
+        assert not isinstance(e, CircuitOpenError)
+
+    async def fetch():
+        try:
+            return await transport.get_async('details', f"{base_url}/movie/6", {})
+        finally:
+            await transport.aclose()
+
+    try:
+        asyncio.run(fetch())
+        raise AssertionError("expected a TransportError")
+    except TransportError as e:
+        assert not isinstance(e, CircuitOpenError)
+    # Both count as failures, so the breaker is now open
+    assert transport.metrics()['counters']['details.errors.decode'] == 2
+    assert transport.breaker.state == 'open'
+    server.shutdown()
+
+
+def test_tmdb_service_against_stub():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {'/3/search/movie': [
+        (200, {}, {'results': [{'id': 603, 'title': 'The Matrix', 'vote_average': 8.2}]}, 0)
+    ]}
+    os.environ['TMDB_BASE_URL'] = base_url
+    os.environ.setdefault('TMDB_API_KEY', 'stub')
+    try:
+        from services.tmdb_service import TMDbService
+        movie, message = TMDbService().search_movie("The Matrix")
+    finally:
+        del os.environ['TMDB_BASE_URL']
+    print(f"Stub search: {movie} ({message})")
+    assert movie['id'] == 603
+    server.shutdown()
+
+
+def test_tmdb_warm_up_opens_pooled_connection():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {'/3/movie/603': [(200, {}, {'id': 603, 'title': 'The Matrix'}, 0)]}
+    StubTMDbHandler.clients = set()
+    tmdb = make_tmdb(base_url)
+    assert tmdb.warm_up()
+    # Not an API call: no rate limit token, breaker attempt or endpoint counter
+    assert tmdb.transport.metrics()['counters'] == {}
+    movie, _ = tmdb.get_movie_details(603)
+    assert movie['id'] == 603
+    # The lookup reused the connection opened by the warm-up
+    assert len(StubTMDbHandler.clients) == 1, StubTMDbHandler.clients
+    server.shutdown()
+    server.server_close()
+    assert not make_tmdb(base_url).warm_up()
+
+
+def test_tmdb_cache_and_invalidation():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {'/3/movie/603': [(200, {}, {'id': 603, 'title': 'The Matrix'}, 0)]}
+    StubTMDbHandler.hits = {}
+    os.environ['TMDB_BASE_URL'] = base_url
+    os.environ.setdefault('TMDB_API_KEY', 'stub')
+    try:
+        from services.tmdb_service import TMDbService
+        tmdb = TMDbService()
+    finally:
+        del os.environ['TMDB_BASE_URL']
+
+    for _ in range(3):
+        movie, _ = tmdb.get_movie_details(603)
+    assert StubTMDbHandler.hits['/3/movie/603'] == 1
+
+    removed = tmdb.invalidate_movie(603)
+    tmdb.get_movie_details(603)
+    print(f"Cache metrics: {tmdb.metrics()['cache']} (invalidated {removed})")
+    assert StubTMDbHandler.hits['/3/movie/603'] == 2
+    server.shutdown()
+
+
+def test_tmdb_singleflight():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {
+        '/3/search/movie': [(200, {}, {'results': [{'id': 11, 'title': 'Star Wars'}]}, 0.3)],
+        '/3/movie/11/similar': [(200, {}, {'results': [{'id': 1891, 'vote_average': 8.4}]}, 0.3)],
+    }
+    StubTMDbHandler.hits = {}
+    os.environ['TMDB_BASE_URL'] = base_url
+    os.environ.setdefault('TMDB_API_KEY', 'stub')
+    try:
+        from services.async_tmdb_service import AsyncTMDbService
+        from services.tmdb_service import TMDbService
+        tmdb = TMDbService()
+    finally:
+        del os.environ['TMDB_BASE_URL']
+
+    # Differently spelled queries normalise to the same key
+    queries = ["Star Wars", "star wars ", "STAR  WARS"] * 7
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        results = list(pool.map(tmdb.search_movie, queries))
+    assert all(movie['id'] == 11 for movie, _ in results)
+    assert StubTMDbHandler.hits['/3/search/movie'] == 1
+
+    async def similar():
+        service = AsyncTMDbService(tmdb)
+        try:
+            return await asyncio.gather(*(service.get_similar_movies(11) for _ in range(20)))
+        finally:
+            await service.close()
+
+    assert all(movies[0]['id'] == 1891 for movies, _ in asyncio.run(similar()))
+    assert StubTMDbHandler.hits['/3/movie/11/similar'] == 1
+    counters = tmdb.metrics()['singleflight']['counters']
+    print(f"Singleflight metrics: {counters}")
+    assert counters['coalesced'] >= 2
+    server.shutdown()
+
+
+def test_singleflight_shares_errors():
+    flights = SingleFlight()
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.2)
+        raise ValueError("boom")
+
+    def call(_):
+        started.wait()
+        try:
+            flights.do('key', failing)
+        except ValueError as e:
+            return str(e)
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        leader = pool.submit(flights.do, 'key', failing)
+        errors = list(pool.map(call, range(5)))
+    try:
+        leader.result()
+        raise AssertionError("expected ValueError")
+    except ValueError:
+        pass
+    assert errors == ["boom"] * 5
+    assert flights.counters.snapshot() == {'calls': 1, 'coalesced': 5, 'errors': 1}
+    assert flights.in_flight() == 0
+
+
+def test_singleflight_followers_stop_at_their_deadline():
+    flights = SingleFlight('test', timeout_error=TransportError)
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(2)
+        return "done"
+
+    def follower():
+        started.wait()
+        with request_budget(0.2):
+            begun = time.monotonic()
+            try:
+                flights.do('key', slow)
+                return None
+            except TransportError:
+                return time.monotonic() - begun
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flights.do, 'key', slow)
+        waited = pool.submit(follower).result()
+        release.set()
+        # The leader's call is unaffected
+        assert leader.result() == "done"
+    assert waited is not None and waited < 0.5, waited
+
+    async def async_follower():
+        async def slow_async():
+            await asyncio.sleep(1)
+            return "done"
+
+        leader = asyncio.ensure_future(flights.do_async('async-key', slow_async))
+        await asyncio.sleep(0)
+        with request_budget(0.2):
+            try:
+                await flights.do_async('async-key', slow_async)
+                raise AssertionError("expected TransportError")
+            except TransportError:
+                pass
+        return await leader
+
+    assert asyncio.run(async_follower()) == "done"
+    assert flights.counters.get('timeouts') == 2
+
+
+def make_tmdb(base_url, **env):
+    """TMDbService pointed at the stub with extra environment settings"""
+    env = dict(env, TMDB_BASE_URL=base_url)
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    os.environ.setdefault('TMDB_API_KEY', 'stub')
+    try:
+        from services.tmdb_service import TMDbService
+        return TMDbService()
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+
+def test_tmdb_stale_while_revalidate():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {'/3/movie/603': [
+        (200, {}, {'id': 603, 'title': 'The Matrix', 'vote_average': 8.1}, 0),
+        (200, {}, {'id': 603, 'title': 'The Matrix', 'vote_average': 8.2}, 0),
+    ]}
+    StubTMDbHandler.hits = {}
+    tmdb = make_tmdb(base_url, TMDB_CACHE_TTLS='details=0.3', TMDB_CACHE_STALE_TTL='60')
+
+    assert tmdb.get_movie_details(603)[0]['vote_average'] == 8.1
+    time.sleep(0.4)
+    # Past its TTL the entry is still served at once and queued for a refresh
+    assert tmdb.get_movie_details(603)[0]['vote_average'] == 8.1
+    assert StubTMDbHandler.hits['/3/movie/603'] == 1
+    assert tmdb.refresher.run_pending() == 1
+    assert tmdb.get_movie_details(603)[0]['vote_average'] == 8.2
+    assert StubTMDbHandler.hits['/3/movie/603'] == 2
+    metrics = tmdb.metrics()
+    print(f"Stale-while-revalidate: cache {metrics['cache']}, refresher {metrics['refresher']}")
+    assert metrics['cache']['stale_hits'] == 1
+    server.shutdown()
+
+
+def test_tmdb_prewarm():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {
+        '/3/trending/movie/day': [(200, {}, {'results': [{'id': 5, 'title': 'Four Rooms'}]}, 0)],
+        '/3/movie/popular': [(200, {}, {'results': [{'id': 6, 'title': 'Judgment Night'}]}, 0)],
+        '/3/movie/5': [(200, {}, {'id': 5, 'title': 'Four Rooms'}, 0)],
+        '/3/movie/6': [(200, {}, {'id': 6, 'title': 'Judgment Night'}, 0)],
+        '/3/movie/5/similar': [(200, {}, {'results': []}, 0)],
+        '/3/movie/6/similar': [(200, {}, {'results': []}, 0)],
+    }
+    StubTMDbHandler.hits = {}
+    tmdb = make_tmdb(base_url, TMDB_PREWARM_INTERVAL='3600', TMDB_REFRESH_RPS='20')
+
+    started = time.monotonic()
+    tmdb.refresher.prewarm()
+    requests = tmdb.refresher.run_pending()
+    elapsed = time.monotonic() - started
+    # Two lists, then details and similar movies for each listed movie, paced at 20 per second
+    assert requests == 6
+    assert elapsed >= 5 / 20, elapsed
+
+    assert tmdb.get_similar_movies(6)[0] == []
+    assert all(count == 1 for count in StubTMDbHandler.hits.values()), StubTMDbHandler.hits
+    # List entries are not stored as search results for their titles
+    assert tmdb.cache.local.get_entry(tmdb._search_key("Four Rooms")) is None
+    assert '/3/search/movie' not in StubTMDbHandler.hits
+
+    # Entries that stay fresh past the next run are not fetched again
+    tmdb.refresher.prewarm()
+    assert tmdb.refresher.run_pending() == 2
+    print(f"Prewarm metrics: {tmdb.refresher.metrics()}")
+    server.shutdown()
+
+
+def test_refreshers_share_one_pace():
+    from services.rate_limiter import REFRESH_BUCKET, RateLimiter, SharedMemoryBuckets
+    from services.tmdb_refresher import TMDbRefresher
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Two workers' refreshers on one node, each configured for 20 requests per second
+        path = os.path.join(directory, 'buckets')
+        refreshers = [TMDbRefresher(None, rps=20, limiter=RateLimiter({}, SharedMemoryBuckets(path, [REFRESH_BUCKET])))
+                      for _ in range(2)]
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            assert all(pool.map(lambda refresher: all(refresher._pace() for _ in range(6)), refreshers))
+        elapsed = time.monotonic() - started
+    # Twelve requests at 20 per second in total; on their own each would take 0.25 s
+    assert elapsed >= 11 / 20, elapsed
+
+
+def test_refresher_stays_out_of_live_flights():
+    from types import SimpleNamespace
+    from services.rate_limiter import BACKGROUND, RateLimiter, current_priority
+    from services.tmdb_refresher import TMDbRefresher
+
+    flights = SingleFlight('tmdb')
+    fetched = []
+
+    def fetch_and_store(endpoint, url, params, key):
+        # Nothing a live caller could join is in flight while the refresher fetches
+        fetched.append((key, flights.busy(key), current_priority()))
+        return {'results': []}
+
+    refresher = TMDbRefresher(SimpleNamespace(flights=flights, _fetch_and_store=fetch_and_store),
+                              rps=100, limiter=RateLimiter({}))
+    started, release = threading.Event(), threading.Event()
+
+    def live_fetch():
+        started.set()
+        release.wait(2)
+        return {'results': []}
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        live = pool.submit(flights.do, 'list:trending', live_fetch)
+        started.wait(2)
+        # A key a live request is already fetching is skipped
+        assert refresher._process('list', 'trending', 'url', {}, 'list:trending') == 0
+        release.set()
+        live.result()
+    assert refresher._process('list', 'trending', 'url', {}, 'list:trending') == 1
+    assert fetched == [('list:trending', False, BACKGROUND)]
+    assert refresher.counters.get('skipped') == 1
+
+
+def test_tmdb_title_index_exact_skips_search_fuzzy_does_not():
+    from services.title_index import build_index
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {
+        '/3/search/movie': [
+            (200, {}, {'results': [{'id': 157336, 'title': 'Interstellar'}]}, 0),
+            (200, {}, {'results': []}, 0),
+        ],
+        '/3/movie/496243': [(200, {}, {'id': 496243, 'title': 'Parasite'}, 0)],
+        '/3/movie/27205': [(200, {}, {'id': 27205, 'title': 'Inception'}, 0)],
+    }
+    StubTMDbHandler.hits = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'titles.sqlite3')
+        build_index([{'id': 496243, 'title': 'Parasite', 'original_title': '기생충', 'popularity': 80},
+                     {'id': 27205, 'original_title': 'Inception', 'popularity': 85},
+                     {'id': 157336, 'original_title': 'Interstellar', 'popularity': 90}], path)
+        tmdb = make_tmdb(base_url, TMDB_TITLE_INDEX=path)
+
+        # Exact match on the English title: straight to details
+        assert tmdb.search_movie("Parasite")[0]['id'] == 496243
+        assert '/3/search/movie' not in StubTMDbHandler.hits
+        # "interstelar" is fuzzily close to Interstellar, but TMDb's answer wins
+        assert tmdb.search_movie("interstelar")[0]['id'] == 157336
+        # TMDb finds nothing: the fuzzy match is the fallback
+        assert tmdb.search_movie("inceptio")[0]['id'] == 27205
+        assert StubTMDbHandler.hits['/3/search/movie'] == 2
+        counters = tmdb.metrics()['counters']
+        print(f"Title index counters: {counters}")
+        assert counters['title_index.hits'] == 1 and counters['title_index.fuzzy_hits'] == 1
+    server.shutdown()
+
+
+def test_tmdb_negative_cache_and_corrections():
+    server, base_url = start_stub_server()
+    StubTMDbHandler.script = {
+        '/3/search/movie': [
+            (200, {}, {'results': []}, 0),
+            (200, {}, {'results': [{'id': 27205, 'title': 'Inception'}]}, 0),
+        ],
+        '/3/movie/27205': [(200, {}, {'id': 27205, 'title': 'Inception'}, 0)],
+    }
+    StubTMDbHandler.hits = {}
+    tmdb = make_tmdb(base_url, TMDB_CACHE_TTLS='negative=60')
+
+    # A miss is remembered, so the retry does not go to TMDb
+    for _ in range(2):
+        movie, message = tmdb.search_movie("incepshun", "user-1")
+        assert movie is None and "No movies found" in message
+    assert StubTMDbHandler.hits['/3/search/movie'] == 1
+    assert tmdb.metrics()['counters']['search.negative_hits'] == 1
+
+    # The same user's next successful search proposes the correction
+    assert tmdb.search_movie("inception", "user-1")[0]['id'] == 27205
+    assert StubTMDbHandler.hits['/3/search/movie'] == 2
+    assert tmdb.corrections.lookup("incepshun") is None
+
+    # A second user making the same correction confirms it
+    assert tmdb.search_movie("incepshun", "user-2")[0] is None
+    assert tmdb.search_movie("Inception", "user-2")[0]['id'] == 27205
+
+    # Anyone sending the failed query now gets the movie by id, without a search
+    for user_id in ("user-3", "user-4"):
+        assert tmdb.search_movie("Incepshun!", user_id)[0]['id'] == 27205
+    assert StubTMDbHandler.hits == {'/3/search/movie': 2, '/3/movie/27205': 1}
+    corrections = tmdb.metrics()['corrections']
+    print(f"Correction metrics: {corrections}")
+    assert corrections['counters'] == {'proposed': 1, 'learned': 1, 'applied': 2}
+
+    # Invalidating the movie drops its search and details entries, and the
+    # correction and its candidate too
+    assert tmdb.invalidate_movie(27205) == 4
+    assert tmdb.corrections.lookup("incepshun") is None
+    server.shutdown()
+
+
+def test_corrections_need_similar_queries():
+    from services.cache import LRUCache, TieredCache
+    from services.search_corrections import DEFAULT_CORRECTION_TTLS, SearchCorrections
+
+    corrections = SearchCorrections(TieredCache(LRUCache(), ttls=DEFAULT_CORRECTION_TTLS), confirmations=1)
+    # Giving up on one movie and asking about another is not a correction
+    corrections.failed('user-1', "alien resurection 5")
+    corrections.resolved('user-1', "inception", 27205)
+    assert corrections.lookup("alien resurection 5") is None
+    # A typo and its fix is
+    corrections.failed('user-1', "the matrx")
+    corrections.resolved('user-1', "the matrix", 603)
+    assert corrections.lookup("the matrx") == 603
+    assert corrections.counters.snapshot() == {'dissimilar': 1, 'learned': 1, 'applied': 1}
+
+
+if __name__ == "__main__":
+    test_retry_after_then_success()
+    test_read_timeout()
+    test_attempt_timeout_capped_by_budget()
+    test_circuit_breaker_fails_fast()
+    test_client_errors_and_the_breaker()
+    test_retry_after_is_honoured()
+    test_cancelled_trial_releases_breaker()
+    test_async_transport()
+    test_non_json_body_is_a_transport_error()
+    test_tmdb_service_against_stub()
+    test_tmdb_warm_up_opens_pooled_connection()
+    test_tmdb_cache_and_invalidation()
+    test_tmdb_singleflight()
+    test_singleflight_shares_errors()
+    test_singleflight_followers_stop_at_their_deadline()
+    test_tmdb_stale_while_revalidate()
+    test_tmdb_prewarm()
+    test_refreshers_share_one_pace()
+    test_refresher_stays_out_of_live_flights()
+    test_tmdb_title_index_exact_skips_search_fuzzy_does_not()
+    test_tmdb_negative_cache_and_corrections()
+    test_corrections_need_similar_queries()
+    print("All transport tests passed!")
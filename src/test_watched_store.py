@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Tests for the watched-movie store: newest-first listing and keyset pages,
+counting only long histories, batched watched-id filtering, the migration
+from per-user documents and the background metadata refresh. Runs
+DatabaseService on a mongomock client, so no MongoDB server is needed.
+"""
+
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import mongomock
+
+from services.db_service import DatabaseService
+from services.message_handler import MessageHandler
+from services.watched_refresher import WatchedRefresher
+
+# pymongo 4.9+ passes a `sort` argument for UpdateOne that mongomock's bulk builder predates
+_add_update = mongomock.collection.BulkOperationBuilder.add_update
+if 'sort' not in _add_update.__code__.co_varnames:
+    mongomock.collection.BulkOperationBuilder.add_update = (
+        lambda self, *args, sort=None, **kwargs: _add_update(self, *args, **kwargs))
+
+
+def make_db() -> DatabaseService:
+    db = DatabaseService(client=mongomock.MongoClient())
+    assert db.ensure_indexes()
+    return db
+
+
+def add_history(db: DatabaseService, user_id: str, count: int) -> None:
+    for movie_id in range(1, count + 1):
+        db.add_watched_movie(user_id, movie_id, {'id': movie_id, 'title': f"Movie {movie_id}",
+                                                 'vote_average': 7.0, 'release_date': '2001-01-01'})
+
+
+class FakeTMDb:
+    """get_movie_details from a dict of movies, counting lookups per id"""
+
+    def __init__(self, movies):
+        self.movies = movies
+        self.lookups = {}
+
+    def get_movie_details(self, movie_id):
+        self.lookups[movie_id] = self.lookups.get(movie_id, 0) + 1
+        movie = self.movies.get(movie_id)
+        return (dict(movie, id=movie_id), "ok") if movie else (None, "not found")
+
+
+class CountingCollection:
+    """Wraps the watched collection and records which methods the store calls"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.calls = []
+
+    def __getattr__(self, name):
+        self.calls.append(name)
+        return getattr(self.collection, name)
+
+
+def test_indexes_created_on_request_only():
+    db = DatabaseService(client=mongomock.MongoClient())
+    assert list(db.watched.index_information()) == []
+    assert db.ensure_indexes()
+    info = db.watched.index_information()
+    assert info['user_id_1_movie_id_1']['unique']
+    assert len(info) == 5
+
+
+def test_listing_pages_newest_first():
+    db = make_db()
+    add_history(db, 'u1', 25)
+    add_history(db, 'u2', 3)
+    # Marking a movie again keeps its place in the history
+    db.add_watched_movie('u1', 1)
+
+    entries, cursor = db.get_watched_page('u1', limit=10)
+    assert [e['id'] for e in entries] == list(range(25, 15, -1))
+    assert entries[0]['title'] == 'Movie 25' and entries[0]['year'] == '2001'
+    seen = [e['id'] for e in entries]
+    while cursor:
+        entries, cursor = db.get_watched_page('u1', limit=10, cursor=cursor)
+        seen += [e['id'] for e in entries]
+    assert seen == list(range(25, 0, -1))
+    assert db.count_watched('u1') == 25 and db.count_watched('nobody') == 0
+    assert db.get_watched_page('u2', limit=10)[1] is None
+
+
+def test_list_watched_counts_only_long_histories():
+    db = make_db()
+    add_history(db, 'short', 4)
+    add_history(db, 'long', 12)
+    db.watched = CountingCollection(db.watched)
+    handler = MessageHandler(container=SimpleNamespace(tmdb_service=None, db_service=db, whatsapp_service=None,
+                                                       openai_service=None, nlp_service=None))
+
+    data = handler._collect_list_watched('short')
+    assert data['watched_count'] == 4 and len(data['watched_movies']) == 4
+    assert 'count_documents' not in db.watched.calls and 'aggregate' not in db.watched.calls
+
+    data = handler._collect_list_watched('long')
+    assert data['watched_count'] == 12 and len(data['watched_movies']) == 10
+    assert db.watched.calls.count('count_documents') == 1
+
+
+def test_watched_ids_in_one_query():
+    db = make_db()
+    add_history(db, 'u1', 5)
+    db.watched = CountingCollection(db.watched)
+    assert db.get_watched_ids('u1', [2, 4, 6, 8]) == {2, 4}
+    assert db.get_watched_ids('u2', [2, 4]) == set()
+    assert db.get_watched_ids('u1', []) == set()
+    # One find per call with candidates, none without
+    assert db.watched.calls == ['find', 'find']
+
+
+def test_migrate_legacy_entries():
+    db = make_db()
+    db.watched_movies.insert_many([
+        {'user_id': 'u1', 'movies': [10, 20, {'id': 30, 'title': 'Stored', 'vote_average': 6.0,
+                                             'watched_at': datetime(2020, 1, 1, tzinfo=timezone.utc)}]},
+        {'user_id': 'u2', 'movies': [20, 10]},
+    ])
+    tmdb = FakeTMDb({10: {'title': 'Ten', 'vote_average': 7.1, 'release_date': '1999-03-31'},
+                     20: {'title': 'Twenty', 'vote_average': 8.0, 'release_date': ''}})
+    assert db.migrate_legacy_entries(tmdb) == 2
+    # Each distinct bare id is looked up once, for every user
+    assert tmdb.lookups == {10: 1, 20: 1}
+    assert db.watched_movies.count_documents({}) == 0
+
+    entries, _ = db.get_watched_page('u1', limit=10)
+    # Bare ids keep their original order, newest (last in the list) first
+    assert [e['id'] for e in entries[:2]] == [20, 10]
+    assert entries[1] == {'id': 10, 'title': 'Ten', 'vote_average': 7.1, 'year': '1999',
+                          'watched_at': entries[1]['watched_at']}
+    assert entries[0]['year'] is None
+    stored = [e for e in entries if e['id'] == 30][0]
+    assert stored['title'] == 'Stored' and stored['watched_at'].year == 2020
+    assert [e['id'] for e in db.get_watched_page('u2', limit=10)[0]] == [10, 20]
+
+    # Running it again finds nothing to move and changes nothing
+    db.watched_movies.insert_one({'user_id': 'u1', 'movies': [10]})
+    assert db.migrate_legacy_entries(tmdb) == 1
+    assert db.count_watched('u1') == 3 and tmdb.lookups == {10: 2, 20: 1}
+
+
+def test_refresher_updates_stale_entries():
+    db = make_db()
+    add_history(db, 'u1', 3)
+    add_history(db, 'u2', 2)
+    # Movies 1 and 2 were last refreshed long ago; movie 3 just now
+    old = datetime.now(timezone.utc) - timedelta(days=30)
+    db.watched.update_many({'movie_id': {'$in': [1, 2]}}, {'$set': {'refreshed_at': old}})
+
+    tmdb = FakeTMDb({1: {'title': 'Movie 1', 'vote_average': 9.5, 'release_date': '2001-01-01'}})
+    refresher = WatchedRefresher(db, tmdb, interval=3600, max_age=7 * 24 * 3600, batch_size=10)
+    # Movie 2 is gone from TMDb: counted, and its entries keep their data
+    assert refresher.refresh_once() == 2
+    assert tmdb.lookups == {1: 1, 2: 1}
+    scores = {(doc['user_id'], doc['movie_id']): doc['vote_average'] for doc in db.watched.find()}
+    assert scores[('u1', 1)] == scores[('u2', 1)] == 9.5
+    assert scores[('u1', 2)] == 7.0 and scores[('u1', 3)] == 7.0
+    assert refresher.metrics() == {'lookup_failures': 1, 'movies_refreshed': 1, 'entries_updated': 2}
+
+    # Refreshed entries are no longer stale, and the failed movie waits out its retry delay
+    tmdb.lookups = {}
+    refresher.refresh_once()
+    assert tmdb.lookups == {}
+
+    # Once the delay is over it is tried again
+    db.watched.update_many({'movie_id': 2}, {'$set': {'refresh_retry_at': old}})
+    refresher.refresh_once()
+    assert tmdb.lookups == {2: 1}
+
+
+if __name__ == "__main__":
+    test_indexes_created_on_request_only()
+    test_listing_pages_newest_first()
+    test_list_watched_counts_only_long_histories()
+    test_watched_ids_in_one_query()
+    test_migrate_legacy_entries()
+    test_refresher_updates_stale_entries()
+    print("All watched store tests passed!")
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Train the local intent classifier from the labelled corpus.
+
+Usage:
+    python train_intent_classifier.py [--corpus data/intent_corpus.jsonl] [--heldout data/intent_heldout.jsonl]
+                                      [--output data/intent_model.npz] [--features 4096] [--epochs 300]
+                                      [--min-confidence 0.7] [--min-accuracy 0.9]
+
+Trains on the whole corpus, then reports accuracy on the frozen held-out file,
+overall and for predictions at or above the confidence NLPService acts on. The
+held-out messages are never trained on and must not appear in the corpus. The
+report is saved with the model; a model whose confident predictions fall below
+--min-accuracy is not written, and NLPService refuses to load one below
+INTENT_MODEL_MIN_ACCURACY.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+from services.cache import normalize_query
+from services.intent_classifier import (DEFAULT_CORPUS_PATH, DEFAULT_HELDOUT_PATH, DEFAULT_MODEL_PATH,
+                                        IntentClassifier, evaluate, heldout_report, load_corpus)
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the local intent classifier")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_PATH)
+    parser.add_argument('--heldout', default=DEFAULT_HELDOUT_PATH, help="Frozen evaluation messages")
+    parser.add_argument('--output', default=os.getenv('INTENT_MODEL', DEFAULT_MODEL_PATH))
+    parser.add_argument('--features', type=int, default=4096, help="Hash buckets")
+    parser.add_argument('--epochs', type=int, default=300)
+    parser.add_argument('--l2', type=float, default=1e-4)
+    parser.add_argument('--min-confidence', type=float,
+                        default=float(os.getenv('INTENT_MODEL_MIN_CONFIDENCE', '0.7')),
+                        help="Probability at which NLPService uses a prediction")
+    parser.add_argument('--min-accuracy', type=float, default=float(os.getenv('INTENT_MODEL_MIN_ACCURACY', '0.9')),
+                        help="Held-out accuracy of confident predictions needed to write the model")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    corpus = load_corpus(args.corpus)
+    heldout_rows = load_corpus(args.heldout)
+    trained_on = {normalize_query(row['text']) for row in corpus}
+    leaked = [row['text'] for row in heldout_rows if normalize_query(row['text']) in trained_on]
+    if leaked:
+        logger.error(f"Held-out messages also in the corpus: {leaked}")
+        sys.exit(1)
+
+    started = time.perf_counter()
+    model = IntentClassifier.train([row['text'] for row in corpus], [row['intent'] for row in corpus],
+                                   n_features=args.features, epochs=args.epochs, l2=args.l2)
+    logger.info(f"Trained on {len(corpus)} messages in {time.perf_counter() - started:.2f}s")
+
+    heldout = heldout_report(evaluate(model, heldout_rows), args.min_confidence)
+    logger.info(f"Held-out accuracy: {heldout['accuracy']:.1%} on {heldout['messages']} messages; "
+                f"{heldout['confident_accuracy']:.1%} on the {heldout['coverage']:.0%} "
+                f"predicted with p >= {args.min_confidence}")
+    if heldout['confident_accuracy'] < args.min_accuracy:
+        logger.error(f"Not saving: confident held-out accuracy is below {args.min_accuracy:.0%}")
+        sys.exit(1)
+
+    model.heldout = heldout
+    model.save(args.output)
+    logger.info(f"Saved {os.path.getsize(args.output)} bytes to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
-from flask import Flask, request, Response
+from flask import Flask, request, Response, jsonify
 from twilio.twiml.messaging_response import MessagingResponse
-from services.message_handler import MessageHandler
+from twilio.request_validator import RequestValidator
+from services.container import get_container, current_container, reset_container
+import atexit
 import logging
+import os
+import threading
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -9,6 +13,45 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+
+_services_started = False
+_services_lock = threading.Lock()
+
+
+def start_services(background: bool = True) -> None:
+    """
+    Build and warm the shared services once for this worker process. Called by
+    the gunicorn post_worker_init hook or the dev entry point, never on import.
+    A failed warm-up is retried in the background until it succeeds.
+    """
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+
+    if background:
+        threading.Thread(target=lambda: get_container().warm_up_until_ready(),
+                         name="service-warmup", daemon=True).start()
+    else:
+        container = get_container()
+        if not container.warm_up():
+            container.warm_up_in_background()
+
+
+atexit.register(reset_container)
+
+BUSY_MESSAGE = "We're handling a lot of messages right now. Please try again in a minute."
+
+
+def _is_valid_twilio_request() -> bool:
+    """Check the X-Twilio-Signature header when TWILIO_VALIDATE_REQUESTS is enabled"""
+    if os.getenv('TWILIO_VALIDATE_REQUESTS', 'false').lower() != 'true':
+        return True
+    validator = RequestValidator(os.getenv('TWILIO_AUTH_TOKEN', ''))
+    signature = request.headers.get('X-Twilio-Signature', '')
+    return validator.validate(request.url, request.form, signature)
+
 @app.route("/test", methods=['GET', 'POST'])
 def test():
     logger.info("Test endpoint hit!")
@@ -25,6 +68,10 @@ def webhook():
         return "Webhook endpoint working!"
     
     # Handle POST requests (actual messages)
+    if not _is_valid_twilio_request():
+        logger.warning("Rejected webhook request with an invalid Twilio signature")
+        return Response("Invalid signature", status=403)
+
     try:
         # Log raw request data
         logger.info(f"Request headers: {dict(request.headers)}")
@@ -36,9 +83,21 @@ def webhook():
         
         logger.info(f"Processing message: '{incoming_msg}' from {sender}")
         
-        # Process the message
-        handler = MessageHandler()
-        response_text, success = handler.handle_message(incoming_msg, sender)
+        container = get_container()
+        reply_queue = container.reply_queue
+
+        if reply_queue is not None:
+            # Acknowledge now, the answer is delivered later via the Twilio REST API
+            if reply_queue.submit(incoming_msg, sender):
+                return str(MessagingResponse())
+            if reply_queue.backpressure != 'inline':
+                resp = MessagingResponse()
+                resp.message(BUSY_MESSAGE)
+                return str(resp)
+            response_text, success = reply_queue.process_inline(incoming_msg, sender)
+        else:
+            # Process the message
+            response_text, success = container.message_handler.handle_message(incoming_msg, sender)
         
         logger.info(f"Handler response: {response_text} (success: {success})")
         
@@ -54,6 +113,31 @@ def webhook():
         resp.message("Sorry, I encountered an error. Please try again.")
         return str(resp)
 
+@app.route("/ready", methods=['GET'])
+def ready():
+    """Readiness probe: healthy only once models and connection pools are warm"""
+    container = current_container()
+    if container is None:
+        return jsonify({'ready': False}), 503
+    status = 200 if container.ready else 503
+    return jsonify(container.health()), status
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    """Runtime metrics such as reply queue wait and processing times"""
+    container = current_container()
+    return jsonify(container.metrics() if container is not None else {})
+
+@app.route("/admin/cache/invalidate/<int:movie_id>", methods=['POST'])
+def invalidate_movie(movie_id: int):
+    """Drop a movie from the TMDb cache tiers (requires the X-Admin-Token header)"""
+    admin_token = os.getenv('ADMIN_TOKEN')
+    if not admin_token or request.headers.get('X-Admin-Token') != admin_token:
+        return Response("Forbidden", status=403)
+    removed = get_container().tmdb_service.invalidate_movie(movie_id)
+    logger.info(f"Invalidated {removed} cache entries for movie {movie_id}")
+    return jsonify({'movie_id': movie_id, 'removed': removed})
+
 @app.route("/", methods=['GET'])
 def home():
     logger.info("Home endpoint hit!")
@@ -66,5 +150,7 @@ if __name__ == "__main__":
     app.logger.addHandler(console_handler)
     
     logger.info("Server starting up...")
-    # Allow external access
-    app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    start_services(background=False)
+    # Allow external access. The reloader would run this block again in a
+    # child process and build a second set of services.
+    app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5000)